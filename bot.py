@@ -9,10 +9,16 @@ Knight_Quiz - نسخه نهایی + سیستم امتیاز جدید
 - !start    : شروع مسابقه‌ای که با !quiz یا !question یا !flags آماده شده
 - !question [n] : مسابقه تشریحی (بدون گزینه) با n سوال
                   منبع سوال‌ها فقط فایل questions.txt است (فرمت: سوال|جواب|دسته|سختی)
-- !top      : بهترین بازیکنان تاریخ
+- !top [n]  : بهترین بازیکنان تاریخ (صفحه‌بندی‌شده، n نفر در هر صفحه)
+- !rank [@player] : رتبه و امتیاز کلی یک بازیکن
 - !resetbot : ریست کردن تمام مسابقه‌های در حال اجرا (برای همه آزاد است)
 - !point @player ±N : کم/زیاد کردن امتیاز کلی بازیکن (فقط Administrator)
 - /help و !help : راهنما
+
+ساخت بانک سوال ترجمه‌شده (بدون اجرای بات):
+    python bot.py --build-bank [n]
+میکروبنچمارک شکستن خط و رندر تصویر سوال:
+    python bot.py --bench-render [n]
 """
 
 import os
@@ -22,12 +28,22 @@ import random
 import io
 import html
 import unicodedata
+import sqlite3
+import threading
+import time
+import functools
+import concurrent.futures
+import hashlib
+import math
+import bisect
+import sys
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple, Callable, Iterator
 
 import discord
 from discord.ext import commands
-import requests
+import aiohttp
 from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
 import arabic_reshaper
@@ -42,39 +58,420 @@ except Exception:
     ARGOS_AVAILABLE = False
 
 ARGOS_EN_FA_TRANSLATOR = None
+# وضعیت لود مدل en→fa:
+# idle (هنوز شروع نشده) / loading / ready / unavailable (نصب نیست) / failed
+ARGOS_STATE = "idle"
+# حداکثر زمانی که دستورها منتظر آماده شدن مترجم می‌مانند (بعد از آن بدون ترجمه ادامه می‌دهند)
+ARGOS_WARMUP_WAIT_SECONDS = 45
+# نسخه‌ی مدل en→fa (جزئی از کلید کش ترجمه؛ با عوض شدن مدل، ترجمه‌های قدیمی استفاده نمی‌شوند)
+ARGOS_MODEL_VERSION = "en-fa-unknown"
+
+# ------------------ کش دو لایه ترجمه (حافظه + دیسک) ------------------
+TRANSLATION_CACHE_PATH = "translation_cache.sqlite3"
+TRANSLATION_CACHE_MEMORY_SIZE = 5000     # حداکثر تعداد ترجمه در LRU حافظه
+TRANSLATION_CACHE_MAX_ROWS = 200000      # حداکثر تعداد ترجمه روی دیسک (قدیمی‌ترین‌ها حذف می‌شوند)
+
+
+def normalize_translation_key(text: str) -> str:
+    """متن انگلیسی را برای کلید کش یکسان می‌کند (یونی‌کد NFC + جمع کردن فاصله‌ها)."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class TranslationCache:
+    """
+    کش ترجمه با دو لایه:
+    - یک LRU در حافظه (سریع، محدود به memory_size)
+    - یک جدول SQLite روی دیسک (ماندگار بعد از ری‌استارت، محدود به max_rows)
+    کلید هر ترجمه = (متن انگلیسی نرمال‌شده، نسخه‌ی مدل Argos).
+    """
+
+    def __init__(self, path: str, memory_size: int, max_rows: int):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+
+        self._memory: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_enabled = True
+        self._writes_since_trim = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self._disk_enabled:
+            return None
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS translations ("
+                    " text_en TEXT NOT NULL,"
+                    " model TEXT NOT NULL,"
+                    " text_fa TEXT NOT NULL,"
+                    " last_used REAL NOT NULL,"
+                    " PRIMARY KEY (text_en, model))"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used)"
+                )
+                conn.commit()
+                self._conn = conn
+            except Exception as e:
+                print(f"[Knight_Quiz] کش ترجمه‌ی دیسکی غیرفعال شد: {e}")
+                self._disk_enabled = False
+                return None
+        return self._conn
+
+    def _remember(self, key: Tuple[str, str], value: str):
+        """اضافه کردن به LRU حافظه (با حذف قدیمی‌ترین در صورت پر بودن)."""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, texts: List[str], model: str) -> Dict[str, str]:
+        """
+        ترجمه‌های موجود در کش را برای لیستی از متن‌های نرمال‌شده برمی‌گرداند.
+        متن‌هایی که در خروجی نیستند miss حساب می‌شوند.
+        """
+        found: Dict[str, str] = {}
+        with self._lock:
+            disk_lookup: List[str] = []
+            for text in texts:
+                key = (text, model)
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    found[text] = value
+                else:
+                    disk_lookup.append(text)
+
+            conn = self._connect() if disk_lookup else None
+            if conn is not None:
+                try:
+                    now = time.time()
+                    for i in range(0, len(disk_lookup), 500):
+                        chunk = disk_lookup[i:i + 500]
+                        placeholders = ",".join("?" * len(chunk))
+                        rows = conn.execute(
+                            f"SELECT text_en, text_fa FROM translations WHERE model = ? AND text_en IN ({placeholders})",
+                            [model] + chunk,
+                        ).fetchall()
+                        for text_en, text_fa in rows:
+                            found[text_en] = text_fa
+                            self._remember((text_en, model), text_fa)
+                            self.disk_hits += 1
+                        if rows:
+                            conn.executemany(
+                                "UPDATE translations SET last_used = ? WHERE text_en = ? AND model = ?",
+                                [(now, text_en, model) for text_en, _ in rows],
+                            )
+                    conn.commit()
+                except Exception as e:
+                    print(f"[Knight_Quiz] خطا در خواندن کش ترجمه: {e}")
+
+            self.misses += sum(1 for t in texts if t not in found)
+        return found
+
+    def get(self, text: str, model: str) -> Optional[str]:
+        return self.get_many([text], model).get(text)
+
+    def put_many(self, items: Dict[str, str], model: str):
+        """ذخیره‌ی ترجمه‌های جدید در هر دو لایه."""
+        if not items:
+            return
+        with self._lock:
+            for text, value in items.items():
+                self._remember((text, model), value)
+
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                now = time.time()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO translations (text_en, model, text_fa, last_used) VALUES (?, ?, ?, ?)",
+                    [(text, model, value, now) for text, value in items.items()],
+                )
+                conn.commit()
+                self._writes_since_trim += len(items)
+                if self._writes_since_trim >= 500:
+                    self._writes_since_trim = 0
+                    self._trim_disk(conn)
+            except Exception as e:
+                print(f"[Knight_Quiz] خطا در نوشتن کش ترجمه: {e}")
+
+    def put(self, text: str, model: str, value: str):
+        self.put_many({text: value}, model)
+
+    def _trim_disk(self, conn: sqlite3.Connection):
+        """اگر تعداد ردیف‌ها از سقف بیشتر شد، کم‌استفاده‌ترین‌ها را حذف می‌کند."""
+        (count,) = conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+        extra = count - self.max_rows
+        if extra <= 0:
+            return
+        conn.execute(
+            "DELETE FROM translations WHERE rowid IN "
+            "(SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+            (extra,),
+        )
+        conn.commit()
+        self.evictions += extra
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_size": len(self._memory),
+            }
+
+    def stats_line(self) -> str:
+        st = self.stats()
+        lookups = st["memory_hits"] + st["disk_hits"] + st["misses"]
+        hit_rate = ((st["memory_hits"] + st["disk_hits"]) / lookups * 100) if lookups else 0.0
+        return (
+            f"hit={st['memory_hits']}+{st['disk_hits']} miss={st['misses']} "
+            f"(~{hit_rate:.1f}٪) evict={st['evictions']} mem={st['memory_size']}"
+        )
+
+
+TRANSLATION_CACHE = TranslationCache(
+    TRANSLATION_CACHE_PATH,
+    memory_size=TRANSLATION_CACHE_MEMORY_SIZE,
+    max_rows=TRANSLATION_CACHE_MAX_ROWS,
+)
+
+
+def _argos_model_version() -> str:
+    """نسخه‌ی بسته‌ی نصب‌شده‌ی en→fa در Argos (برای کلید کش)."""
+    try:
+        import argostranslate.package as argos_package
+        for pkg in argos_package.get_installed_packages():
+            if pkg.from_code == "en" and pkg.to_code == "fa":
+                return f"en-fa-{getattr(pkg, 'package_version', None) or 'unknown'}"
+    except Exception:
+        pass
+    return "en-fa-unknown"
+
+
+_ARGOS_LOAD_LOCK = threading.Lock()
+
+
+def _get_argos_translator():
+    """ترجمه‌گر en→fa را (در صورت نیاز) پیدا می‌کند؛ اگر نصب نباشد None برمی‌گرداند."""
+    global ARGOS_EN_FA_TRANSLATOR, ARGOS_MODEL_VERSION
+
+    if ARGOS_EN_FA_TRANSLATOR is not None:
+        return ARGOS_EN_FA_TRANSLATOR
+
+    # چند ترد آماده‌سازی ممکن است هم‌زمان به اینجا برسند؛ مدل فقط یک بار لود شود
+    with _ARGOS_LOAD_LOCK:
+        if ARGOS_EN_FA_TRANSLATOR is not None:
+            return ARGOS_EN_FA_TRANSLATOR
+        languages = argos_translate.get_installed_languages()
+        from_lang = next((lang for lang in languages if lang.code.startswith("en")), None)
+        to_lang = next((lang for lang in languages if lang.code.startswith("fa")), None)
+        if from_lang and to_lang:
+            ARGOS_EN_FA_TRANSLATOR = from_lang.get_translation(to_lang)
+            ARGOS_MODEL_VERSION = _argos_model_version()
+        else:
+            print("[Knight_Quiz] بسته‌ی زبان en→fa در Argos نصب نشده است؛ متن انگلیسی برگردانده می‌شود.")
+        return ARGOS_EN_FA_TRANSLATOR
 
 
 def translate_en_to_fa(text: str) -> str:
     """
     ترجمه‌ی متن انگلیسی به فارسی با Argos Translate.
+    اول کش (حافظه، بعد دیسک) بررسی می‌شود و فقط در صورت miss، Argos صدا زده می‌شود.
     اگر Argos یا بسته‌ی en→fa نصب نباشد، همان متن اصلی برگردانده می‌شود.
     """
-    global ARGOS_EN_FA_TRANSLATOR
-
     if not text:
         return text
 
-    if not ARGOS_AVAILABLE:
+    if not ARGOS_AVAILABLE or ARGOS_STATE == "loading":
+        # تا وقتی warm-up مدل تمام نشده، منتظر نمی‌مانیم و متن اصلی را برمی‌گردانیم
         return text
 
     try:
-        # اگر هنوز ترجمه‌گر en→fa را نگرفته‌ایم، الان بگیریم
-        if ARGOS_EN_FA_TRANSLATOR is None:
-            languages = argos_translate.get_installed_languages()
-            from_lang = next((lang for lang in languages if lang.code.startswith("en")), None)
-            to_lang = next((lang for lang in languages if lang.code.startswith("fa")), None)
-            if from_lang and to_lang:
-                ARGOS_EN_FA_TRANSLATOR = from_lang.get_translation(to_lang)
-            else:
-                print("[Knight_Quiz] بسته‌ی زبان en→fa در Argos نصب نشده است؛ متن انگلیسی برگردانده می‌شود.")
-                return text
-
-        return ARGOS_EN_FA_TRANSLATOR.translate(text)
+        translator = _get_argos_translator()
+        if translator is None:
+            return text
+
+        key = normalize_translation_key(text)
+        if not key:
+            return text
+
+        cached = TRANSLATION_CACHE.get(key, ARGOS_MODEL_VERSION)
+        if cached is not None:
+            return cached
+
+        translated = translator.translate(key)
+        if translated:
+            TRANSLATION_CACHE.put(key, ARGOS_MODEL_VERSION, translated)
+        return translated or text
     except Exception as e:
         print(f"[Knight_Quiz] خطا در Argos Translate: {e}")
         return text
 
 
+ARGOS_BATCH_SIZE = 32  # حداکثر تعداد جمله در هر فراخوانی دسته‌ای CTranslate2
+# پیام «ترجمه‌ی دسته‌ای در دسترس نیست» فقط یک بار چاپ می‌شود
+_ARGOS_BATCH_FALLBACK_LOGGED = False
+
+
+def _argos_translate_batch(translator, texts: List[str]) -> List[Optional[str]]:
+    """
+    ترجمه‌ی دسته‌ای چند متن با یک فراخوانی translate_batch در CTranslate2.
+    اگر ساختار داخلی Argos مطابق انتظار نبود (نسخه‌ی دیگر یا ترجمه‌ی ترکیبی)،
+    متن‌ها یکی‌یکی با translator.translate ترجمه می‌شوند.
+    خروجی هم‌طول ورودی است؛ برای متنی که ترجمه نشد None برمی‌گردد.
+    """
+    global _ARGOS_BATCH_FALLBACK_LOGGED
+
+    # get_translation در Argos نسخه‌های جدید یک CachedTranslation برمی‌گرداند
+    # که ترجمه‌گر اصلی (PackageTranslation با pkg و translator) در underlying آن است
+    package_translator = getattr(translator, "underlying", translator)
+    pkg = getattr(package_translator, "pkg", None)
+    tokenizer = getattr(pkg, "tokenizer", None)
+    if pkg is not None and tokenizer is not None and not getattr(pkg, "target_prefix", ""):
+        try:
+            if getattr(package_translator, "translator", None) is None:
+                # Argos مدل CTranslate2 را بار اول با یک ترجمه‌ی معمولی می‌سازد
+                package_translator.translate(texts[0])
+            ct2 = package_translator.translator
+            tokenized = [tokenizer.encode(t) for t in texts]
+            results = ct2.translate_batch(
+                tokenized,
+                replace_unknowns=True,
+                max_batch_size=ARGOS_BATCH_SIZE,
+                beam_size=4,
+                num_hypotheses=1,
+                length_penalty=0.2,
+            )
+            outputs: List[Optional[str]] = []
+            for res in results:
+                tokens = res.hypotheses[0] if hasattr(res, "hypotheses") else res[0]["tokens"]
+                outputs.append(tokenizer.decode(tokens).strip() or None)
+            return outputs
+        except Exception as e:
+            print(f"[Knight_Quiz] ترجمه‌ی دسته‌ای ممکن نشد، ترجمه‌ی تکی انجام می‌شود: {e}")
+    elif not _ARGOS_BATCH_FALLBACK_LOGGED:
+        _ARGOS_BATCH_FALLBACK_LOGGED = True
+        print(
+            f"[Knight_Quiz] ترجمه‌گر Argos ({type(package_translator).__name__}) ترجمه‌ی دسته‌ای ندارد؛ "
+            "متن‌ها یکی‌یکی ترجمه می‌شوند."
+        )
+
+    outputs = []
+    for t in texts:
+        try:
+            outputs.append(translator.translate(t) or None)
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در Argos Translate: {e}")
+            outputs.append(None)
+    return outputs
+
+
+def translate_many_en_to_fa(texts: List[str]) -> List[str]:
+    """
+    نسخه‌ی دسته‌ای translate_en_to_fa برای همه‌ی سوال‌ها و گزینه‌های یک مسابقه:
+    - متن‌ها نرمال و تکراری‌ها حذف می‌شوند
+    - هر چه در کش هست از کش خوانده می‌شود
+    - بقیه در چند فراخوانی دسته‌ای به Argos داده می‌شوند
+    - نتیجه به ترتیب ورودی برگردانده می‌شود (متن ترجمه‌نشده = همان متن اصلی)
+    """
+    if not texts or not ARGOS_AVAILABLE or ARGOS_STATE == "loading":
+        return list(texts)
+
+    try:
+        translator = _get_argos_translator()
+    except Exception as e:
+        print(f"[Knight_Quiz] خطا در Argos Translate: {e}")
+        return list(texts)
+    if translator is None:
+        return list(texts)
+
+    keys = [normalize_translation_key(t) if t else "" for t in texts]
+    unique_keys = list(dict.fromkeys(k for k in keys if k))
+
+    translated = TRANSLATION_CACHE.get_many(unique_keys, ARGOS_MODEL_VERSION)
+    missing = [k for k in unique_keys if k not in translated]
+
+    if missing:
+        fresh: Dict[str, str] = {}
+        for i in range(0, len(missing), ARGOS_BATCH_SIZE * 4):
+            chunk = missing[i:i + ARGOS_BATCH_SIZE * 4]
+            for key, value in zip(chunk, _argos_translate_batch(translator, chunk)):
+                if value:
+                    fresh[key] = value
+        TRANSLATION_CACHE.put_many(fresh, ARGOS_MODEL_VERSION)
+        translated.update(fresh)
+
+    return [translated.get(k) or t for t, k in zip(texts, keys)]
+
+
+ARGOS_WARMUP_TASK: Optional[asyncio.Task] = None
+
+
+def warm_up_argos():
+    """
+    مدل en→fa را لود می‌کند و یک ترجمه‌ی آزمایشی انجام می‌دهد
+    (تا CTranslate2 و tokenizer هم گرم شوند). این تابع blocking است و در ترد اجرا می‌شود.
+    """
+    global ARGOS_STATE
+
+    if not ARGOS_AVAILABLE:
+        ARGOS_STATE = "unavailable"
+        return
+
+    ARGOS_STATE = "loading"
+    started = time.perf_counter()
+    try:
+        translator = _get_argos_translator()
+        if translator is None:
+            ARGOS_STATE = "unavailable"
+            return
+        translator.translate("Hello, world.")
+        ARGOS_STATE = "ready"
+        print(f"[Knight_Quiz] مدل Argos en→fa ({ARGOS_MODEL_VERSION}) در {time.perf_counter() - started:.1f} ثانیه لود شد.")
+    except Exception as e:
+        ARGOS_STATE = "failed"
+        print(f"[Knight_Quiz] خطا در لود مدل Argos: {e}")
+
+
+def start_argos_warmup():
+    """warm-up مدل را در پس‌زمینه شروع می‌کند (فقط یک بار)."""
+    global ARGOS_WARMUP_TASK, ARGOS_STATE
+    if ARGOS_WARMUP_TASK is None:
+        if ARGOS_AVAILABLE:
+            ARGOS_STATE = "loading"
+        ARGOS_WARMUP_TASK = asyncio.create_task(asyncio.to_thread(warm_up_argos))
+
+
+async def wait_for_argos(timeout: float = ARGOS_WARMUP_WAIT_SECONDS) -> bool:
+    """
+    تا پایان warm-up (حداکثر timeout ثانیه) صبر می‌کند.
+    اگر warm-up تمام شده باشد یا اصلاً شروع نشده باشد True برمی‌گرداند.
+    """
+    task = ARGOS_WARMUP_TASK
+    if task is None or task.done():
+        return True
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
 if ARGOS_AVAILABLE:
     print("[Knight_Quiz] Argos Translate شناسایی شد و برای همه ترجمه‌ها استفاده می‌شود.")
 else:
@@ -84,9 +481,6 @@ else:
 load_dotenv()
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 
-if not TOKEN or TOKEN == "YOUR_DISCORD_BOT_TOKEN_HERE":
-    raise RuntimeError("❌ لطفاً توکن واقعی بات را داخل فایل .env در متغیر DISCORD_BOT_TOKEN قرار بده.")
-
 # فقط سرور مجاز (برای اینکه بات فقط در سرور خودت باشد)
 # اگر نخواهی محدود باشد، می‌توانی این متغیر را در .env ست نکنی یا 0 بگذاری
 ALLOWED_GUILD_ID = int(os.getenv("ALLOWED_GUILD_ID", "0"))
@@ -103,7 +497,26 @@ bot = commands.Bot(
     help_command=None  # غیرفعال کردن help پیش‌فرض
 )
 
-SCORES_FILE = "scores.json"
+SCORES_FILE = "scores.json"      # فرمت قدیمی امتیازها (فقط برای مهاجرت یک‌باره به SCORES_DB_PATH)
+SCORES_DB_PATH = "scores.sqlite3"
+# امتیازهای نسخه‌های قبلی (بدون تفکیک سرور) به این سرور منتقل می‌شوند
+LEGACY_SCORES_GUILD_ID = int(os.getenv("LEGACY_SCORES_GUILD_ID", str(ALLOWED_GUILD_ID)))
+# امتیازهای سروری که این مدت (ثانیه) استفاده نشده از حافظه خارج می‌شود (و دوباره از دیسک خوانده می‌شود)
+GUILD_SCORES_IDLE_SECONDS = int(os.getenv("GUILD_SCORES_IDLE_SECONDS", "1800"))
+GUILD_SCORES_SWEEP_INTERVAL = 60
+# تغییرهای امتیاز اول در حافظه جمع می‌شوند و هر چند ثانیه یک‌جا روی دیسک نوشته می‌شوند
+SCORE_FLUSH_INTERVAL = float(os.getenv("SCORE_FLUSH_INTERVAL", "5"))
+# اگر تعداد بازیکن‌های در صف نوشتن به این عدد برسد، بدون صبر برای SCORE_FLUSH_INTERVAL نوشته می‌شود
+SCORE_FLUSH_MAX_PENDING = 64
+# هنگام خاموش شدن، نوشتن نهایی چند بار (با این فاصله‌ی ثانیه) تکرار می‌شود تا تغییری گم نشود
+SCORE_FINAL_FLUSH_ATTEMPTS = 3
+SCORE_FINAL_FLUSH_RETRY_DELAY = 1.0
+# وقتی لاگ رویدادهای امتیاز به این اندازه برسد، در snapshot جمع می‌شود
+SCORE_SNAPSHOT_EVERY = 1000
+# تعداد نفرات هر صفحه‌ی !top (پیش‌فرض و سقف) و مدت فعال ماندن دکمه‌های صفحه‌بندی (ثانیه)
+TOP_PAGE_SIZE = 10
+TOP_PAGE_MAX_SIZE = 25
+TOP_VIEW_TIMEOUT = 180
 QUESTIONS_FILE = "questions.txt"  # منبع سوال‌های تشریحی !question
 
 # تایم‌اوت‌ها
@@ -112,6 +525,31 @@ QUESTION_TIMEOUT_SECONDS = 15   # برای سوال‌های تشریحی
 
 DEFAULT_NUM_QUESTIONS = 30
 
+# آماده‌سازی سوال‌ها (ترجمه و رندر) بیرون از event loop، در یک استخر ترد انجام می‌شود
+PREPARE_MAX_WORKERS = max(1, int(os.getenv("PREPARE_MAX_WORKERS", "4")))
+# حداکثر تعداد کانال‌هایی که هم‌زمان در حال آماده‌سازی سوال هستند
+PREPARE_MAX_CONCURRENT = max(1, int(os.getenv("PREPARE_MAX_CONCURRENT", "2")))
+# تعداد تصویرهایی که هم‌زمان برای یک مسابقه رندر می‌شوند (۰ = برابر PREPARE_MAX_WORKERS)؛
+# موازی‌سازی واقعی به تعداد workerهای استخر آماده‌سازی محدود است
+RENDER_PARALLELISM = max(0, int(os.getenv("RENDER_PARALLELISM", "0"))) or PREPARE_MAX_WORKERS
+# حداقل فاصله‌ی بین دو ویرایش امبد لودینگ (برای نخوردن به rate limit دیسکورد)
+PROGRESS_EDIT_INTERVAL = 1.5
+# مسابقه بعد از آماده شدن این تعداد سوال قابل شروع است؛ بقیه هم‌زمان با مسابقه آماده می‌شوند
+PIPELINE_START_AFTER = max(1, int(os.getenv("PIPELINE_START_AFTER", "3")))
+# حداکثر چند سوال جلوتر از سوال در حال پرسیدن آماده نگه داشته می‌شود
+PIPELINE_LOOKAHEAD = max(1, int(os.getenv("PIPELINE_LOOKAHEAD", "3")))
+# تعداد تلاش برای ارسال یک سوال (با خطای موقت دیسکورد) و فاصله‌ی پایه بین تلاش‌ها (ثانیه)
+SEND_ATTEMPTS = 3
+SEND_RETRY_DELAY = 1.0
+
+# بافر سوال‌های کاملاً آماده (ترجمه + تصویر) برای هر سرور
+# اگر تعداد سوال‌های بافر از LOW کمتر شود، در زمان بیکاری تا HIGH پر می‌شود
+PREFETCH_LOW_WATER = max(0, int(os.getenv("PREFETCH_LOW_WATER", "10")))
+PREFETCH_HIGH_WATER = max(PREFETCH_LOW_WATER, int(os.getenv("PREFETCH_HIGH_WATER", "30")))
+PREFETCH_BATCH_SIZE = 5      # تعداد سوالی که در هر دور پر کردن آماده می‌شود
+PREFETCH_IDLE_DELAY = 5      # اگر سرور مشغول آماده‌سازی مسابقه باشد، چند ثانیه صبر شود
+PREFETCH_MAX_IDLE_WAIT = 120  # حداکثر کل زمان صبر برای تمام شدن آماده‌سازی‌ها؛ بعد از آن پر کردن ادامه می‌یابد
+
 EMBED_HEADER_TEXT = "Hollywood Server"
 EMBED_FOOTER = "Dev : Amin Dark Knight 🦇"
 
@@ -137,6 +575,21 @@ QUESTION_FONT_PATH = "question_font.ttf"
 # اندازه فونت سوال‌ها و گزینه‌ها
 QUESTION_FONT_SIZE = 64   # اگر خواستی دو شماره کم شود، بگذار 62
 OPTION_FONT_SIZE = 55     # اگر خواستی دو شماره کم شود، بگذار 53
+# فرمت خروجی تصویرها: jpeg ، progressive (JPEG پیشرونده) یا webp
+# (webp در همان کیفیت تقریباً نصف حجم JPEG است ولی encode آن کندتر است)
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").strip().lower()
+if IMAGE_FORMAT not in ("jpeg", "progressive", "webp"):
+    IMAGE_FORMAT = "jpeg"
+IMAGE_EXT = "webp" if IMAGE_FORMAT == "webp" else "jpg"
+# سقف حجم هر تصویر سوال (کیلوبایت)
+IMAGE_KB_LIMIT = 60
+
+# پرچم‌ها: فایل‌های نرمال‌شده‌ی پرچم به صورت محلی ذخیره و به شکل attachment ارسال می‌شوند
+FLAG_ASSET_DIR = "flag_assets"
+FLAG_IMAGE_SIZE = (480, 320)    # پرچم‌ها با حفظ نسبت داخل این کادر جا می‌شوند
+# FLAG_CARD_MODE: card (پرچم روی question_bg.png) یا plain (فقط خود پرچم)
+FLAG_CARD_MODE = os.getenv("FLAG_CARD_MODE", "card").strip().lower()
+FLAG_CARD_TITLE = "پرچم کدوم کشوره؟"   # متن بالای کارت پرچم
 
 # محدودیت طول سوال و گزینه‌ها (برای جلوگیری از سوال‌های خیلی طولانی)
 MAX_QUESTION_CHARS = 80
@@ -227,25 +680,6 @@ def shape_text(text: str) -> str:
         return text
 
 
-def load_global_scores() -> Dict[int, int]:
-    if os.path.exists(SCORES_FILE):
-        try:
-            with open(SCORES_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return {int(k): int(v) for k, v in data.items()}
-        except Exception:
-            return {}
-    return {}
-
-
-def save_global_scores(scores: Dict[int, int]):
-    try:
-        with open(SCORES_FILE, "w", encoding="utf-8") as f:
-            json.dump(scores, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
-
-
 def make_embed(body: str, color: discord.Color) -> discord.Embed:
     """
     یک Embed می‌سازد که در بالاترین قسمت متن:
@@ -267,16 +701,118 @@ def make_timer_embed(seconds: int) -> discord.Embed:
     return discord.Embed(description=desc, color=color_from_hex(COLOR_QUESTION_EMBED))
 
 
+class LoadingProgress:
+    """
+    امبد لودینگ آماده‌سازی را به‌روز می‌کند؛
+    ویرایش‌های پشت‌سرهم با فاصله‌ی PROGRESS_EDIT_INTERVAL محدود می‌شوند.
+    اگر message برابر None باشد (آماده‌سازی پس‌زمینه) کاری نمی‌کند.
+    """
+
+    def __init__(self, message: Optional[discord.Message]):
+        self.message = message
+        self._last_edit = 0.0
+
+    async def update(self, body: str, force: bool = False):
+        if self.message is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        self._last_edit = now
+        try:
+            await self.message.edit(embed=make_embed(body, color_from_hex(COLOR_QUESTION_EMBED)))
+        except Exception:
+            pass
+
+
+class PreparationPipeline:
+    """
+    سوال‌های آماده‌ی یک مسابقه که به تدریج (در یک تسک پس‌زمینه) پر می‌شوند.
+    - تولیدکننده قبل از هر سوال wait_for_room را صدا می‌زند و هیچ‌وقت بیش از
+      lookahead سوال جلوتر از سوال در حال پرسیدن نمی‌رود (backpressure)
+    - send_next_question با get منتظر سوال بعدی می‌ماند؛ اگر تولید تمام شده باشد None می‌گیرد
+    items همان لیست prepared_questions جلسه است.
+    """
+
+    def __init__(self, items: list, lookahead: int = PIPELINE_LOOKAHEAD):
+        self.items = items
+        self.lookahead = lookahead
+        self.consumed = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        # تولیدکننده منتظر جا (backpressure) است و منابعی مصرف نمی‌کند
+        self._parked = False
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def producing(self) -> bool:
+        """در حال آماده‌سازی واقعی (نه متوقف در انتظار جا)."""
+        return self.running and not self._parked
+
+    def start(self, producer) -> asyncio.Task:
+        self.task = asyncio.create_task(producer)
+        self.task.add_done_callback(self._on_done)
+        return self.task
+
+    def _on_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[Knight_Quiz] خطا در آماده‌سازی پس‌زمینه‌ی سوال‌ها: {task.exception()}")
+        self._changed.set()
+
+    def cancel(self):
+        if self.running:
+            self.task.cancel()
+
+    def put(self, item):
+        self.items.append(item)
+        self._changed.set()
+
+    def room(self) -> int:
+        """چند سوال دیگر می‌تواند آماده شود بدون اینکه از lookahead جلوتر برود."""
+        return self.consumed + self.lookahead - len(self.items)
+
+    async def _wait_change(self):
+        self._changed.clear()
+        await self._changed.wait()
+
+    async def wait_for_room(self):
+        self._parked = True
+        try:
+            while self.room() <= 0:
+                await self._wait_change()
+        finally:
+            self._parked = False
+
+    async def wait_ready(self, count: int):
+        """صبر تا count سوال آماده شود (یا تولید تمام شود)."""
+        while len(self.items) < count and self.running:
+            await self._wait_change()
+
+    async def get(self, index: int):
+        """سوال شماره‌ی index (از صفر)؛ اگر هنوز آماده نیست صبر می‌کند."""
+        if index + 1 > self.consumed:
+            self.consumed = index + 1
+            self._changed.set()
+        while len(self.items) <= index and self.running:
+            await self._wait_change()
+        return self.items[index] if index < len(self.items) else None
+
+
 def build_scores_embed(
     guild: discord.Guild,
     scores: Dict[int, int],
     description_prefix: str,
     color_hex: str,
     order_map: Optional[Dict[int, int]] = None,
+    start_rank: int = 1,
 ) -> discord.Embed:
     """
     ساخت امبد رتبه‌بندی.
     اگر order_map داده شود، در صورت مساوی بودن امتیاز، کسی که زودتر به آن امتیاز رسیده بالاتر است.
+    start_rank: رتبه‌ی اولین نفر (برای صفحه‌های بعدی !top).
     نفرات ۱، ۲، ۳ با مدال نمایش داده می‌شوند.
     از نفر چهارم به بعد عدد + خط تیره.
     هر بازیکن در دو خط:
@@ -294,7 +830,7 @@ def build_scores_embed(
         sorted_scores = sorted(scores.items(), key=sort_key)
 
         lines = []
-        for idx, (user_id, score) in enumerate(sorted_scores, start=1):
+        for idx, (user_id, score) in enumerate(sorted_scores, start=start_rank):
             member = guild.get_member(user_id)
             if member:
                 mention = member.mention
@@ -324,6 +860,93 @@ def build_scores_embed(
     return make_embed(body, color_from_hex(color_hex))
 
 
+# ------------------ اجرای کارهای سنگین بیرون از event loop ------------------
+_PREPARE_EXECUTOR: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_PREPARE_SEMAPHORE: Optional[asyncio.Semaphore] = None
+
+
+def get_prepare_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    استخر مشترک آماده‌سازی (ترد).
+    تردها وضعیت مترجم (ARGOS_STATE)، کش ترجمه و کش تصویرها را با بقیه‌ی بات شریک‌اند؛
+    استخر پروسس هر کدام را جدا و از لحظه‌ی fork کپی می‌کرد و از هم عقب می‌افتادند.
+    """
+    global _PREPARE_EXECUTOR
+    if _PREPARE_EXECUTOR is None:
+        _PREPARE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=PREPARE_MAX_WORKERS,
+            thread_name_prefix="knight-prepare",
+        )
+    return _PREPARE_EXECUTOR
+
+
+def get_prepare_semaphore() -> asyncio.Semaphore:
+    """سقف تعداد کانال‌هایی که هم‌زمان سوال آماده می‌کنند."""
+    global _PREPARE_SEMAPHORE
+    if _PREPARE_SEMAPHORE is None:
+        _PREPARE_SEMAPHORE = asyncio.Semaphore(PREPARE_MAX_CONCURRENT)
+    return _PREPARE_SEMAPHORE
+
+
+async def run_blocking(func, *args):
+    """
+    اجرای یک کار CPU-bound (ترجمه، رندر) در استخر آماده‌سازی.
+    اگر تسک صدا زننده cancel شود، کاری که هنوز شروع نشده هم لغو می‌شود.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_prepare_executor(), functools.partial(func, *args))
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedImage:
+    """
+    تصویر آماده‌ی یک سوال به صورت بایت‌های فشرده (تغییرناپذیر).
+    discord.File یک‌بار مصرف است؛ برای همین فقط موقع ارسال با to_file ساخته می‌شود
+    و همین تصویر را می‌شود دوباره (retry یا کانال دیگر) فرستاد.
+    """
+    data: bytes
+    filename: str
+
+    def to_file(self) -> discord.File:
+        return discord.File(io.BytesIO(self.data), filename=self.filename)
+
+
+def prepared_image(data: Optional[bytes], filename: str) -> Optional[PreparedImage]:
+    """PreparedImage از بایت‌های تصویر (یا None اگر تصویری نیست)."""
+    if data is None:
+        return None
+    return PreparedImage(data, filename)
+
+
+async def send_with_image(
+    channel: discord.abc.Messageable,
+    embed: discord.Embed,
+    image: Optional[PreparedImage],
+    view: Optional[discord.ui.View] = None,
+    attempts: int = SEND_ATTEMPTS,
+) -> discord.Message:
+    """
+    ارسال امبد همراه تصویر (attachment) سوال.
+    برای هر تلاش یک discord.File تازه ساخته می‌شود، پس خطای موقت دیسکورد (5xx / شبکه) دوباره امتحان می‌شود.
+    """
+    kwargs = {}
+    if view is not None:
+        kwargs["view"] = view
+    if image is not None:
+        embed.set_image(url=f"attachment://{image.filename}")
+
+    for attempt in range(1, attempts + 1):
+        try:
+            if image is None:
+                return await channel.send(embed=embed, **kwargs)
+            return await channel.send(embed=embed, file=image.to_file(), **kwargs)
+        except (discord.DiscordServerError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt >= attempts:
+                raise
+            print(f"[Knight_Quiz] ارسال سوال ناموفق بود (تلاش {attempt}/{attempts}): {e}")
+            await asyncio.sleep(SEND_RETRY_DELAY * attempt)
+
+
 def _load_question_font(size: int) -> ImageFont.FreeTypeFont:
     """
     تلاش می‌کند فونت اختصاصی (question_font.ttf) را لود کند.
@@ -342,27 +965,223 @@ def _load_question_font(size: int) -> ImageFont.FreeTypeFont:
     return ImageFont.load_default()
 
 
+class RenderContext:
+    """
+    منابع مشترک رندر: پس‌زمینه یک بار decode می‌شود و برای هر تصویر یک کپی RGBA از
+    نسخه‌ی دست‌نخورده داده می‌شود؛ فونت‌ها برای هر اندازه کش می‌شوند.
+    اگر question_bg.png یا question_font.ttf عوض شوند (mtime/size)، همه چیز دوباره لود می‌شود.
+    فونت‌ها برای هر ترد جدا نگه داشته می‌شوند، چون شیء FreeType بین تردها امن نیست.
+    """
+
+    def __init__(self, bg_path: str, font_path: str):
+        self.bg_path = bg_path
+        self.font_path = font_path
+        self._lock = threading.Lock()
+        self._bg: Optional[Image.Image] = None
+        self._bg_sig = None
+        self._font_generation = 0
+        self._font_sig = None
+        self._local = threading.local()
+        self._fingerprint = ""
+        self._fingerprint_sig = None
+
+    @staticmethod
+    def _signature(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def background(self) -> Optional[Image.Image]:
+        """کپی قابل‌ویرایش از پس‌زمینه (RGBA)، یا None اگر فایل نیست/خراب است."""
+        sig = self._signature(self.bg_path)
+        if sig is None:
+            return None
+        with self._lock:
+            if sig != self._bg_sig:
+                try:
+                    with Image.open(self.bg_path) as img:
+                        self._bg = img.convert("RGBA")
+                except Exception:
+                    self._bg = None
+                self._bg_sig = sig
+            bg = self._bg
+        return bg.copy() if bg is not None else None
+
+    def font(self, size: int) -> ImageFont.FreeTypeFont:
+        """فونت سوال در اندازه‌ی size (کش‌شده برای این ترد)."""
+        sig = self._signature(self.font_path)
+        changed = False
+        with self._lock:
+            if sig != self._font_sig:
+                changed = self._font_sig is not None
+                self._font_sig = sig
+                self._font_generation += 1
+            generation = self._font_generation
+        if changed:
+            # اندازه‌های کش‌شده مال فونت قبلی‌اند
+            TEXT_MEASURER.clear()
+
+        local = self._local
+        if getattr(local, "generation", None) != generation:
+            local.generation = generation
+            local.fonts = {}
+        font = local.fonts.get(size)
+        if font is None:
+            font = _load_question_font(size)
+            # جزئی از کلید کش TEXT_MEASURER (فونت جدید با همان مسیر کلید جدید می‌گیرد)
+            font.generation = generation
+            local.fonts[size] = font
+        return font
+
+    def fingerprint(self) -> str:
+        """هش محتوای فایل‌های پس‌زمینه و فونت (فقط وقتی فایل‌ها عوض شوند دوباره حساب می‌شود)."""
+        sigs = (self._signature(self.bg_path), self._signature(self.font_path))
+        with self._lock:
+            if sigs != self._fingerprint_sig:
+                h = hashlib.sha1()
+                for path, sig in zip((self.bg_path, self.font_path), sigs):
+                    if sig is None:
+                        h.update(b"-")
+                        continue
+                    with open(path, "rb") as f:
+                        h.update(f.read())
+                self._fingerprint = h.hexdigest()[:16]
+                self._fingerprint_sig = sigs
+            return self._fingerprint
+
+
+RENDER_CONTEXT = RenderContext(QUESTION_BG_PATH, QUESTION_FONT_PATH)
+
+
+# ------------------ اندازه‌گیری و شکل‌دهی متن (با کش) ------------------
+TEXT_STROKE_WIDTH = 3
+TEXT_MEASURE_CACHE_SIZE = 8192
+# اگر تخمین جمعی عرض خط تا این حد به max_width نزدیک باشد، عرض دقیق اندازه‌گیری می‌شود
+WRAP_EXACT_MARGIN = 8
+
+
+class TextMeasurer:
+    """
+    کش شکل‌دهی فارسی (reshape + bidi) برای هر متن و اندازه‌ها برای هر (فونت، متن).
+    فونت‌ها با (مسیر، اندازه، نسخه‌ی فایل فونت در RENDER_CONTEXT) شناخته می‌شوند، پس نسخه‌های جدای هر ترد هم کش مشترک دارند.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._shaped: "OrderedDict[str, str]" = OrderedDict()
+        self._metrics: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _font_key(font) -> tuple:
+        path = getattr(font, "path", None)
+        if path is None:
+            return ("id", id(font))
+        return (path, getattr(font, "size", None), getattr(font, "generation", 0))
+
+    def _get(self, cache: OrderedDict, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def _put(self, cache: OrderedDict, key, value):
+        with self._lock:
+            cache[key] = value
+            if len(cache) > self.max_entries:
+                cache.popitem(last=False)
+
+    def shape(self, text: str) -> str:
+        shaped = self._get(self._shaped, text)
+        if shaped is None:
+            shaped = shape_text(text)
+            self._put(self._shaped, text, shaped)
+        return shaped
+
+    def measure(self, font: ImageFont.FreeTypeFont, text: str) -> Tuple[str, Tuple[int, int, int, int]]:
+        """متن شکل‌داده‌شده و bbox آن (با حاشیه‌ی متن)، همان چیزی که draw.textbbox می‌دهد."""
+        key = (self._font_key(font), "bbox", text)
+        cached = self._get(self._metrics, key)
+        if cached is None:
+            shaped = self.shape(text)
+            bbox = font.getbbox(shaped or " ", mode="L", stroke_width=TEXT_STROKE_WIDTH)
+            cached = (shaped, tuple(bbox))
+            self._put(self._metrics, key, cached)
+        return cached
+
+    def width(self, font: ImageFont.FreeTypeFont, text: str) -> int:
+        bbox = self.measure(font, text)[1]
+        return bbox[2] - bbox[0]
+
+    def advance(self, font: ImageFont.FreeTypeFont, text: str) -> float:
+        """طول پیشروی متن (بدون حاشیه)؛ برای جمع زدن عرض کلمه‌ها."""
+        key = (self._font_key(font), "advance", text)
+        cached = self._get(self._metrics, key)
+        if cached is None:
+            cached = (font.getlength(self.shape(text)),)
+            self._put(self._metrics, key, cached)
+        return cached[0]
+
+    def clear(self):
+        with self._lock:
+            self._shaped.clear()
+            self._metrics.clear()
+
+    def stats_line(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"hit {self.hits}/{total} ({rate:.0f}%), {len(self._shaped)} متن، {len(self._metrics)} اندازه"
+
+
+TEXT_MEASURER = TextMeasurer(TEXT_MEASURE_CACHE_SIZE)
+
+
 def _measure_line(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont) -> int:
     """طول پیکسلی یک خط (بعد از شکل‌دهی فارسی) را برمی‌گرداند."""
-    shaped = shape_text(text)
-    bbox = draw.textbbox((0, 0), shaped, font=font, stroke_width=3)
-    return bbox[2] - bbox[0]
+    return TEXT_MEASURER.width(font, text)
 
 
 def _wrap_text(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list:
-    """متن را بر اساس حداکثر عرض پیکسل به چند خط می‌شکند."""
+    """
+    متن را بر اساس حداکثر عرض پیکسل به چند خط می‌شکند.
+    عرض خط از جمع عرض کلمه‌ها (کش‌شده) تخمین زده می‌شود و فقط نزدیک مرز
+    اندازه‌گیری دقیق انجام می‌شود؛ اندازه‌ی خط‌های نهایی برای رسم دوباره استفاده می‌شود.
+    """
     words = text.split(" ")
     lines = []
     current = ""
+    current_advance = 0.0
+    space = TEXT_MEASURER.advance(font, " ")
+    stroke = 2 * TEXT_STROKE_WIDTH
 
     for word in words:
         test_line = (current + " " + word).strip()
-        width = _measure_line(draw, test_line, font)
-        if width <= max_width or not current:
+        word_advance = TEXT_MEASURER.advance(font, word)
+        test_advance = current_advance + (space if current else 0.0) + word_advance
+        estimate = test_advance + stroke
+
+        if not current or estimate <= max_width - WRAP_EXACT_MARGIN:
+            fits = True
+        elif estimate > max_width + WRAP_EXACT_MARGIN:
+            fits = False
+        else:
+            fits = _measure_line(draw, test_line, font) <= max_width
+
+        if fits:
             current = test_line
+            current_advance = test_advance
         else:
             lines.append(current)
             current = word
+            current_advance = word_advance
 
     if current:
         lines.append(current)
@@ -370,45 +1189,270 @@ def _wrap_text(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFon
     return lines
 
 
-def _compress_to_limit(base_rgb: Image.Image, filename: str, kb_limit: int) -> Optional[discord.File]:
+# کیفیت‌های مجاز برای جستجو (از کم به زیاد)
+ENCODE_QUALITY_LEVELS = list(range(35, 96, 5))
+
+
+class EncodeStats:
+    """
+    آمار encode تصویرها: زمان، حجم، کیفیت انتخاب‌شده و تعداد encode برای هر تصویر.
+    کیفیت انتخاب‌شده‌ی آخر (برای هر فرمت/سقف حجم) پیش‌بینی شروع تصویر بعدی است.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._predicted: Dict[tuple, int] = {}
+        self.images = 0
+        self.encodes = 0
+        self.total_ms = 0.0
+        self.total_bytes = 0
+        self.last_line = ""
+
+    def predicted_level(self, key: tuple) -> int:
+        with self._lock:
+            return self._predicted.get(key, len(ENCODE_QUALITY_LEVELS) - 1)
+
+    def record(self, key: tuple, level: int, encodes: int, elapsed_ms: float, size: int):
+        with self._lock:
+            self._predicted[key] = level
+            self.images += 1
+            self.encodes += encodes
+            self.total_ms += elapsed_ms
+            self.total_bytes += size
+            self.last_line = (
+                f"{key[0]} q={ENCODE_QUALITY_LEVELS[level]} {size / 1024:.1f}KB "
+                f"{elapsed_ms:.1f}ms ({encodes} encode)"
+            )
+
+    def stats_line(self) -> str:
+        if not self.images:
+            return "هنوز تصویری encode نشده"
+        return (
+            f"{self.images} تصویر، میانگین {self.total_bytes / self.images / 1024:.1f}KB و "
+            f"{self.total_ms / self.images:.1f}ms، {self.encodes / self.images:.1f} encode برای هر تصویر "
+            f"(آخری: {self.last_line})"
+        )
+
+
+ENCODE_STATS = EncodeStats()
+
+
+def _encode_image(base_rgb: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if IMAGE_FORMAT == "webp":
+        base_rgb.save(buf, format="WEBP", quality=quality, method=2)
+    else:
+        base_rgb.save(
+            buf,
+            format="JPEG",
+            quality=quality,
+            optimize=True,
+            progressive=(IMAGE_FORMAT == "progressive"),
+        )
+    return buf.getvalue()
+
+
+def _compress_to_limit(base_rgb: Image.Image, kb_limit: int) -> Optional[bytes]:
     """
-    تصویر را به صورت JPEG فشرده می‌کند تا به حدود حجم تعیین شده برسد.
+    تصویر را (با فرمت IMAGE_FORMAT) فشرده می‌کند تا به حدود حجم تعیین شده برسد
+    و بایت‌های فایل را برمی‌گرداند.
+    بیشترین کیفیتی که زیر سقف حجم بماند جستجو می‌شود: شروع از کیفیت تصویر قبلی،
+    قدم‌های نمایی به سمت درست و بعد جستجوی دودویی (معمولاً ۲ تا ۳ encode به جای ۷).
     """
     target_bytes = kb_limit * 1024
-    last_buf: Optional[io.BytesIO] = None
-
-    for quality in [95, 85, 75, 65, 55, 45, 35]:
-        buf = io.BytesIO()
-        base_rgb.save(buf, format="JPEG", quality=quality, optimize=True)
-        size = buf.tell()
-        last_buf = buf
-        if size <= target_bytes:
-            break
+    key = (IMAGE_FORMAT, kb_limit)
+    start = time.perf_counter()
+    results: Dict[int, bytes] = {}
+
+    def fits(level: int) -> bool:
+        if level not in results:
+            results[level] = _encode_image(base_rgb, ENCODE_QUALITY_LEVELS[level])
+        return len(results[level]) <= target_bytes
+
+    top = len(ENCODE_QUALITY_LEVELS) - 1
+    guess = ENCODE_STATS.predicted_level(key)
+    # lo: بالاترین سطحی که می‌دانیم جا می‌شود (-1 یعنی هنوز هیچ)، hi: پایین‌ترین سطحی که می‌دانیم جا نمی‌شود
+    if fits(guess):
+        lo, hi = guess, top + 1
+        step = 1
+        while lo + step <= top and fits(lo + step):
+            lo += step
+            step *= 2
+        hi = min(hi, lo + step)
+    else:
+        lo, hi = -1, guess
+        step = 1
+        while hi - step >= 0 and not fits(hi - step):
+            hi -= step
+            step *= 2
+        lo = max(-1, hi - step)
+        if lo >= 0 and not fits(lo):
+            lo = -1
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid
 
-    if last_buf is None:
-        return None
+    # حتی با کمترین کیفیت جا نشد: همان کمترین کیفیت برگردانده می‌شود
+    level = lo if lo >= 0 else 0
+    fits(level)
+    data = results[level]
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    ENCODE_STATS.record(key, level, len(results), elapsed_ms, len(data))
+    return data
+
+
+# ------------------ کش دیسکی تصویرهای رندرشده ------------------
+RENDER_CACHE_DIR = "render_cache"
+RENDER_CACHE_MAX_BYTES = max(0, int(os.getenv("RENDER_CACHE_MAX_MB", "200"))) * 1024 * 1024
+# با هر تغییر در چیدمان رندرها یک واحد زیاد شود تا تصویرهای قدیمی استفاده نشوند
+RENDER_LAYOUT_VERSION = 1
+
+
+def render_cache_key(kind: str, *content) -> str:
+    """
+    کلید محتوایی یک تصویر: نوع رندر، متن‌ها (با همان ترتیب گزینه‌ها)، هش فایل‌های
+    پس‌زمینه/فونت و ثابت‌های ظاهری (اندازه‌ی فونت‌ها، رنگ‌ها، فرمت و سقف حجم).
+    """
+    style = [
+        RENDER_LAYOUT_VERSION,
+        RENDER_CONTEXT.fingerprint(),
+        QUESTION_FONT_SIZE,
+        OPTION_FONT_SIZE,
+        QUESTION_TEXT_COLOR_HEX,
+        OPTION_TEXT_COLOR_HEX,
+        TEXT_STROKE_COLOR_HEX,
+        TEXT_STROKE_WIDTH,
+        IMAGE_FORMAT,
+        IMAGE_KB_LIMIT,
+    ]
+    payload = json.dumps([kind, style, list(content)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class RenderCache:
+    """
+    کش دیسکی تصویرهای رندرشده (نام فایل = کلید محتوایی) با سقف حجم و حذف LRU.
+    ترتیب LRU در حافظه نگه داشته می‌شود و با mtime فایل‌ها بعد از ری‌استارت بازسازی می‌شود.
+    """
 
-    last_buf.seek(0)
-    return discord.File(last_buf, filename=filename)
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: Optional["OrderedDict[str, int]"] = None   # نام فایل → حجم
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _index(self) -> "OrderedDict[str, int]":
+        if self._entries is None:
+            found = []
+            if os.path.isdir(self.directory):
+                for entry in os.scandir(self.directory):
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        st = entry.stat()
+                        found.append((st.st_mtime, entry.name, st.st_size))
+            found.sort()
+            self._entries = OrderedDict((name, size) for _, name, size in found)
+            self._total = sum(size for _, _, size in found)
+        return self._entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self.max_bytes <= 0:
+            return None
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            entries = self._index()
+            if key not in entries:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._index().pop(key, 0)
+                self._total -= size
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: Optional[bytes]):
+        if self.max_bytes <= 0 or not data:
+            return
+        path = os.path.join(self.directory, key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[Knight_Quiz] خطا در ذخیره‌ی تصویر در کش: {e}")
+            return
+
+        evicted: List[str] = []
+        with self._lock:
+            entries = self._index()
+            self._total += len(data) - entries.pop(key, 0)
+            entries[key] = len(data)
+            while self._total > self.max_bytes and len(entries) > 1:
+                name, size = entries.popitem(last=False)
+                self._total -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats_line(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        count = len(self._entries) if self._entries is not None else 0
+        return f"hit {self.hits}/{total} ({rate:.0f}%), {count} فایل، {self._total / 1024 / 1024:.1f}MB"
 
 
-def render_question_image(question_text: str, options: list) -> Optional[discord.File]:
+RENDER_CACHE = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+
+
+def cached_render(kind: str, content: tuple, render_func, *args) -> Optional[bytes]:
+    """اگر تصویر این محتوا در کش دیسکی هست همان را برمی‌گرداند (بدون Pillow)، وگرنه رندر و ذخیره."""
+    key = render_cache_key(kind, *content)
+    data = RENDER_CACHE.get(key)
+    if data is None:
+        data = render_func(*args)
+        RENDER_CACHE.put(key, data)
+    return data
+
+
+def render_question_image_bytes(question_text: str, options: list) -> Optional[bytes]:
     """
     سوال و گزینه‌ها را روی تصویر question_bg.png رندر می‌کند
-    و به صورت یک فایل JPEG با حداکثر ~60KB برمی‌گرداند.
+    و بایت‌های یک JPEG با حداکثر ~60KB را برمی‌گرداند.
     سوال و گزینه‌ها کمی پایین‌تر نمایش داده می‌شوند.
+    (تصویرهای تکراری از کش دیسکی خوانده می‌شوند.)
     """
-    if not os.path.exists(QUESTION_BG_PATH):
-        return None
+    return cached_render("mc", (question_text, list(options)), _render_question_image_bytes, question_text, options)
 
-    try:
-        base = Image.open(QUESTION_BG_PATH).convert("RGBA")
-    except Exception:
+
+def _render_question_image_bytes(question_text: str, options: list) -> Optional[bytes]:
+    base = RENDER_CONTEXT.background()
+    if base is None:
         return None
 
     draw = ImageDraw.Draw(base)
-    question_font = _load_question_font(QUESTION_FONT_SIZE)
-    option_font = _load_question_font(OPTION_FONT_SIZE)
+    question_font = RENDER_CONTEXT.font(QUESTION_FONT_SIZE)
+    option_font = RENDER_CONTEXT.font(OPTION_FONT_SIZE)
 
     max_width = base.width - 160
     line_spacing = 14  # فاصله خطوط
@@ -442,27 +1486,25 @@ def render_question_image(question_text: str, options: list) -> Optional[discord
         # یک خط خالی اضافی بین هر گزینه
         items.append(("", False))
 
-    shaped_lines = [shape_text(text) for (text, _) in items]
-
-    line_heights = []
-    for (text, is_option), shaped in zip(items, shaped_lines):
-        font = option_font if is_option else question_font
-        bbox = draw.textbbox((0, 0), shaped or " ", font=font, stroke_width=3)
-        line_heights.append(bbox[3] - bbox[1])
+    # شکل‌دهی و اندازه‌ی هر خط از کش (همان‌هایی که موقع شکستن خط‌ها حساب شدند)
+    measured = [
+        TEXT_MEASURER.measure(option_font if is_option else question_font, text)
+        for (text, is_option) in items
+    ]
+    line_heights = [bbox[3] - bbox[1] for (_, bbox) in measured]
 
     total_height = sum(line_heights) + line_spacing * (len(line_heights) - 1)
     # نقطه شروع کمی پایین‌تر
     start_y = max(80, (base.height - total_height) // 3 + 40)
 
     current_y = start_y
-    for (raw_line, is_option), shaped_line, h in zip(items, shaped_lines, line_heights):
+    for (raw_line, is_option), (shaped_line, bbox), h in zip(items, measured, line_heights):
         font = option_font if is_option else question_font
 
         if not raw_line:
             current_y += h + line_spacing
             continue
 
-        bbox = draw.textbbox((0, 0), shaped_line, font=font, stroke_width=3)
         line_width = bbox[2] - bbox[0]
         x = (base.width - line_width) // 2
 
@@ -482,43 +1524,39 @@ def render_question_image(question_text: str, options: list) -> Optional[discord
         current_y += h + line_spacing
 
     base_rgb = base.convert("RGB")
-    return _compress_to_limit(base_rgb, "question.jpg", kb_limit=60)
+    return _compress_to_limit(base_rgb, kb_limit=IMAGE_KB_LIMIT)
 
 
-def render_question_only_image(question_text: str) -> Optional[discord.File]:
+def render_question_only_image_bytes(question_text: str) -> Optional[bytes]:
     """
     فقط خود سوال (بدون گزینه) را در تصویر رندر می‌کند (برای دستور !question).
     سوال کمی پایین‌تر از وسط تصویر قرار می‌گیرد.
+    (تصویرهای تکراری از کش دیسکی خوانده می‌شوند.)
     """
-    if not os.path.exists(QUESTION_BG_PATH):
-        return None
+    return cached_render("open", (question_text,), _render_question_only_image_bytes, question_text)
 
-    try:
-        base = Image.open(QUESTION_BG_PATH).convert("RGBA")
-    except Exception:
+
+def _render_question_only_image_bytes(question_text: str) -> Optional[bytes]:
+    base = RENDER_CONTEXT.background()
+    if base is None:
         return None
 
     draw = ImageDraw.Draw(base)
-    question_font = _load_question_font(QUESTION_FONT_SIZE)
+    question_font = RENDER_CONTEXT.font(QUESTION_FONT_SIZE)
 
     max_width = base.width - 160
     line_spacing = 10
 
     question_lines = _wrap_text(draw, question_text, question_font, max_width)
-    shaped_lines = [shape_text(text) for text in question_lines]
-
-    line_heights = []
-    for shaped in shaped_lines:
-        bbox = draw.textbbox((0, 0), shaped or " ", font=question_font, stroke_width=3)
-        line_heights.append(bbox[3] - bbox[1])
+    measured = [TEXT_MEASURER.measure(question_font, text) for text in question_lines]
+    line_heights = [bbox[3] - bbox[1] for (_, bbox) in measured]
 
     total_height = sum(line_heights) + line_spacing * (len(line_heights) - 1)
     # کمی پایین‌تر از مرکز
     start_y = (base.height - total_height) // 2 + 8
 
     current_y = start_y
-    for shaped_line, h in zip(shaped_lines, line_heights):
-        bbox = draw.textbbox((0, 0), shaped_line, font=question_font, stroke_width=3)
+    for (shaped_line, bbox), h in zip(measured, line_heights):
         line_width = bbox[2] - bbox[0]
         x = (base.width - line_width) // 2
 
@@ -533,73 +1571,269 @@ def render_question_only_image(question_text: str) -> Optional[discord.File]:
         current_y += h + line_spacing
 
     base_rgb = base.convert("RGB")
-    return _compress_to_limit(base_rgb, "question_open.jpg", kb_limit=60)
+    return _compress_to_limit(base_rgb, kb_limit=IMAGE_KB_LIMIT)
 
 
-# ------------------ مدل داده سوال خام و آماده (quiz) ------------------
-@dataclass
-class RawQuizQuestion:
-    source: str           # trivia یا opentdb
-    question_en: str
-    correct_en: str
-    incorrects_en: List[str]
-    family: str           # خانواده‌ی موضوعی (برای کنترل ۲۰٪)
+def normalize_flag_image(data: bytes) -> Optional[bytes]:
+    """
+    تصویر دانلودشده‌ی پرچم را با حفظ نسبت داخل FLAG_IMAGE_SIZE جا می‌دهد
+    و به صورت PNG برمی‌گرداند (تا همه‌ی پرچم‌ها اندازه و فرمت یکسان داشته باشند).
+    """
+    try:
+        img = Image.open(io.BytesIO(data)).convert("RGBA")
+    except Exception:
+        return None
 
+    box_w, box_h = FLAG_IMAGE_SIZE
+    scale = min(box_w / img.width, box_h / img.height)
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    img = img.resize(size, Image.LANCZOS)
 
-@dataclass
-class PreparedQuizQuestion:
-    question_fa: str
-    options_fa: List[str]
-    correct_index: int
-    correct_text_fa: str
-    file: Optional[discord.File]
-    source: str           # منبع (trivia / opentdb)
-    family: str           # خانواده‌ی موضوعی
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
 
 
-# ------------------ مدل داده پرچم‌ها برای !flags ------------------
-@dataclass
-class FlagCountry:
-    name_en: str   # نام انگلیسی کشور
-    name_fa: str   # نام فارسی کشور
-    flag_url: str  # آدرس اینترنتی تصویر پرچم
+def render_flag_card_bytes(flag_path: str) -> Optional[bytes]:
+    """
+    پرچم (فایل نرمال‌شده) را همراه متن سوال روی question_bg.png می‌گذارد
+    (با همان فونت، رنگ و حاشیه‌ی render_question_image_bytes) و JPEG حداکثر ~60KB برمی‌گرداند.
+    (کارت‌های تکراری از کش دیسکی خوانده می‌شوند.)
+    """
+    # نام فایل پرچم هش URL آن است؛ حجم فایل هم در کلید است تا دانلود دوباره کش را باطل کند.
+    # متن عنوان و اندازه‌ی پرچم هم در کلید است تا عوض شدنشان کارت‌های قدیمی را باطل کند
+    try:
+        flag_size = os.path.getsize(flag_path)
+    except OSError:
+        return None
+    content = (os.path.basename(flag_path), flag_size, FLAG_CARD_TITLE, list(FLAG_IMAGE_SIZE))
+    return cached_render("flag", content, _render_flag_card_bytes, flag_path)
 
 
-@dataclass
-class PreparedFlagQuestion:
-    flag_url: str
-    options_fa: List[str]
-    correct_index: int
-    correct_text_fa: str
+def _render_flag_card_bytes(flag_path: str) -> Optional[bytes]:
+    base = RENDER_CONTEXT.background()
+    if base is None:
+        return None
+
+    try:
+        with Image.open(flag_path) as img:
+            flag = img.convert("RGBA")
+    except Exception:
+        return None
+
+    draw = ImageDraw.Draw(base)
+    question_font = RENDER_CONTEXT.font(QUESTION_FONT_SIZE)
+
+    title = shape_text(FLAG_CARD_TITLE)
+    bbox = draw.textbbox((0, 0), title, font=question_font, stroke_width=3)
+    title_w = bbox[2] - bbox[0]
+    title_h = bbox[3] - bbox[1]
+    title_y = max(60, base.height // 8)
+    draw.text(
+        ((base.width - title_w) // 2, title_y),
+        title,
+        font=question_font,
+        fill=hex_to_rgb(QUESTION_TEXT_COLOR_HEX),
+        stroke_width=3,
+        stroke_fill=hex_to_rgb(TEXT_STROKE_COLOR_HEX),
+    )
+
+    # پرچم تا جای ممکن بزرگ، زیر متن سوال، با یک قاب مشکی نازک
+    area_top = title_y + title_h + 50
+    max_w = base.width - 320
+    max_h = base.height - area_top - 80
+    scale = min(max_w / flag.width, max_h / flag.height)
+    flag = flag.resize((max(1, round(flag.width * scale)), max(1, round(flag.height * scale))), Image.LANCZOS)
+
+    x = (base.width - flag.width) // 2
+    y = area_top + (max_h - flag.height) // 2
+    border = 4
+    draw.rectangle(
+        (x - border, y - border, x + flag.width + border - 1, y + flag.height + border - 1),
+        fill=hex_to_rgb(TEXT_STROKE_COLOR_HEX),
+    )
+    base.alpha_composite(flag, (x, y))
+
+    base_rgb = base.convert("RGB")
+    return _compress_to_limit(base_rgb, kb_limit=IMAGE_KB_LIMIT)
+
+
+# ------------------ کلاینت HTTP مشترک (aiohttp با keep-alive) ------------------
+HTTP_TIMEOUT_SECONDS = 10
+HTTP_LIMIT_TOTAL = 20       # حداکثر اتصال هم‌زمان کل
+HTTP_LIMIT_PER_HOST = 4     # حداکثر اتصال هم‌زمان به هر میزبان
+
+_HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """
+    یک ClientSession مشترک برای همه‌ی درخواست‌ها (استفاده‌ی دوباره از اتصال‌ها).
+    با بسته شدن، دفعه‌ی بعد دوباره ساخته می‌شود.
+    """
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT_TOTAL,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=60,
+        )
+        _HTTP_SESSION = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS),
+        )
+    return _HTTP_SESSION
+
+
+async def close_http_session():
+    global _HTTP_SESSION
+    if _HTTP_SESSION is not None and not _HTTP_SESSION.closed:
+        await _HTTP_SESSION.close()
+    _HTTP_SESSION = None
+
+
+async def http_get_bytes(url: str, timeout: float = HTTP_TIMEOUT_SECONDS) -> bytes:
+    """درخواست GET و برگرداندن بدنه‌ی پاسخ به صورت bytes."""
+    session = await get_http_session()
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+async def http_get_json(url: str, params: Optional[Dict[str, object]] = None, timeout: float = HTTP_TIMEOUT_SECONDS):
+    """درخواست GET و برگرداندن JSON (خطای HTTP یا تایم‌اوت به صورت exception بالا می‌رود)."""
+    session = await get_http_session()
+    query = {k: str(v) for k, v in (params or {}).items()}
+    async with session.get(url, params=query, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+        resp.raise_for_status()
+        return await resp.json(content_type=None)
+
+
+# ------------------ مدل داده سوال خام و آماده (quiz) ------------------
+@dataclass
+class RawQuizQuestion:
+    source: str           # trivia یا opentdb
+    question_en: str
+    correct_en: str
+    incorrects_en: List[str]
+    family: str           # خانواده‌ی موضوعی (برای کنترل ۲۰٪)
+    difficulty: str = ""  # easy / medium (اگر منبع گفته باشد)
+
+
+@dataclass(slots=True)
+class PreparedQuizQuestion:
+    question_fa: str
+    options_fa: List[str]
+    correct_index: int
+    correct_text_fa: str
+    image: Optional[PreparedImage]  # اگر None باشد سوال به صورت امبد متنی فرستاده می‌شود
+    source: str           # منبع (trivia / opentdb)
+    family: str           # خانواده‌ی موضوعی
+    content_hash: str = ""  # هش محتوای سوال (برای تاریخچه‌ی سوال‌های پرسیده‌شده)
+
+
+# ------------------ مدل داده پرچم‌ها برای !flags ------------------
+@dataclass
+class FlagCountry:
+    name_en: str   # نام انگلیسی کشور
+    name_fa: str   # نام فارسی کشور
+    flag_url: str  # آدرس اینترنتی تصویر پرچم
+
+
+@dataclass(slots=True)
+class PreparedFlagQuestion:
+    flag_url: str
+    options_fa: List[str]
+    correct_index: int
+    correct_text_fa: str
+    image: Optional[PreparedImage] = None   # تصویر محلی پرچم/کارت سوال (اگر نبود، از flag_url استفاده می‌شود)
 
 
 FLAG_COUNTRIES: List[FlagCountry] = []
 
+# کش محلی لیست کشورها (همراه نام‌های ترجمه‌شده) تا بعد از ری‌استارت دوباره دانلود/ترجمه نشود
+FLAG_CACHE_PATH = "flag_countries.json"
+FLAG_CACHE_TTL_SECONDS = 7 * 24 * 3600   # بعد از این مدت، در پس‌زمینه تازه می‌شود
+FLAG_REFRESH_RETRY_SECONDS = 15 * 60     # اگر تازه کردن ناموفق بود، تا این مدت دوباره تلاش نشود
+
+_FLAG_CACHE_FETCHED_AT = 0.0
+_FLAG_LOAD_LOCK: Optional[asyncio.Lock] = None
+_FLAG_REFRESH_TASK: Optional[asyncio.Task] = None
+_FLAG_REFRESH_NOT_BEFORE = 0.0
+_FLAG_NAME_RETRY_TASK: Optional[asyncio.Task] = None
+
+
+def flag_name_untranslated(country: FlagCountry) -> bool:
+    """نام فارسی هنوز همان نام انگلیسی است (ترجمه آماده نبود)."""
+    return not country.name_fa or country.name_fa == country.name_en
+
+
+def _read_flag_cache() -> Tuple[List[FlagCountry], float]:
+    """لیست کشورها و زمان دریافتشان را از فایل کش می‌خواند (اگر نبود: لیست خالی)."""
+    if not os.path.exists(FLAG_CACHE_PATH):
+        return [], 0.0
+    try:
+        with open(FLAG_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        countries = [
+            FlagCountry(name_en=c["name_en"], name_fa=c.get("name_fa") or c["name_en"], flag_url=c["flag_url"])
+            for c in data.get("countries", [])
+        ]
+        return countries, float(data.get("fetched_at", 0.0))
+    except Exception as e:
+        print(f"[Knight_Quiz] خطا در خواندن کش پرچم‌ها: {e}")
+        return [], 0.0
+
 
-def load_flag_countries() -> List[FlagCountry]:
+def _write_flag_cache(countries: List[FlagCountry], fetched_at: float):
     """
-    یک بار از REST Countries لیست کشورها را می‌گیرد و
-    برای هر کشور: نام انگلیسی، نام فارسی (در صورت وجود) و URL پرچم را ذخیره می‌کند.
-    اگر ترجمه فارسی موجود نباشد، با Argos ترجمه می‌کند (در صورت نصب بودن).
+    نوشتن اتمیک کش (اول فایل موقت، بعد جایگزینی).
+    نام‌های ترجمه‌نشده (همان انگلیسی) ذخیره نمی‌شوند تا بعداً دوباره ترجمه شوند.
     """
-    global FLAG_COUNTRIES
-    if FLAG_COUNTRIES:
-        return FLAG_COUNTRIES
+    data = {
+        "fetched_at": fetched_at,
+        "countries": [
+            {
+                "name_en": c.name_en,
+                "name_fa": None if flag_name_untranslated(c) else c.name_fa,
+                "flag_url": c.flag_url,
+            }
+            for c in countries
+        ],
+    }
+    tmp_path = FLAG_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, FLAG_CACHE_PATH)
+    except Exception as e:
+        print(f"[Knight_Quiz] خطا در نوشتن کش پرچم‌ها: {e}")
+
 
+async def download_flag_countries(previous: List[FlagCountry]) -> List[FlagCountry]:
+    """
+    لیست کشورها را از REST Countries می‌گیرد و
+    برای هر کشور: نام انگلیسی، نام فارسی (در صورت وجود) و URL پرچم را برمی‌گرداند.
+    اگر ترجمه فارسی موجود نباشد، اول از ترجمه‌های قبلی (previous) و بعد با Argos ترجمه می‌کند.
+    در صورت خطا لیست خالی برمی‌گرداند.
+    """
     url = "https://restcountries.com/v3.1/all"
     params = {
         "fields": "name,flags,translations"
     }
 
     try:
-        resp = requests.get(url, params=params, timeout=15)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await http_get_json(url, params=params, timeout=15)
     except Exception as e:
         print(f"[Knight_Quiz] خطا در دریافت پرچم‌ها از REST Countries: {e}")
         return []
 
+    # ترجمه‌هایی که قبلاً انجام شده‌اند دوباره انجام نمی‌شوند
+    known_fa = {c.name_en: c.name_fa for c in previous if c.name_fa and c.name_fa != c.name_en}
+
     countries: List[FlagCountry] = []
+    # کشورهایی که نام فارسی آماده ندارند (یک‌جا با ترجمه‌ی دسته‌ای ترجمه می‌شوند)
+    untranslated: List[int] = []
 
     for item in data:
         try:
@@ -620,22 +1854,404 @@ def load_flag_countries() -> List[FlagCountry]:
                 name_fa = fa_entry.get("common") or fa_entry.get("official")
 
             if not name_fa:
-                # اگر ترجمه آماده نبود، با Argos ترجمه کن (در صورت وجود)
-                name_fa = translate_en_to_fa(name_en) or name_en
+                name_fa = known_fa.get(name_en)
+            if not name_fa:
+                untranslated.append(len(countries))
 
             countries.append(FlagCountry(
                 name_en=name_en,
-                name_fa=name_fa,
+                name_fa=name_fa or name_en,
                 flag_url=flag_url,
             ))
         except Exception:
             continue
 
-    FLAG_COUNTRIES = countries
-    print(f"[Knight_Quiz] {len(FLAG_COUNTRIES)} پرچم از REST Countries لود شد.")
+    if untranslated:
+        # اگر ترجمه آماده نبود، با Argos ترجمه کن (در صورت وجود) — بیرون از event loop
+        names_fa = await run_blocking(translate_many_en_to_fa, [countries[i].name_en for i in untranslated])
+        for i, name_fa in zip(untranslated, names_fa):
+            countries[i].name_fa = name_fa or countries[i].name_en
+
+    return countries
+
+
+async def refresh_flag_countries() -> List[FlagCountry]:
+    """دانلود دوباره‌ی لیست کشورها و به‌روزرسانی حافظه و کش (اگر دانلود موفق بود)."""
+    global FLAG_COUNTRIES, _FLAG_CACHE_FETCHED_AT
+    countries = await download_flag_countries(FLAG_COUNTRIES)
+    if countries:
+        FLAG_COUNTRIES = countries
+        _FLAG_CACHE_FETCHED_AT = time.time()
+        await asyncio.to_thread(_write_flag_cache, countries, _FLAG_CACHE_FETCHED_AT)
+        print(f"[Knight_Quiz] {len(FLAG_COUNTRIES)} پرچم از REST Countries لود شد.")
     return FLAG_COUNTRIES
 
 
+def schedule_flag_refresh():
+    """اگر کش پرچم‌ها قدیمی است، تازه کردنش را در پس‌زمینه شروع می‌کند (فقط یک بار هم‌زمان)."""
+    global _FLAG_REFRESH_TASK
+    now = time.time()
+    if now - _FLAG_CACHE_FETCHED_AT < FLAG_CACHE_TTL_SECONDS or now < _FLAG_REFRESH_NOT_BEFORE:
+        return
+    if _FLAG_REFRESH_TASK is not None and not _FLAG_REFRESH_TASK.done():
+        return
+
+    async def refresh():
+        global _FLAG_REFRESH_NOT_BEFORE
+        # برای ترجمه‌ی نام‌های جدید منتظر مترجم می‌مانیم
+        await wait_for_argos()
+        fetched_before = _FLAG_CACHE_FETCHED_AT
+        await refresh_flag_countries()
+        if _FLAG_CACHE_FETCHED_AT == fetched_before:
+            # REST Countries در دسترس نبود؛ با همان کش قدیمی ادامه می‌دهیم
+            _FLAG_REFRESH_NOT_BEFORE = time.time() + FLAG_REFRESH_RETRY_SECONDS
+
+    _FLAG_REFRESH_TASK = asyncio.create_task(refresh())
+
+
+def schedule_flag_name_retry():
+    """
+    اگر نام فارسی بعضی کشورها ترجمه نشده (مترجم هنوز آماده نبود)،
+    بعد از آماده شدن مترجم ترجمه و در کش ذخیره می‌شوند.
+    """
+    global _FLAG_NAME_RETRY_TASK
+    if not ARGOS_AVAILABLE or not any(flag_name_untranslated(c) for c in FLAG_COUNTRIES):
+        return
+    if _FLAG_NAME_RETRY_TASK is not None and not _FLAG_NAME_RETRY_TASK.done():
+        return
+
+    async def retry():
+        if not await wait_for_argos() or ARGOS_STATE not in ("idle", "ready"):
+            return
+        pending = [c for c in FLAG_COUNTRIES if flag_name_untranslated(c)]
+        names_fa = await run_blocking(translate_many_en_to_fa, [c.name_en for c in pending])
+        translated = 0
+        for country, name_fa in zip(pending, names_fa):
+            if name_fa and name_fa != country.name_en:
+                country.name_fa = name_fa
+                translated += 1
+        if translated:
+            await asyncio.to_thread(_write_flag_cache, FLAG_COUNTRIES, _FLAG_CACHE_FETCHED_AT)
+            print(f"[Knight_Quiz] نام فارسی {translated} کشور بعد از آماده شدن مترجم ترجمه شد.")
+
+    _FLAG_NAME_RETRY_TASK = asyncio.create_task(retry())
+
+
+async def load_flag_countries() -> List[FlagCountry]:
+    """
+    لیست کشورها برای !flags:
+    - اگر در حافظه هست همان (و اگر قدیمی شده، تازه کردن در پس‌زمینه)
+    - وگرنه از فایل کش (حتی اگر قدیمی باشد یا REST Countries در دسترس نباشد)
+    - و فقط اگر کشی وجود ندارد، دانلود مستقیم از REST Countries.
+    """
+    global FLAG_COUNTRIES, _FLAG_CACHE_FETCHED_AT, _FLAG_LOAD_LOCK
+
+    if _FLAG_LOAD_LOCK is None:
+        _FLAG_LOAD_LOCK = asyncio.Lock()
+
+    async with _FLAG_LOAD_LOCK:
+        if not FLAG_COUNTRIES:
+            cached, fetched_at = await asyncio.to_thread(_read_flag_cache)
+            if cached:
+                FLAG_COUNTRIES = cached
+                _FLAG_CACHE_FETCHED_AT = fetched_at
+                print(f"[Knight_Quiz] {len(FLAG_COUNTRIES)} پرچم از کش محلی لود شد.")
+            else:
+                await refresh_flag_countries()
+                schedule_flag_name_retry()
+                return FLAG_COUNTRIES
+
+    schedule_flag_refresh()
+    schedule_flag_name_retry()
+    return FLAG_COUNTRIES
+
+
+# ------------------ فایل‌های محلی پرچم‌ها ------------------
+_FLAG_ASSET_TASK: Optional[asyncio.Task] = None
+
+
+def flag_asset_path(flag_url: str) -> str:
+    """مسیر فایل محلی (نرمال‌شده) پرچم برای یک URL."""
+    name = hashlib.sha1(flag_url.encode("utf-8")).hexdigest()[:20]
+    return os.path.join(FLAG_ASSET_DIR, f"{name}.png")
+
+
+def _store_flag_asset(path: str, data: bytes) -> bool:
+    """نرمال‌سازی و نوشتن اتمیک فایل پرچم (blocking)."""
+    normalized = normalize_flag_image(data)
+    if normalized is None:
+        return False
+    os.makedirs(FLAG_ASSET_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(normalized)
+    os.replace(tmp_path, path)
+    return True
+
+
+async def ensure_flag_asset(flag_url: str) -> Optional[str]:
+    """
+    اگر پرچم قبلاً دانلود شده مسیرش را برمی‌گرداند؛
+    وگرنه یک بار دانلود، نرمال و ذخیره می‌کند. در صورت خطا None.
+    """
+    path = flag_asset_path(flag_url)
+    if os.path.exists(path):
+        return path
+    try:
+        data = await http_get_bytes(flag_url)
+        if await run_blocking(_store_flag_asset, path, data):
+            return path
+    except Exception as e:
+        print(f"[Knight_Quiz] خطا در دانلود پرچم {flag_url}: {e}")
+    return None
+
+
+def schedule_flag_asset_prefetch(countries: List[FlagCountry]):
+    """دانلود همه‌ی پرچم‌هایی که هنوز محلی نیستند، در پس‌زمینه (فقط یک بار هم‌زمان)."""
+    global _FLAG_ASSET_TASK
+    if _FLAG_ASSET_TASK is not None and not _FLAG_ASSET_TASK.done():
+        return
+    missing = [c.flag_url for c in countries if not os.path.exists(flag_asset_path(c.flag_url))]
+    if not missing:
+        return
+
+    async def prefetch():
+        results = await asyncio.gather(*[ensure_flag_asset(url) for url in missing])
+        ok = sum(1 for r in results if r)
+        print(f"[Knight_Quiz] {ok}/{len(missing)} پرچم به صورت محلی ذخیره شد.")
+
+    _FLAG_ASSET_TASK = asyncio.create_task(prefetch())
+
+
+def _read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def prepare_flag_image(flag_url: str) -> Optional[PreparedImage]:
+    """تصویر سوال پرچم برای attachment (کارت روی پس‌زمینه یا خود پرچم، طبق FLAG_CARD_MODE)."""
+    path = await ensure_flag_asset(flag_url)
+    if path is None:
+        return None
+    if FLAG_CARD_MODE == "card":
+        card = await run_blocking(render_flag_card_bytes, path)
+        if card is not None:
+            return prepared_image(card, f"flag.{IMAGE_EXT}")
+    data = await asyncio.to_thread(_read_file_bytes, path)
+    return prepared_image(data, "flag.png")
+
+
+# ------------------ مخزن ایندکس‌دار سوال‌ها ------------------
+# مرز دسته‌های طول متن سوال (بر حسب کاراکتر)
+LENGTH_BUCKET_SHORT = 50
+LENGTH_BUCKET_MEDIUM = MAX_QUESTION_CHARS
+
+
+def question_language(text: str) -> str:
+    """زبان متن سوال: fa اگر حرف فارسی/عربی داشته باشد، وگرنه en."""
+    for ch in text:
+        if "\u0600" <= ch <= "\u06ff" or "\ufb50" <= ch <= "\ufefc":
+            return "fa"
+    return "en"
+
+
+def length_bucket(text: str) -> str:
+    n = len(text)
+    if n <= LENGTH_BUCKET_SHORT:
+        return "short"
+    if n <= LENGTH_BUCKET_MEDIUM:
+        return "medium"
+    return "long"
+
+
+class _BucketSampler:
+    """
+    نمونه‌گیری تصادفی بدون جایگذاری از یک لیست شناسه‌ها، بدون کپی یا shuffle کل لیست
+    (Fisher–Yates تنبل: فقط جابه‌جایی‌ها در یک dict نگه داشته می‌شوند).
+    """
+
+    def __init__(self, ids: List[int]):
+        self.ids = ids
+        self.remaining = len(ids)
+        self._swaps: Dict[int, int] = {}
+
+    def next(self) -> Optional[int]:
+        if self.remaining <= 0:
+            return None
+        j = random.randrange(self.remaining)
+        last = self.remaining - 1
+        picked = self._swaps.get(j, j)
+        self._swaps[j] = self._swaps.get(last, last)
+        self._swaps.pop(last, None)
+        self.remaining -= 1
+        return self.ids[picked]
+
+
+class QuestionIndex:
+    """
+    مخزن سوال‌ها با ایندکس‌های ثانویه روی source, family, difficulty, language و length_bucket.
+    هر نوع سوالی (RawQuizQuestion, BankQuestion, TxtQuestion, ...) را نگه می‌دارد و
+    نمونه‌گیری با سهمیه (مثلاً ۶۰٪ OpenTDB و حداکثر ۲۰٪ برای هر خانواده) را بدون
+    shuffle یا پیمایش کل لیست انجام می‌دهد؛ هزینه‌ی هر نمونه‌گیری به تعداد سوال‌های
+    انتخاب‌شده و تعداد خانواده‌ها بستگی دارد، نه به اندازه‌ی مخزن.
+    """
+
+    FIELDS = ("source", "family", "difficulty", "language", "length_bucket")
+
+    def __init__(self):
+        self.items: list = []
+        self._index: Dict[str, Dict[str, List[int]]] = {field: {} for field in self.FIELDS}
+        self._by_source_family: Dict[Tuple[str, str], List[int]] = {}
+        # (field, value) → سطل (منبع، خانواده) → شناسه‌ها؛ نمونه‌گیری با where بدون پیمایش کل مخزن
+        self._by_field_bucket: Dict[Tuple[str, str], Dict[Tuple[str, str], List[int]]] = {}
+        self._attrs: List[Dict[str, str]] = []
+
+    @classmethod
+    def from_items(cls, items: list, **defaults: str) -> "QuestionIndex":
+        index = cls()
+        for item in items:
+            index.add(item, **defaults)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @staticmethod
+    def _item_attrs(item, defaults: Dict[str, str]) -> Dict[str, str]:
+        text = (
+            getattr(item, "question_fa", None)
+            or getattr(item, "question_en", None)
+            or getattr(item, "question", "")
+        )
+        attrs = {
+            "source": getattr(item, "source", None) or defaults.get("source"),
+            "family": getattr(item, "family", None) or getattr(item, "category", None) or defaults.get("family"),
+            "difficulty": getattr(item, "difficulty", None) or defaults.get("difficulty"),
+            "language": defaults.get("language") or question_language(text),
+            "length_bucket": length_bucket(text),
+        }
+        return {field: (value or "unknown") for field, value in attrs.items()}
+
+    def add(self, item, **defaults: str) -> int:
+        """اضافه کردن یک سوال؛ فیلدهایی که آیتم ندارد از defaults (یا unknown) پر می‌شوند."""
+        item_id = len(self.items)
+        self.items.append(item)
+        attrs = self._item_attrs(item, defaults)
+        self._attrs.append(attrs)
+        bucket = (attrs["source"], attrs["family"])
+        for field in self.FIELDS:
+            self._index[field].setdefault(attrs[field], []).append(item_id)
+            self._by_field_bucket.setdefault((field, attrs[field]), {}).setdefault(bucket, []).append(item_id)
+        self._by_source_family.setdefault(bucket, []).append(item_id)
+        return item_id
+
+    def values(self, field: str) -> List[str]:
+        return list(self._index[field])
+
+    def lookup(self, **criteria: str) -> List[int]:
+        """شناسه‌ی سوال‌هایی که با همه‌ی معیارها (field=value) جور هستند."""
+        lists = [self._index[field].get(value, []) for field, value in criteria.items()]
+        if not lists:
+            return list(range(len(self.items)))
+        lists.sort(key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            other_set = set(other)
+            result = [i for i in result if i in other_set]
+        return list(result)
+
+    def count(self, **criteria: str) -> int:
+        if len(criteria) == 1:
+            ((field, value),) = criteria.items()
+            return len(self._index[field].get(value, []))
+        return len(self.lookup(**criteria))
+
+    def sample(
+        self,
+        total: int,
+        source_quota: Optional[Dict[str, int]] = None,
+        family_cap: Optional[float] = None,
+        where: Optional[Dict[str, str]] = None,
+        is_excluded: Optional[Callable[[object], bool]] = None,
+    ) -> list:
+        """
+        total سوال تصادفی:
+        - source_quota: تعداد هدف از هر منبع (تا جای ممکن رعایت می‌شود)
+        - family_cap: سقف نرم سهم هر خانواده (مثلاً 0.2)
+        - where: فیلتر روی فیلدهای ایندکس (مثلاً {"language": "fa"})
+        - is_excluded: سوال‌هایی که نباید انتخاب شوند
+        اگر سهمیه‌ها باعث کمبود شوند، به ترتیب شُل می‌شوند: اول سهم منبع‌ها، بعد سقف خانواده‌ها.
+        """
+        if total <= 0 or not self.items:
+            return []
+
+        samplers: Dict[Tuple[str, str], _BucketSampler] = {}
+        if where:
+            # هر سطل از کوتاه‌ترین لیست معیارها ساخته می‌شود و فقط همان با بقیه‌ی معیارها چک می‌شود
+            per_field = [self._by_field_bucket.get((field, value), {}) for field, value in where.items()]
+            smallest = min(per_field, key=lambda buckets: sum(map(len, buckets.values())))
+            for key, ids in smallest.items():
+                if len(where) > 1:
+                    ids = [i for i in ids if all(self._attrs[i][f] == v for f, v in where.items())]
+                if ids:
+                    samplers[key] = _BucketSampler(ids)
+        else:
+            for key, ids in self._by_source_family.items():
+                samplers[key] = _BucketSampler(ids)
+
+        max_per_family = max(1, int(total * family_cap)) if family_cap else total
+        family_counts: Dict[str, int] = {}
+        selected: list = []
+
+        def draw(keys: List[Tuple[str, str]], respect_cap: bool) -> bool:
+            # انتخاب یک سوال از بین سطل‌های (منبع، خانواده) با وزن تعداد باقی‌مانده
+            while True:
+                live = [
+                    k for k in keys
+                    if samplers[k].remaining > 0
+                    and (not respect_cap or family_counts.get(k[1], 0) < max_per_family)
+                ]
+                if not live:
+                    return False
+                key = random.choices(live, weights=[samplers[k].remaining for k in live])[0]
+                item = self.items[samplers[key].next()]
+                if is_excluded is not None and is_excluded(item):
+                    continue
+                selected.append(item)
+                family_counts[key[1]] = family_counts.get(key[1], 0) + 1
+                return True
+
+        keys_by_source: Dict[str, List[Tuple[str, str]]] = {}
+        for key in samplers:
+            keys_by_source.setdefault(key[0], []).append(key)
+
+        # فاز ۱: سهم هر منبع + سقف خانواده‌ها (منبع‌ها به نوبت، منبع با سهم بیشتر اول)
+        if source_quota:
+            desired = {src: n for src, n in source_quota.items() if n > 0}
+            order = sorted(desired, key=lambda src: -desired[src])
+            while len(selected) < total:
+                progress = False
+                for src in order:
+                    if desired[src] <= 0 or len(selected) >= total:
+                        continue
+                    if draw(keys_by_source.get(src, []), respect_cap=True):
+                        desired[src] -= 1
+                        progress = True
+                if not progress:
+                    break
+
+        # فاز ۲: کمبود از هر منبعی، با حفظ سقف خانواده‌ها
+        all_keys = list(samplers)
+        while len(selected) < total and draw(all_keys, respect_cap=True):
+            pass
+
+        # فاز ۳: اگر باز هم کم داریم، از سقف خانواده‌ها می‌گذریم که مسابقه حتماً اجرا شود
+        while len(selected) < total and draw(all_keys, respect_cap=False):
+            pass
+
+        return selected
+
+
 # ------------------ مدل سوال‌های txt برای !question ------------------
 @dataclass
 class TxtQuestion:
@@ -645,6 +2261,11 @@ class TxtQuestion:
     difficulty: str
 
 
+def txt_question_key(q: TxtQuestion) -> str:
+    """کلید تاریخچه‌ی یک سوال txt."""
+    return seen_key("txt", q.question, q.answer)
+
+
 def load_txt_questions(path: str) -> List[TxtQuestion]:
     """
     سوال‌ها را از فایل txt با فرمت:
@@ -678,10 +2299,11 @@ def load_txt_questions(path: str) -> List[TxtQuestion]:
 
 
 TXT_QUESTION_BANK: List[TxtQuestion] = load_txt_questions(QUESTIONS_FILE)
+TXT_QUESTION_INDEX = QuestionIndex.from_items(TXT_QUESTION_BANK, source="txt")
 
 
 # ------------------ گرفتن سوال از ۲ منبع برای quiz ------------------
-def fetch_raw_trivia_questions(limit: int) -> List[RawQuizQuestion]:
+async def fetch_raw_trivia_questions(limit: int) -> List[RawQuizQuestion]:
     """
     گرفتن سوال از Trivia API با چند دسته و دو سطح سختی (easy, medium).
     """
@@ -696,9 +2318,7 @@ def fetch_raw_trivia_questions(limit: int) -> List[RawQuizQuestion]:
         "types": "text_choice",
     }
     try:
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await http_get_json(url, params=params)
     except Exception as e:
         print(f"[Knight_Quiz] خطا در Trivia API: {e}")
         return []
@@ -727,248 +2347,1641 @@ def fetch_raw_trivia_questions(limit: int) -> List[RawQuizQuestion]:
             correct_en=correct,
             incorrects_en=incorrect,
             family=family,
+            difficulty=str(item.get("difficulty") or ""),
         ))
     return results
 
 
-def fetch_raw_opentdb_questions(limit: int) -> List[RawQuizQuestion]:
+# ------------------ OpenTDB: توکن نشست + رعایت محدودیت نرخ ------------------
+OPENTDB_API_URL = "https://opentdb.com/api.php"
+OPENTDB_TOKEN_URL = "https://opentdb.com/api_token.php"
+# OpenTDB از هر IP هر ۵ ثانیه فقط یک درخواست قبول می‌کند
+OPENTDB_MIN_INTERVAL = 5.2
+# هر دسته یک درخواست جدا است؛ برای اینکه زمان انتظار زیاد نشود تعداد دسته‌ها محدود است
+OPENTDB_MAX_CATEGORIES = 3
+
+# کدهای پاسخ OpenTDB
+OPENTDB_CODE_SUCCESS = 0
+OPENTDB_CODE_NO_RESULTS = 1
+OPENTDB_CODE_INVALID_PARAMETER = 2
+OPENTDB_CODE_TOKEN_NOT_FOUND = 3
+OPENTDB_CODE_TOKEN_EMPTY = 4
+OPENTDB_CODE_RATE_LIMIT = 5
+
+
+class OpenTDBClient:
     """
-    گرفتن سوال از OpenTDB از چند دسته‌ی رندوم (حداکثر ۷ دسته) با سختی easy/medium.
+    درخواست‌های OpenTDB را پشت سر هم و با فاصله‌ی OPENTDB_MIN_INTERVAL می‌فرستد،
+    کد پاسخ را می‌خواند و از توکن نشست استفاده می‌کند تا سوال تکراری بین مسابقه‌ها نیاید
+    (وقتی توکن تمام شد، ریست می‌شود).
+    """
+
+    def __init__(self):
+        self.token: Optional[str] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._last_request = 0.0
+
+        self.requests_made = 0
+        self.questions_requested = 0
+        self.questions_received = 0
+
+    async def _get(self, url: str, params: Dict[str, object]):
+        """یک درخواست با رعایت فاصله‌ی زمانی از درخواست قبلی."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            wait = self._last_request + OPENTDB_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await http_get_json(url, params=params)
+            finally:
+                self._last_request = time.monotonic()
+                self.requests_made += 1
+
+    async def _request_token(self):
+        try:
+            data = await self._get(OPENTDB_TOKEN_URL, {"command": "request"})
+            self.token = data.get("token") if isinstance(data, dict) else None
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در گرفتن توکن OpenTDB: {e}")
+            self.token = None
+
+    async def _ensure_token(self):
+        """فقط یک توکن گرفته شود حتی اگر چند دسته هم‌زمان درخواست بدهند."""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self.token is None:
+                await self._request_token()
+
+    async def _reset_token(self):
+        if not self.token:
+            await self._request_token()
+            return
+        try:
+            await self._get(OPENTDB_TOKEN_URL, {"command": "reset", "token": self.token})
+            print("[Knight_Quiz] توکن OpenTDB تمام شده بود و ریست شد.")
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در ریست توکن OpenTDB: {e}")
+            self.token = None
+
+    async def fetch(self, category: int, difficulty: str, amount: int) -> List[dict]:
+        """
+        سوال‌های یک دسته را برمی‌گرداند (آیتم‌های خام JSON).
+        - کد ۱ (سوال کافی نیست): با تعداد کمتر دوباره امتحان می‌کند
+        - کد ۳/۴ (توکن نامعتبر/تمام‌شده): توکن جدید یا ریست
+        - کد ۵ (محدودیت نرخ): بعد از فاصله‌ی مجاز دوباره
+        """
+        if self.token is None:
+            await self._ensure_token()
+
+        requested = amount
+        results: List[dict] = []
+        code = None
+        for attempt in range(1, 5):
+            params = {
+                "amount": amount,
+                "type": "multiple",
+                "difficulty": difficulty,
+                "category": category,
+            }
+            if self.token:
+                params["token"] = self.token
+            try:
+                data = await self._get(OPENTDB_API_URL, params)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 429:
+                    print(f"[Knight_Quiz] خطا در OpenTDB (cat={category}): {e}")
+                    break
+                # محدودیت نرخ با HTTP 429 (بدنه‌ی پاسخ همان response_code=5 است)
+                data = {"response_code": OPENTDB_CODE_RATE_LIMIT}
+            except Exception as e:
+                print(f"[Knight_Quiz] خطا در OpenTDB (cat={category}): {e}")
+                break
+            if not isinstance(data, dict):
+                break
+
+            code = data.get("response_code")
+            if code == OPENTDB_CODE_SUCCESS:
+                results = data.get("results", []) or []
+                break
+            if code == OPENTDB_CODE_NO_RESULTS and amount > 1:
+                amount = max(1, amount // 2)
+                continue
+            if code == OPENTDB_CODE_TOKEN_NOT_FOUND:
+                await self._request_token()
+                continue
+            if code == OPENTDB_CODE_TOKEN_EMPTY:
+                await self._reset_token()
+                continue
+            if code == OPENTDB_CODE_RATE_LIMIT:
+                # علاوه بر فاصله‌ی عادی بین درخواست‌ها، هر بار کمی بیشتر صبر می‌کنیم
+                await asyncio.sleep(OPENTDB_MIN_INTERVAL * attempt)
+                continue
+            break
+
+        self.questions_requested += requested
+        self.questions_received += len(results)
+        print(
+            f"[Knight_Quiz] OpenTDB cat={category} ({difficulty}): "
+            f"{requested} درخواست → {len(results)} سوال (code={code})"
+        )
+        return results
+
+    def yield_line(self) -> str:
+        pct = (self.questions_received / self.questions_requested * 100) if self.questions_requested else 0.0
+        return (
+            f"{self.requests_made} درخواست، {self.questions_received}/{self.questions_requested} سوال (~{pct:.0f}٪)"
+        )
+
+
+OPENTDB_CLIENT = OpenTDBClient()
+
+
+async def fetch_raw_opentdb_questions(limit: int) -> List[RawQuizQuestion]:
+    """
+    گرفتن سوال از OpenTDB از چند دسته‌ی رندوم (حداکثر OPENTDB_MAX_CATEGORIES دسته) با سختی easy/medium.
+    درخواست‌ها از OPENTDB_CLIENT رد می‌شوند (محدودیت نرخ + توکن نشست).
     """
     if limit <= 0:
         return []
 
-    results: List[RawQuizQuestion] = []
     if not OPENTDB_CATEGORIES:
-        return results
+        return []
 
-    # حداکثر ۷ دسته‌ی رندوم (برای تنوع موضوعی)
-    cats = random.sample(OPENTDB_CATEGORIES, k=min(7, len(OPENTDB_CATEGORIES)))
-    # تعداد پایه‌ی سوال برای هر دسته (کمی بیشتر برای انعطاف)
-    base_per_cat = max(1, limit // len(cats))
+    # چند دسته‌ی رندوم (برای تنوع موضوعی)
+    cats = random.sample(OPENTDB_CATEGORIES, k=min(OPENTDB_MAX_CATEGORIES, len(OPENTDB_CATEGORIES)))
+    # سهم هر دسته (اندازه‌ی limit را خود فراخواننده با توجه به بازده فیلترها تعیین می‌کند)
+    base_per_cat = max(1, math.ceil(limit / len(cats)))
 
     # برای اینکه هم easy و هم medium داشته باشیم، بین دسته‌ها پخش می‌کنیم
     difficulties = ["easy"] * (len(cats) // 2) + ["medium"] * (len(cats) - len(cats) // 2)
     random.shuffle(difficulties)
 
-    for idx, cat_id in enumerate(cats):
-        amount = base_per_cat * 2  # بیش‌ازحد برای اینکه بعداً بتوانیم فیلتر کنیم
-        amount = min(amount, 50)
-        difficulty = difficulties[idx] if idx < len(difficulties) else random.choice(["easy", "medium"])
+    async def fetch_category(cat_id: int, difficulty: str) -> List[RawQuizQuestion]:
+        amount = min(base_per_cat, 50)
+
+        family = OPENTDB_FAMILY_MAP.get(cat_id, f"opentdb_{cat_id}")
+        found: List[RawQuizQuestion] = []
+        for item in await OPENTDB_CLIENT.fetch(cat_id, difficulty, amount):
+            q = html.unescape(item.get("question", ""))
+            correct = html.unescape(item.get("correct_answer", ""))
+            incorrect = [html.unescape(x) for x in item.get("incorrect_answers", [])]
+            if not q or not correct or len(incorrect) != 3:
+                continue
+            found.append(RawQuizQuestion(
+                source="opentdb",
+                question_en=q,
+                correct_en=correct,
+                incorrects_en=incorrect,
+                family=family,
+                difficulty=difficulty,
+            ))
+        return found
+
+    batches = await asyncio.gather(*[
+        fetch_category(cat_id, difficulties[idx] if idx < len(difficulties) else random.choice(["easy", "medium"]))
+        for idx, cat_id in enumerate(cats)
+    ])
+    print(f"[Knight_Quiz] بازده OpenTDB تا این لحظه: {OPENTDB_CLIENT.yield_line()}")
+    return [rq for batch in batches for rq in batch]
+
+
+def split_source_targets(total: int) -> Dict[str, int]:
+    """سهم هر منبع از total سوال (حدوداً ۴۰٪ Trivia و ۶۰٪ OpenTDB)."""
+    # نسبت‌های هدف
+    trivia_target = max(1, int(round(total * 0.4)))
+    opentdb_target = total - trivia_target
+    if opentdb_target < 1:
+        opentdb_target = 1
+        trivia_target = total - 1
+
+    # برای اینکه مجموع دقیقاً total شود
+    sum_target = trivia_target + opentdb_target
+    if sum_target != total:
+        # تنظیم کوچک اگر گرد کردن باعث اختلاف شده باشد
+        opentdb_target += (total - sum_target)
+
+    return {"trivia": trivia_target, "opentdb": opentdb_target}
+
+
+def filter_english_questions(raw_list: List[RawQuizQuestion]) -> List[RawQuizQuestion]:
+    """فیلتر طول روی متن انگلیسی سوال و گزینه‌ها (قبل از هر ترجمه‌ای)."""
+    filtered: List[RawQuizQuestion] = []
+    for rq in raw_list:
+        if not rq.question_en or len(rq.question_en) > MAX_QUESTION_CHARS * 2:
+            continue
+        options = [rq.correct_en] + rq.incorrects_en
+        if len(options) != 4:
+            continue
+        if any((not opt) or len(opt) > MAX_OPTION_CHARS * 2 for opt in options):
+            continue
+        filtered.append(rq)
+    return filtered
+
+
+def select_balanced_questions(pool_by_source: Dict[str, list], total: int, desired_per_source: Dict[str, int]) -> list:
+    """
+    از استخر سوال‌های هر منبع (هر آیتم باید source و family داشته باشد) total سوال انتخاب می‌کند:
+    - تا جای ممکن به سهم هر منبع احترام می‌گذارد
+    - تلاش می‌کند هیچ خانواده‌ای بیش از ۲۰٪ سوال‌ها نگیرد
+    - اگر محدودیت‌ها باعث کمبود شود، به شکل هوشمند شُل می‌شود.
+    (نمونه‌گیری با سهمیه روی QuestionIndex انجام می‌شود.)
+    """
+    index = QuestionIndex()
+    for src, lst in pool_by_source.items():
+        for q in lst:
+            index.add(q, source=src)
+    return index.sample(total, source_quota=desired_per_source, family_cap=0.2)
+
+
+# ------------------ بازده فیلترها و اندازه‌ی درخواست‌ها ------------------
+# ضریب بیش‌ازحد گرفتن نسبت به سهم هر منبع بین این دو حد می‌ماند
+OVERFETCH_MIN_FACTOR = 1.2
+OVERFETCH_MAX_FACTOR = 3.0
+OVERFETCH_EXTRA = 2             # چند سوال اضافه‌ی ثابت برای نوسان بازده
+YIELD_SMOOTHING = 0.3           # وزن هر مشاهده‌ی جدید در میانگین نمایی بازده
+# بازده اولیه (تا قبل از اولین مشاهده)
+DEFAULT_ENGLISH_YIELD = 0.85
+DEFAULT_TRANSLATION_YIELD = 0.9
+# حداکثر چند دور تکمیلی وقتی بازده کمتر از انتظار بود
+COLLECT_MAX_TOPUP_ROUNDS = 1
+
+
+def _ema(old: Optional[float], value: float) -> float:
+    if old is None:
+        return value
+    return old + YIELD_SMOOTHING * (value - old)
+
+
+class FetchYieldTracker:
+    """
+    بازده فیلترها برای هر منبع، در طول مسابقه‌ها (میانگین نمایی):
+    - english: سهم سوال‌های دریافتی که از فیلتر طول انگلیسی رد می‌شوند
+    - translation: سهم سوال‌های ترجمه‌شده که از فیلتر طول فارسی رد می‌شوند
+    - family_share: سهم هر خانواده از سوال‌های سالم (برای تخمین اثر سقف ۲۰٪ خانواده‌ها)
+    با این اعداد اندازه‌ی هر درخواست تعیین می‌شود، به جای ۳ برابر ثابت.
+    """
+
+    def __init__(self):
+        self.english: Dict[str, float] = {}
+        self.translation: Dict[str, float] = {}
+        self.family_share: Dict[str, Dict[str, float]] = {}
+        # آمار
+        self.requested = 0
+        self.received = 0
+        self.topup_rounds = 0
+
+    def record_fetch(self, source: str, fetched_count: int, passed: List[RawQuizQuestion]):
+        """ثبت نتیجه‌ی یک دریافت (تعداد خام و سوال‌هایی که از فیلتر انگلیسی رد شدند)."""
+        self.received += fetched_count
+        if fetched_count <= 0:
+            return
+        self.english[source] = _ema(self.english.get(source), len(passed) / fetched_count)
+
+        if not passed:
+            return
+        counts: Dict[str, int] = {}
+        for rq in passed:
+            counts[rq.family] = counts.get(rq.family, 0) + 1
+        shares = self.family_share.setdefault(source, {})
+        for family in set(shares) | set(counts):
+            shares[family] = _ema(shares.get(family, 0.0), counts.get(family, 0) / len(passed))
+
+    def record_translation(self, attempted: List[RawQuizQuestion], kept: List["BankQuestion"]):
+        """ثبت نتیجه‌ی ترجمه‌ی یک دسته (سوال‌هایی که فیلتر طول فارسی را رد کردند)."""
+        attempted_by_source: Dict[str, int] = {}
+        kept_by_source: Dict[str, int] = {}
+        for rq in attempted:
+            attempted_by_source[rq.source] = attempted_by_source.get(rq.source, 0) + 1
+        for bq in kept:
+            kept_by_source[bq.source] = kept_by_source.get(bq.source, 0) + 1
+        for source, n in attempted_by_source.items():
+            self.translation[source] = _ema(self.translation.get(source), kept_by_source.get(source, 0) / n)
+
+    def pass_rate(self, source: str) -> float:
+        """سهم سوال‌های خام یک منبع که در نهایت قابل استفاده‌اند."""
+        rate = self.english.get(source, DEFAULT_ENGLISH_YIELD) * self.translation.get(source, DEFAULT_TRANSLATION_YIELD)
+        return max(0.05, rate)
+
+    def _balanced_candidates(self, source: str, need: int, total: int) -> int:
+        """
+        چند سوال سالم لازم است تا با سقف ۲۰٪ خانواده‌ها need سوال قابل انتخاب باشد.
+        اگر با OVERFETCH_MAX_FACTOR هم نشود (خانواده‌های کم)، سقف نرم است و شُل می‌شود.
+        """
+        shares = self.family_share.get(source)
+        if not shares:
+            return need
+        # سهم این منبع از سقف هر خانواده
+        cap = max(1, int(total * 0.2)) * need / total
+        limit = math.ceil(need * OVERFETCH_MAX_FACTOR)
+        for n in range(need, limit + 1):
+            if sum(min(n * share, cap) for share in shares.values()) >= need:
+                return n
+        return need
+
+    def request_size(self, source: str, need: int, total: int) -> int:
+        """اندازه‌ی درخواست از یک منبع برای رسیدن به need سوال قابل استفاده."""
+        if need <= 0:
+            return 0
+        size = math.ceil(self._balanced_candidates(source, need, total) / self.pass_rate(source)) + OVERFETCH_EXTRA
+        low = math.ceil(need * OVERFETCH_MIN_FACTOR)
+        high = math.ceil(need * OVERFETCH_MAX_FACTOR) + OVERFETCH_EXTRA
+        return max(low, min(size, high))
+
+    def expected_usable(self, source: str, passed_count: int) -> int:
+        """تخمین تعداد سوال‌هایی که بعد از ترجمه از این تعداد سوال سالم باقی می‌مانند."""
+        return int(passed_count * self.translation.get(source, DEFAULT_TRANSLATION_YIELD))
+
+    def yield_line(self) -> str:
+        parts = []
+        for source in sorted(set(self.english) | set(self.translation)):
+            parts.append(
+                f"{source}: انگلیسی {self.english.get(source, DEFAULT_ENGLISH_YIELD):.0%}"
+                f" / ترجمه {self.translation.get(source, DEFAULT_TRANSLATION_YIELD):.0%}"
+            )
+        parts.append(f"درخواست {self.requested} / دریافت {self.received} / دور تکمیلی {self.topup_rounds}")
+        return " | ".join(parts)
+
+
+FETCH_YIELD = FetchYieldTracker()
+
+
+async def collect_raw_mc_questions(
+    total: int,
+    exclude_hashes: Optional[set] = None,
+    guild_id: Optional[int] = None,
+) -> List[RawQuizQuestion]:
+    """
+    گرفتن سوال‌های خام انگلیسی از ۲ منبع با این ویژگی‌ها:
+    - حدوداً ۴۰٪ Trivia ، ۶۰٪ OpenTDB (در حد امکان)
+    - فیلتر طول روی متن انگلیسی (سوال و گزینه‌ها)
+    - تلاش برای اینکه هیچ خانواده‌ای بیش از ۲۰٪ سوال‌ها نگیرد
+    - اگر محدودیت‌ها باعث کمبود شود، مسابقه لغو نمی‌شود و به شکل هوشمند شُل می‌شود.
+    اندازه‌ی درخواست‌ها از روی بازده فیلترها (FETCH_YIELD) تعیین می‌شود و فقط وقتی
+    بازده کم باشد یک دور تکمیلی گرفته می‌شود. exclude_hashes: سوال‌هایی که نباید برگردند.
+    سوال‌هایی که اخیراً در سرور guild_id پرسیده شده‌اند همین‌جا (قبل از ترجمه) حذف می‌شوند.
+    """
+    if total <= 0:
+        return []
+
+    targets = split_source_targets(total)
+    fetchers = {
+        "trivia": fetch_raw_trivia_questions,
+        "opentdb": fetch_raw_opentdb_questions,
+    }
+    pool_by_source: Dict[str, List[RawQuizQuestion]] = {src: [] for src in fetchers}
+    seen = set(exclude_hashes or ())
+
+    async def fetch_round(sizes: Dict[str, int]) -> List[str]:
+        # هر دو منبع هم‌زمان دریافت می‌شوند (زمان کل ≈ کندترین درخواست)
+        sources = [src for src in fetchers if sizes.get(src, 0) > 0]
+        results = await asyncio.gather(*[fetchers[src](sizes[src]) for src in sources])
+        answered: List[str] = []
+        for src, raw_all in zip(sources, results):
+            FETCH_YIELD.requested += sizes[src]
+            fresh: List[RawQuizQuestion] = []
+            for rq in raw_all:
+                h = question_content_hash(rq.question_en, rq.correct_en)
+                if h in seen:
+                    continue
+                seen.add(h)
+                if SEEN_HISTORY.contains(guild_id, h):
+                    continue
+                fresh.append(rq)
+            passed = filter_english_questions(fresh)
+            FETCH_YIELD.record_fetch(src, len(raw_all), passed)
+            pool_by_source[src].extend(passed)
+            if raw_all:
+                answered.append(src)
+        return answered
+
+    answered = await fetch_round({
+        src: FETCH_YIELD.request_size(src, targets[src], total) for src in fetchers
+    })
+
+    # دور تکمیلی فقط اگر بازده کمتر از انتظار بود (و فقط از منابعی که جواب داده‌اند)
+    for _ in range(COLLECT_MAX_TOPUP_ROUNDS):
+        expected = sum(FETCH_YIELD.expected_usable(src, len(pool)) for src, pool in pool_by_source.items())
+        shortfall = total - expected
+        if shortfall <= 0 or not answered:
+            break
+        if len(answered) == len(fetchers):
+            shares = split_source_targets(shortfall)
+        else:
+            shares = {answered[0]: shortfall}
+        FETCH_YIELD.topup_rounds += 1
+        answered = await fetch_round({
+            src: FETCH_YIELD.request_size(src, n, total) for src, n in shares.items()
+        })
+
+    print(f"[Knight_Quiz] بازده فیلترها: {FETCH_YIELD.yield_line()}")
+    return select_balanced_questions(pool_by_source, total, targets)
+
+
+# ------------------ بانک سوال‌های ترجمه‌شده (آفلاین) ------------------
+QUESTION_BANK_PATH = "question_bank.sqlite3"
+# اگر تعداد سوال‌های هنوز استفاده‌نشده‌ی بانک کمتر از این شد، در پس‌زمینه پر می‌شود
+QUESTION_BANK_MIN_FRESH = 90
+QUESTION_BANK_TOPUP_SIZE = 150
+
+
+@dataclass
+class BankQuestion:
+    source: str
+    family: str
+    question_en: str
+    correct_en: str
+    incorrects_en: List[str]
+    question_fa: str
+    correct_fa: str           # ترجمه‌ی گزینه‌ی درست
+    incorrects_fa: List[str]  # ترجمه‌ی گزینه‌های غلط (هم‌ترتیب با incorrects_en)
+    difficulty: str = ""      # سختی (اگر منبع گفته باشد)
+
+
+def question_content_hash(question_en: str, correct_en: str) -> str:
+    """هش محتوای سوال (متن نرمال‌شده‌ی سوال + جواب) برای تشخیص تکراری‌ها."""
+    key = normalize_translation_key(question_en).casefold() + "\x1f" + normalize_translation_key(correct_en).casefold()
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def translate_raw_questions(raw_list: List[RawQuizQuestion]) -> List[BankQuestion]:
+    """
+    سوال‌های خام را (سوال + ۴ گزینه) با یک ترجمه‌ی دسته‌ای به فارسی برمی‌گرداند.
+    سوال‌هایی که ترجمه‌ی یکی از گزینه‌هایشان از MAX_OPTION_CHARS بلندتر شود حذف می‌شوند.
+    این تابع blocking است.
+    """
+    texts_en: List[str] = []
+    for raw in raw_list:
+        texts_en.append(raw.question_en)
+        texts_en.append(raw.correct_en)
+        texts_en.extend(raw.incorrects_en)
+    texts_fa = translate_many_en_to_fa(texts_en)
+
+    results: List[BankQuestion] = []
+    for i, raw in enumerate(raw_list):
+        chunk = texts_fa[i * 5:i * 5 + 5]
+        question_fa = chunk[0] or raw.question_en
+        options_fa = [
+            opt_fa or opt_en
+            for opt_fa, opt_en in zip(chunk[1:], [raw.correct_en] + list(raw.incorrects_en))
+        ]
+        # اگر ترجمه‌ی گزینه‌ای خیلی طولانی شود، ردش می‌کنیم
+        if any(len(opt_fa) > MAX_OPTION_CHARS for opt_fa in options_fa):
+            continue
+        results.append(BankQuestion(
+            source=raw.source,
+            family=raw.family,
+            question_en=raw.question_en,
+            correct_en=raw.correct_en,
+            incorrects_en=list(raw.incorrects_en),
+            question_fa=question_fa,
+            correct_fa=options_fa[0],
+            incorrects_fa=options_fa[1:],
+            difficulty=raw.difficulty,
+        ))
+    return results
+
+
+def shuffle_bank_options(bq: BankQuestion) -> Tuple[List[str], int]:
+    """گزینه‌های فارسی را به ترتیب تصادفی برمی‌گرداند + اندیس گزینه‌ی درست."""
+    options_fa = [bq.correct_fa] + list(bq.incorrects_fa)
+    order = list(range(len(options_fa)))
+    random.shuffle(order)
+    return [options_fa[i] for i in order], order.index(0)
+
+
+class QuestionBank:
+    """
+    بانک محلی سوال‌های چندگزینه‌ای ترجمه‌شده (SQLite) با ایندکس روی منبع و خانواده.
+    !quiz اول از اینجا سوال برمی‌دارد و فقط برای جبران کمبود سراغ شبکه می‌رود.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mc_questions ("
+                " id INTEGER PRIMARY KEY,"
+                " content_hash TEXT NOT NULL UNIQUE,"
+                " source TEXT NOT NULL,"
+                " family TEXT NOT NULL,"
+                " question_en TEXT NOT NULL,"
+                " correct_en TEXT NOT NULL,"
+                " incorrects_en TEXT NOT NULL,"
+                " question_fa TEXT NOT NULL,"
+                " correct_fa TEXT NOT NULL,"
+                " incorrects_fa TEXT NOT NULL,"
+                " model TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " used_count INTEGER NOT NULL DEFAULT 0,"
+                " last_used REAL NOT NULL DEFAULT 0,"
+                " difficulty TEXT NOT NULL DEFAULT '')"
+            )
+            # بانک‌های ساخته‌شده با نسخه‌ی قبلی ستون difficulty ندارند
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(mc_questions)")}
+            if "difficulty" not in columns:
+                conn.execute("ALTER TABLE mc_questions ADD COLUMN difficulty TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_mc_source_family ON mc_questions(source, family)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_mc_source_used ON mc_questions(source, used_count)")
+            # برای count(fresh_only) بدون پیمایش کل جدول
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_mc_used ON mc_questions(used_count)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def known_hashes(self, hashes: List[str]) -> set:
+        """از بین هش‌های داده‌شده، آن‌هایی که در بانک هستند."""
+        if not hashes:
+            return set()
+        found = set()
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT content_hash FROM mc_questions WHERE content_hash IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                found.update(h for (h,) in rows)
+        return found
+
+    def add_many(self, items: List[BankQuestion], mark_used: bool = False) -> int:
+        """
+        سوال‌های ترجمه‌شده را اضافه می‌کند (تکراری‌ها نادیده گرفته می‌شوند).
+        سوال‌هایی که ترجمه نشده‌اند (متن سوال همان انگلیسی است) ذخیره نمی‌شوند.
+        تعداد سوال‌های جدید را برمی‌گرداند.
+        """
+        rows = []
+        now = time.time()
+        for bq in items:
+            if bq.question_fa == bq.question_en:
+                continue
+            rows.append((
+                question_content_hash(bq.question_en, bq.correct_en),
+                bq.source,
+                bq.family,
+                bq.question_en,
+                bq.correct_en,
+                json.dumps(bq.incorrects_en, ensure_ascii=False),
+                bq.question_fa,
+                bq.correct_fa,
+                json.dumps(bq.incorrects_fa, ensure_ascii=False),
+                ARGOS_MODEL_VERSION,
+                now,
+                1 if mark_used else 0,
+                now if mark_used else 0,
+                bq.difficulty,
+            ))
+        if not rows:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO mc_questions (content_hash, source, family, question_en, correct_en,"
+                " incorrects_en, question_fa, correct_fa, incorrects_fa, model, created_at, used_count, last_used,"
+                " difficulty) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+            return conn.total_changes - before
+
+    def _candidate_rows(self, conn: sqlite3.Connection, src: str, limit: int) -> Iterator[tuple]:
+        """
+        کاندیدهای منبع src، اول از کم‌استفاده‌ترین طبقه‌ی used_count.
+        از هر طبقه یک پنجره از یک id تصادفی (با دور زدن به ابتدای طبقه) خوانده می‌شود؛
+        همه‌ی پرس‌وجوها روی ایندکس (source, used_count) هستند و کل بانک مرتب نمی‌شود.
+        """
+        tier = -1
+        while limit > 0:
+            (tier,) = conn.execute(
+                "SELECT MIN(used_count) FROM mc_questions WHERE source = ? AND used_count > ?",
+                (src, tier),
+            ).fetchone()
+            if tier is None:
+                return
+            (low,) = conn.execute(
+                "SELECT MIN(id) FROM mc_questions WHERE source = ? AND used_count = ?", (src, tier)
+            ).fetchone()
+            (high,) = conn.execute(
+                "SELECT MAX(id) FROM mc_questions WHERE source = ? AND used_count = ?", (src, tier)
+            ).fetchone()
+            start = random.randint(low, high)
+            for condition in ("id >= ?", "id < ?"):
+                rows = conn.execute(
+                    "SELECT content_hash, source, family, question_en, correct_en, incorrects_en,"
+                    " question_fa, correct_fa, incorrects_fa, difficulty FROM mc_questions"
+                    f" WHERE source = ? AND used_count = ? AND {condition} ORDER BY id LIMIT ?",
+                    (src, tier, start, limit),
+                ).fetchall()
+                limit -= len(rows)
+                yield from rows
+                if limit <= 0:
+                    return
+
+    def draw(self, total: int, is_excluded: Optional[Callable[[str], bool]] = None) -> List[BankQuestion]:
+        """
+        total سوال با همان قواعد تعادل منبع/خانواده برمی‌دارد
+        (کم‌استفاده‌ترین سوال‌ها اولویت دارند) و آن‌ها را استفاده‌شده علامت می‌زند.
+        is_excluded(content_hash): سوال‌هایی که نباید انتخاب شوند (مثلاً اخیراً در همین سرور پرسیده شده‌اند).
+        """
+        if total <= 0:
+            return []
+        targets = split_source_targets(total)
+        with self._lock:
+            conn = self._connect()
+            pool_by_source: Dict[str, List[BankQuestion]] = {}
+            hash_of: Dict[int, str] = {}
+            for src, target in targets.items():
+                want = max(target * 3, target + 5)
+                pool: List[BankQuestion] = []
+                # تا want * 8 کاندید خوانده می‌شود تا اگر سوال‌های کنارگذاشته‌شده زیاد بودند
+                # هم want سوال پیدا شود؛ فقط به تعداد لازم decode می‌شوند
+                for row in self._candidate_rows(conn, src, want * 8):
+                    if is_excluded is not None and is_excluded(row[0]):
+                        continue
+                    bq = BankQuestion(
+                        source=row[1],
+                        family=row[2],
+                        question_en=row[3],
+                        correct_en=row[4],
+                        incorrects_en=json.loads(row[5]),
+                        question_fa=row[6],
+                        correct_fa=row[7],
+                        incorrects_fa=json.loads(row[8]),
+                        difficulty=row[9],
+                    )
+                    hash_of[id(bq)] = row[0]
+                    pool.append(bq)
+                    if len(pool) >= want:
+                        break
+                pool_by_source[src] = pool
+
+            selected = select_balanced_questions(pool_by_source, total, targets)
+            if selected:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE mc_questions SET used_count = used_count + 1, last_used = ? WHERE content_hash = ?",
+                    [(now, hash_of[id(bq)]) for bq in selected],
+                )
+                conn.commit()
+        return selected
+
+    def count(self, fresh_only: bool = False) -> int:
+        with self._lock:
+            conn = self._connect()
+            if fresh_only:
+                (n,) = conn.execute("SELECT COUNT(*) FROM mc_questions WHERE used_count = 0").fetchone()
+            else:
+                (n,) = conn.execute("SELECT COUNT(*) FROM mc_questions").fetchone()
+        return n
+
+
+QUESTION_BANK = QuestionBank(QUESTION_BANK_PATH)
+
+
+async def build_question_bank(target: int, max_rounds: int = 10) -> int:
+    """
+    سازنده‌ی بانک سوال: از Trivia API و OpenTDB سوال جمع می‌کند، فیلتر طول انگلیسی،
+    حذف تکراری‌ها، ترجمه و فیلتر طول فارسی را انجام می‌دهد و در بانک ذخیره می‌کند.
+    تا وقتی target سوال جدید اضافه شود یا دورها تمام شوند ادامه می‌دهد.
+    """
+    added = 0
+    empty_rounds = 0
+    for round_no in range(1, max_rounds + 1):
+        if added >= target or empty_rounds >= 3:
+            break
+
+        trivia_raw, opentdb_raw = await asyncio.gather(
+            fetch_raw_trivia_questions(50),
+            fetch_raw_opentdb_questions(100),
+        )
+        trivia_ok = filter_english_questions(trivia_raw)
+        opentdb_ok = filter_english_questions(opentdb_raw)
+        FETCH_YIELD.record_fetch("trivia", len(trivia_raw), trivia_ok)
+        FETCH_YIELD.record_fetch("opentdb", len(opentdb_raw), opentdb_ok)
+        raw_list = trivia_ok + opentdb_ok
+        hashes = [question_content_hash(r.question_en, r.correct_en) for r in raw_list]
+        known = await asyncio.to_thread(QUESTION_BANK.known_hashes, hashes)
+        fresh = [r for r, h in zip(raw_list, hashes) if h not in known]
+        if not fresh:
+            empty_rounds += 1
+            continue
+
+        translated = await run_blocking(translate_raw_questions, fresh)
+        FETCH_YIELD.record_translation(fresh, translated)
+        new_count = await asyncio.to_thread(QUESTION_BANK.add_many, translated)
+        added += new_count
+        empty_rounds = 0 if new_count else empty_rounds + 1
+        print(f"[Knight_Quiz] بانک سوال: دور {round_no} → {new_count} سوال جدید (کل: {QUESTION_BANK.count()})")
+
+    return added
+
+
+_BANK_TOPUP_TASK: Optional[asyncio.Task] = None
+
+
+def schedule_bank_topup():
+    """
+    اگر سوال‌های استفاده‌نشده‌ی بانک کم شده باشد، پر کردن بانک را در پس‌زمینه شروع می‌کند
+    (هم‌زمان فقط یک پر کردن اجرا می‌شود).
+    """
+    global _BANK_TOPUP_TASK
+    if _BANK_TOPUP_TASK is not None and not _BANK_TOPUP_TASK.done():
+        return
+
+    async def topup():
+        try:
+            fresh = await asyncio.to_thread(QUESTION_BANK.count, True)
+            if fresh >= QUESTION_BANK_MIN_FRESH:
+                return
+            await wait_for_argos()
+            if ARGOS_STATE != "ready":
+                # بدون مترجم چیزی برای ذخیره در بانک تولید نمی‌شود
+                return
+            added = await build_question_bank(QUESTION_BANK_TOPUP_SIZE)
+            print(f"[Knight_Quiz] بانک سوال در پس‌زمینه پر شد: {added} سوال جدید.")
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در پر کردن بانک سوال: {e}")
+
+    _BANK_TOPUP_TASK = asyncio.create_task(topup())
+
+
+# ------------------ امتیازهای کلی (SQLite) ------------------
+class ScoreStore:
+    """
+    امتیازهای کلی بازیکن‌ها در SQLite (حالت WAL)، جدا برای هر سرور (guild_id)،
+    به شکل snapshot + لاگ رویداد:
+    - هر تغییر امتیاز (نتیجه‌ی مسابقه، !point) فقط یک ردیف به guild_score_events اضافه می‌کند (append-only)
+    - هر رویداد شماره‌ی ترتیب (step) خودش را دارد، پس ترتیب رسیدن به امتیاز (tie-break در !top)
+      بعد از ری‌استارت هم حفظ می‌شود
+    - compact رویدادها را در جدول guild_scores (snapshot) جمع می‌کند و لاگ را خالی می‌کند
+    - load_guild: snapshot + رویدادهای بعد از آن، فقط برای یک سرور
+    امتیازهای قدیمی (scores.json و جدول‌های بدون guild_id) یک‌بار به سرور LEGACY_SCORES_GUILD_ID منتقل می‌شوند.
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None, legacy_guild_id: int = 0):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self.legacy_guild_id = legacy_guild_id
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # تعداد رویدادهای لاگ که هنوز در snapshot جمع نشده‌اند
+        self.log_size = 0
+        self.compactions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS guild_scores ("
+                " guild_id INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " score INTEGER NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL DEFAULT 0,"
+                " order_step INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (guild_id, user_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS guild_score_events ("
+                " id INTEGER PRIMARY KEY,"
+                " guild_id INTEGER NOT NULL,"
+                " step INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " delta INTEGER NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_score_events_guild ON guild_score_events(guild_id, step)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.commit()
+            self._conn = conn
+            self._migrate_single_namespace(conn)
+            self._migrate_legacy_json(conn)
+            (self.log_size,) = conn.execute("SELECT COUNT(*) FROM guild_score_events").fetchone()
+        return self._conn
+
+    def _migrate_single_namespace(self, conn: sqlite3.Connection):
+        """جدول‌های نسخه‌ی قبلی (scores / score_events بدون guild_id) به سرور legacy_guild_id منتقل می‌شوند."""
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "scores" not in tables:
+            return
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(scores)")}
+        order_column = "order_step" if "order_step" in columns else "0"
+        with conn:
+            (moved,) = conn.execute("SELECT COUNT(*) FROM scores").fetchone()
+            conn.execute(
+                "INSERT INTO guild_scores (guild_id, user_id, score, updated_at, order_step)"
+                f" SELECT ?, user_id, score, updated_at, {order_column} FROM scores",
+                (self.legacy_guild_id,),
+            )
+            if "score_events" in tables:
+                conn.execute(
+                    "INSERT INTO guild_score_events (guild_id, step, user_id, delta, kind, created_at)"
+                    " SELECT ?, step, user_id, delta, kind, created_at FROM score_events ORDER BY step",
+                    (self.legacy_guild_id,),
+                )
+                conn.execute("DROP TABLE score_events")
+            conn.execute("DROP TABLE scores")
+        self._warn_legacy_target(moved)
+
+    def _migrate_legacy_json(self, conn: sqlite3.Connection):
+        """انتقال یک‌باره‌ی scores.json؛ فایل قدیمی دست نمی‌خورد (به عنوان نسخه‌ی پشتیبان می‌ماند)."""
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_migrated'").fetchone():
+            return
+        try:
+            with open(self.legacy_json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            rows = [(int(k), int(v)) for k, v in data.items()]
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در خواندن {self.legacy_json_path} برای مهاجرت (نادیده گرفته شد): {e}")
+            return
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT INTO guild_scores (guild_id, user_id, score, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(guild_id, user_id) DO UPDATE SET score = score + excluded.score",
+                [(self.legacy_guild_id, user_id, score, now) for user_id, score in rows],
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('legacy_json_migrated', ?)",
+                (str(now),),
+            )
+        print(f"[Knight_Quiz] {len(rows)} امتیاز از {self.legacy_json_path} به {self.path} منتقل شد.")
+        self._warn_legacy_target(len(rows))
+
+    def _warn_legacy_target(self, moved: int):
+        if moved and not self.legacy_guild_id:
+            print(
+                "[Knight_Quiz] ⚠️ امتیازهای قدیمی به سرور 0 منتقل شدند (ALLOWED_GUILD_ID و LEGACY_SCORES_GUILD_ID ست نشده)؛ "
+                "در هیچ سروری نمایش داده نمی‌شوند."
+            )
+
+    def load_guild(self, guild_id: int) -> Tuple[Dict[int, int], Dict[int, int], int]:
+        """
+        (امتیازها، ترتیب رسیدن به امتیاز، آخرین step) یک سرور از snapshot و رویدادهای بعد از آن.
+        بازیکن‌هایی که ترتیبشان معلوم نیست (مهاجرت‌شده از JSON) در order map نیستند.
+        """
+        scores: Dict[int, int] = {}
+        order_map: Dict[int, int] = {}
+        last_step = 0
+        with self._lock:
+            conn = self._connect()
+            for user_id, score, order_step in conn.execute(
+                "SELECT user_id, score, order_step FROM guild_scores WHERE guild_id = ?", (guild_id,)
+            ):
+                scores[user_id] = score
+                if order_step:
+                    order_map[user_id] = order_step
+                    last_step = max(last_step, order_step)
+            for step, user_id, delta in conn.execute(
+                "SELECT step, user_id, delta FROM guild_score_events WHERE guild_id = ? ORDER BY step", (guild_id,)
+            ):
+                scores[user_id] = scores.get(user_id, 0) + delta
+                order_map[user_id] = step
+                last_step = step
+        return scores, order_map, last_step
+
+    def append(self, events: List[Tuple[int, int, int, int, str]]):
+        """اضافه کردن رویدادهای (guild_id, step, user_id, delta, kind) به لاگ در یک تراکنش."""
+        if not events:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO guild_score_events (guild_id, step, user_id, delta, kind, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    [(guild_id, step, user_id, delta, kind, now) for guild_id, step, user_id, delta, kind in events],
+                )
+            self.log_size += len(events)
+
+    async def append_async(self, events: List[Tuple[int, int, int, int, str]]):
+        """نسخه‌ی async از append (نوشتن روی دیسک بیرون از event loop)."""
+        await asyncio.to_thread(self.append, events)
+
+    def compact(self) -> int:
+        """
+        جمع کردن لاگ رویدادها در snapshot (جدول guild_scores) در یک تراکنش؛
+        تعداد رویدادهای جمع‌شده را برمی‌گرداند.
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                (folded,) = conn.execute("SELECT COUNT(*) FROM guild_score_events").fetchone()
+                if not folded:
+                    return 0
+                conn.execute(
+                    "INSERT INTO guild_scores (guild_id, user_id, score, updated_at, order_step)"
+                    " SELECT guild_id, user_id, SUM(delta), MAX(created_at), MAX(step) FROM guild_score_events"
+                    " WHERE true GROUP BY guild_id, user_id"
+                    " ON CONFLICT(guild_id, user_id) DO UPDATE SET"
+                    " score = score + excluded.score,"
+                    " updated_at = excluded.updated_at,"
+                    " order_step = excluded.order_step"
+                )
+                conn.execute("DELETE FROM guild_score_events")
+            self.log_size = 0
+            self.compactions += 1
+        return folded
+
+    async def compact_async(self) -> int:
+        return await asyncio.to_thread(self.compact)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+SCORE_STORE = ScoreStore(SCORES_DB_PATH, legacy_json_path=SCORES_FILE, legacy_guild_id=LEGACY_SCORES_GUILD_ID)
+
+class ScoreWriteBehind:
+    """
+    صف نوشتن امتیازها (write-behind): دستورها فقط تغییر را در حافظه ثبت می‌کنند
+    و یک تسک پس‌زمینه تغییرهای جمع‌شده را هر SCORE_FLUSH_INTERVAL ثانیه
+    (یا زودتر، با رسیدن به SCORE_FLUSH_MAX_PENDING بازیکن) در یک تراکنش به لاگ اضافه می‌کند.
+    تغییرهای یک بازیکن در یک سرور (از یک نوع) تا نوشته شدن با هم جمع می‌شوند و آخرین step را نگه می‌دارند؛
+    اگر نوشتن خطا بدهد دوباره به صف برمی‌گردند.
+    وقتی لاگ از SCORE_SNAPSHOT_EVERY رویداد بزرگ‌تر شود، در snapshot جمع می‌شود.
+    """
+
+    def __init__(self, store: ScoreStore):
+        self.store = store
+        # (guild_id, user_id, kind) → [delta جمع‌شده، آخرین step]
+        self._pending: Dict[Tuple[int, int, str], List[int]] = {}
+        # سرورهایی که رویدادشان در حال نوشتن است
+        self._inflight_guilds: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wake: Optional[asyncio.Event] = None
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.max_batch = 0
+        self.failures = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+
+    def add(self, guild_id: int, user_id: int, delta: int, step: int, kind: str):
+        entry = self._pending.get((guild_id, user_id, kind))
+        if entry is None:
+            self._pending[(guild_id, user_id, kind)] = [delta, step]
+        else:
+            entry[0] += delta
+            entry[1] = step
+        self.schedule_flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def dirty_guilds(self) -> set:
+        """سرورهایی که تغییر نوشته‌نشده دارند (نباید از حافظه خارج شوند)."""
+        return {guild_id for guild_id, _, _ in self._pending} | self._inflight_guilds
+
+    def _take_batch(self) -> List[Tuple[int, int, int, int, str]]:
+        batch = [
+            (guild_id, step, user_id, delta, kind)
+            for (guild_id, user_id, kind), (delta, step) in self._pending.items()
+        ]
+        self._pending = {}
+        return batch
+
+    def schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # بیرون از event loop (مثلاً اسکریپت‌ها): نوشتن فوری
+            self.store.append(self._take_batch())
+            return
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        if len(self._pending) >= SCORE_FLUSH_MAX_PENDING:
+            self._wake.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wake.wait(), SCORE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """نوشتن همه‌ی تغییرهای در صف (نوشتن‌های هم‌زمان پشت سر هم انجام می‌شوند)."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if self._wake is not None:
+                self._wake.clear()
+            batch = self._take_batch()
+            if not batch:
+                return
+            started = time.perf_counter()
+            self._inflight_guilds = {event[0] for event in batch}
+            try:
+                await self.store.append_async(batch)
+            except Exception as e:
+                self.failures += 1
+                for guild_id, step, user_id, delta, kind in batch:
+                    entry = self._pending.setdefault((guild_id, user_id, kind), [0, step])
+                    entry[0] += delta
+                    entry[1] = max(entry[1], step)
+                print(f"[Knight_Quiz] خطا در نوشتن امتیازها ({len(batch)} رویداد دوباره در صف): {e}")
+                return
+            finally:
+                self._inflight_guilds = set()
+            self.last_latency = time.perf_counter() - started
+            self.total_latency += self.last_latency
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+
+            if self.store.log_size >= SCORE_SNAPSHOT_EVERY:
+                await self.compact()
+
+    async def compact(self):
+        try:
+            folded = await self.store.compact_async()
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در فشرده‌سازی لاگ امتیازها: {e}")
+            return
+        if folded:
+            print(f"[Knight_Quiz] {folded} رویداد امتیاز در snapshot جمع شد.")
+
+    async def close(self):
+        """نوشتن نهایی و فشرده‌سازی لاگ (هنگام خاموش شدن بات).
+
+        اگر نوشتن شکست بخورد تا SCORE_FINAL_FLUSH_ATTEMPTS بار دوباره امتحان می‌شود؛
+        بعد از آن store بسته می‌شود، پس رویدادهای باقی‌مانده از دست رفته‌اند و در لاگ گزارش می‌شوند.
+        """
+        for attempt in range(1, SCORE_FINAL_FLUSH_ATTEMPTS + 1):
+            await self.flush()
+            if not self._pending:
+                break
+            if attempt < SCORE_FINAL_FLUSH_ATTEMPTS:
+                await asyncio.sleep(SCORE_FINAL_FLUSH_RETRY_DELAY * attempt)
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self._pending:
+            dropped = len(self._pending)
+            self._pending = {}
+            print(
+                f"[Knight_Quiz] خطا: نوشتن نهایی امتیازها بعد از {SCORE_FINAL_FLUSH_ATTEMPTS} تلاش ناموفق بود؛ "
+                f"{dropped} رویداد امتیاز از دست رفت."
+            )
+            return
+        await self.compact()
+
+    def stats_line(self) -> str:
+        log_part = f"لاگ {self.store.log_size} رویداد، {self.store.compactions} snapshot"
+        if not self.flushes:
+            return f"هنوز نوشتنی انجام نشده، {self.pending} رویداد در صف، {log_part}"
+        avg_batch = self.flushed_rows / self.flushes
+        avg_ms = self.total_latency / self.flushes * 1000
+        return (
+            f"{self.flushes} نوشتن، batch میانگین {avg_batch:.1f} (بیشینه {self.max_batch})، "
+            f"تأخیر آخر {self.last_latency * 1000:.1f}ms (میانگین {avg_ms:.1f}ms)، "
+            f"خطا {self.failures}، {self.pending} رویداد در صف، {log_part}"
+        )
+
+
+SCORE_WRITER = ScoreWriteBehind(SCORE_STORE)
+
+
+class Leaderboard:
+    """
+    رتبه‌بندی کلی که با هر تغییر امتیاز مرتب می‌ماند (به جای sort کامل در هر !top).
+    کلیدها (-امتیاز، ترتیب رسیدن به امتیاز، user_id) در یک لیست مرتب با bisect نگه داشته می‌شوند:
+    - پیدا کردن رتبه‌ی یک بازیکن: O(log n)
+    - k نفر از یک رتبه به بعد: O(k)
+    - به‌روزرسانی یک بازیکن: جستجوی O(log n) + جابه‌جایی لیست (memmove)
+    """
+
+    # ترتیب نامعلوم (مثل build_scores_embed): بعد از همه‌ی هم‌امتیازها
+    UNKNOWN_ORDER = 10**9
+
+    def __init__(self):
+        self._keys: List[Tuple[int, int, int]] = []
+        self._key_of: Dict[int, Tuple[int, int, int]] = {}
+
+    @classmethod
+    def from_scores(cls, scores: Dict[int, int], order_map: Dict[int, int]) -> "Leaderboard":
+        board = cls()
+        board._key_of = {
+            user_id: (-score, order_map.get(user_id, cls.UNKNOWN_ORDER), user_id)
+            for user_id, score in scores.items()
+        }
+        board._keys = sorted(board._key_of.values())
+        return board
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def update(self, user_id: int, score: int, order: Optional[int]):
+        old = self._key_of.get(user_id)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, old)]
+        key = (-score, order if order is not None else self.UNKNOWN_ORDER, user_id)
+        self._key_of[user_id] = key
+        bisect.insort(self._keys, key)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """رتبه‌ی بازیکن (از ۱)، یا None اگر امتیازی ندارد."""
+        key = self._key_of.get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._keys, key) + 1
+
+    def page(self, offset: int, count: int) -> List[Tuple[int, int]]:
+        """(user_id, امتیاز) برای count نفر از رتبه‌ی offset+1 به بعد."""
+        return [(user_id, -neg_score) for neg_score, _, user_id in self._keys[offset:offset + count]]
+
+
+class GuildScores:
+    """امتیازهای کلی یک سرور: امتیازها، ترتیب رسیدن به امتیاز و رتبه‌بندی مرتب."""
+
+    def __init__(self, guild_id: int, scores: Dict[int, int], order_map: Dict[int, int], step_counter: int):
+        self.guild_id = guild_id
+        self.scores = scores
+        self.order_map = order_map
+        self.step_counter = step_counter
+        self.leaderboard = Leaderboard.from_scores(scores, order_map)
+        self.last_used = time.monotonic()
+
+    def apply(self, deltas: Dict[int, int], kind: str) -> Dict[int, int]:
+        """
+        تغییرها را روی امتیازهای حافظه (و ترتیب رسیدن به امتیاز) اعمال می‌کند
+        و برای نوشتن پس‌زمینه در SCORE_WRITER صف می‌کند. امتیاز جدید بازیکن‌ها را برمی‌گرداند.
+        kind: نوع رویداد در لاگ (match / point)
+        """
+        self.last_used = time.monotonic()
+        new_scores = {}
+        for user_id, delta in deltas.items():
+            self.scores[user_id] = self.scores.get(user_id, 0) + delta
+            self.step_counter += 1
+            self.order_map[user_id] = self.step_counter
+            self.leaderboard.update(user_id, self.scores[user_id], self.step_counter)
+            new_scores[user_id] = self.scores[user_id]
+            SCORE_WRITER.add(self.guild_id, user_id, delta, self.step_counter, kind)
+        return new_scores
+
+
+class GuildScoreRegistry:
+    """
+    امتیازهای کلی سرورها در حافظه: هر سرور اولین بار که لازم شود از SCORE_STORE خوانده می‌شود
+    و اگر GUILD_SCORES_IDLE_SECONDS استفاده نشود (و تغییر نوشته‌نشده نداشته باشد) از حافظه خارج می‌شود.
+    """
+
+    def __init__(self, store: ScoreStore, writer: ScoreWriteBehind):
+        self.store = store
+        self.writer = writer
+        self._guilds: Dict[int, GuildScores] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.evictions = 0
+
+    async def get(self, guild_id: int) -> GuildScores:
+        ns = self._guilds.get(guild_id)
+        if ns is not None:
+            ns.last_used = time.monotonic()
+            return ns
+        # چند درخواست هم‌زمان برای یک سرور فقط یک بار از دیسک می‌خوانند
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = asyncio.create_task(self._load(guild_id))
+            self._loading[guild_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, guild_id: int) -> GuildScores:
+        scores, order_map, step_counter = await asyncio.to_thread(self.store.load_guild, guild_id)
+        ns = GuildScores(guild_id, scores, order_map, step_counter)
+        self._guilds[guild_id] = ns
+        self.loads += 1
+        return ns
+
+    def sweep(self):
+        """خارج کردن سرورهای بی‌استفاده از حافظه."""
+        now = time.monotonic()
+        dirty = self.writer.dirty_guilds()
+        for guild_id, ns in list(self._guilds.items()):
+            if guild_id not in dirty and now - ns.last_used > GUILD_SCORES_IDLE_SECONDS:
+                del self._guilds[guild_id]
+                self.evictions += 1
+
+    def start_sweeper(self):
+        """شروع تسک پس‌زمینه‌ای که هر GUILD_SCORES_SWEEP_INTERVAL ثانیه sweep را اجرا می‌کند."""
+        if self._sweep_task is not None and not self._sweep_task.done():
+            return
+
+        async def sweeper():
+            while True:
+                await asyncio.sleep(GUILD_SCORES_SWEEP_INTERVAL)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"[Knight_Quiz] خطا در خارج کردن امتیازهای سرورها از حافظه: {e}")
+
+        self._sweep_task = asyncio.create_task(sweeper())
+
+    def stats_line(self) -> str:
+        return f"{len(self._guilds)} سرور در حافظه، {self.loads} بارگذاری، {self.evictions} خروج از حافظه"
+
+
+GUILD_SCORES = GuildScoreRegistry(SCORE_STORE, SCORE_WRITER)
+
+
+def score_guild_id(guild: Optional[discord.Guild]) -> int:
+    """شناسه‌ی فضای امتیاز (۰ برای پیام خصوصی)."""
+    return guild.id if guild is not None else 0
+
+
+async def add_match_scores_to_global(guild_id: int, match_scores: Dict[int, int]):
+    """
+    امتیازهای یک مسابقه را بعد از پایان مسابقه
+    به امتیاز کلی همان سرور اضافه می‌کند.
+
+    فقط امتیازهای مثبت به امتیاز کلی اضافه می‌شوند
+    (برای اینکه امتیاز کلی بازیکن‌ها منفی نشود).
+    """
+    deltas = {user_id: score for user_id, score in match_scores.items() if score > 0}
+    if not deltas:
+        return
+    # خطای خواندن امتیازها نباید جلوی پاک شدن جلسه‌ی مسابقه را بگیرد
+    try:
+        ns = await GUILD_SCORES.get(guild_id)
+        ns.apply(deltas, "match")
+    except Exception as e:
+        print(f"[Knight_Quiz] خطا در ثبت امتیازهای کلی سرور {guild_id}: {e}")
+
+# مسابقه چندگزینه‌ای
+active_quizzes: Dict[int, "QuizSession"] = {}
+# مسابقه تشریحی (بدون گزینه) برای !question
+active_question_sessions: Dict[int, "QuestionSession"] = {}
+# مسابقه پرچم‌ها برای !flags
+active_flag_sessions: Dict[int, "FlagSession"] = {}
 
-        params = {
-            "amount": amount,
-            "type": "multiple",
-            "difficulty": difficulty,
-            "category": cat_id,
-        }
-        try:
-            resp = requests.get(url="https://opentdb.com/api.php", params=params, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            print(f"[Knight_Quiz] خطا در OpenTDB (cat={cat_id}): {e}")
-            continue
 
-        if not isinstance(data, dict):
-            continue
+# ------------------ تاریخچه‌ی سوال‌های پرسیده‌شده در هر سرور ------------------
+SEEN_HISTORY_PATH = "seen_questions.json"
+SEEN_HISTORY_MAX_AGE_DAYS = 30        # بعد از این مدت یک سوال دوباره مجاز است
+SEEN_HISTORY_MAX_PER_GUILD = 5000     # قدیمی‌ترین‌ها بعد از این تعداد حذف می‌شوند
+SEEN_KEY_CHARS = 16                   # طول هش ذخیره‌شده (۶۴ بیت برای این حجم کافی است)
+SEEN_HISTORY_SAVE_DELAY = 10          # ذخیره روی دیسک با کمی تأخیر (چند علامت‌گذاری با هم)
 
-        family = OPENTDB_FAMILY_MAP.get(cat_id, f"opentdb_{cat_id}")
-        for item in data.get("results", []):
-            q = html.unescape(item.get("question", ""))
-            correct = html.unescape(item.get("correct_answer", ""))
-            incorrect = [html.unescape(x) for x in item.get("incorrect_answers", [])]
-            if not q or not correct or len(incorrect) != 3:
-                continue
-            results.append(RawQuizQuestion(
-                source="opentdb",
-                question_en=q,
-                correct_en=correct,
-                incorrects_en=incorrect,
-                family=family,
-            ))
 
-    return results
+def seen_key(*parts: str) -> str:
+    """
+    هش محتوای نرمال‌شده برای تاریخچه.
+    برای سوال‌های چندگزینه‌ای seen_key(question_en, correct_en) همان ابتدای question_content_hash است.
+    """
+    key = "\x1f".join(normalize_translation_key(p).casefold() for p in parts)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:SEEN_KEY_CHARS]
 
 
-def collect_raw_mc_questions(total: int) -> List[RawQuizQuestion]:
+class SeenHistory:
     """
-    گرفتن سوال‌های خام انگلیسی از ۲ منبع با این ویژگی‌ها:
-    - حدوداً ۴۰٪ Trivia ، ۶۰٪ OpenTDB (در حد امکان)
-    - فیلتر طول روی متن انگلیسی (سوال و گزینه‌ها)
-    - تلاش برای اینکه هیچ خانواده‌ای بیش از ۲۰٪ سوال‌ها نگیرد
-    - اگر محدودیت‌ها باعث کمبود شود، مسابقه لغو نمی‌شود و به شکل هوشمند شُل می‌شود.
+    تاریخچه‌ی فشرده‌ی سوال‌های پرسیده‌شده در هر سرور (هش → زمان پرسیدن)،
+    با انقضای زمانی و سقف تعداد، ذخیره‌شده در SEEN_HISTORY_PATH.
+    قبل از ترجمه و رندر بررسی می‌شود تا سوال تکراری در ارزان‌ترین مرحله کنار برود.
+    contains از تردهای آماده‌سازی هم صدا زده می‌شود (QUESTION_BANK.draw)، پس دسترسی‌ها قفل دارند.
     """
-    if total <= 0:
-        return []
 
-    # نسبت‌های هدف
-    trivia_target = max(1, int(round(total * 0.4)))
-    opentdb_target = total - trivia_target
-    if opentdb_target < 1:
-        opentdb_target = 1
-        trivia_target = total - 1
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._guilds: Dict[int, "OrderedDict[str, float]"] = {}
+        self._loaded = False
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در خواندن تاریخچه‌ی سوال‌ها: {e}")
+            return
+        for gid, entries in data.items():
+            ordered = OrderedDict(sorted(entries.items(), key=lambda kv: kv[1]))
+            self._guilds[int(gid)] = ordered
+            self._expire(ordered)
+
+    def _entries(self, guild_id: int) -> "OrderedDict[str, float]":
+        if not self._loaded:
+            self._load()
+        entries = self._guilds.get(guild_id)
+        if entries is None:
+            entries = OrderedDict()
+            self._guilds[guild_id] = entries
+        return entries
+
+    def _expire(self, entries: "OrderedDict[str, float]"):
+        cutoff = time.time() - SEEN_HISTORY_MAX_AGE_DAYS * 86400
+        while entries and next(iter(entries.values())) < cutoff:
+            entries.popitem(last=False)
+        while len(entries) > SEEN_HISTORY_MAX_PER_GUILD:
+            entries.popitem(last=False)
+
+    def contains(self, guild_id: Optional[int], content_hash: str) -> bool:
+        if guild_id is None or not content_hash:
+            return False
+        with self._lock:
+            asked_at = self._entries(guild_id).get(content_hash[:SEEN_KEY_CHARS])
+        return asked_at is not None and asked_at >= time.time() - SEEN_HISTORY_MAX_AGE_DAYS * 86400
 
-    # برای اینکه مجموع دقیقاً total شود
-    sum_target = trivia_target + opentdb_target
-    if sum_target != total:
-        # تنظیم کوچک اگر گرد کردن باعث اختلاف شده باشد
-        opentdb_target += (total - sum_target)
+    def mark(self, guild_id: Optional[int], content_hash: str):
+        """ثبت پرسیده شدن یک سوال (ذخیره روی دیسک با کمی تأخیر)."""
+        if guild_id is None or not content_hash:
+            return
+        with self._lock:
+            entries = self._entries(guild_id)
+            key = content_hash[:SEEN_KEY_CHARS]
+            entries[key] = time.time()
+            entries.move_to_end(key)
+            self._expire(entries)
+            self._dirty = True
+        self.schedule_save()
+
+    def schedule_save(self):
+        if self._save_task is not None and not self._save_task.done():
+            return
+        try:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+        except RuntimeError:
+            self.save()
+
+    async def _save_later(self):
+        await asyncio.sleep(SEEN_HISTORY_SAVE_DELAY)
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            await asyncio.to_thread(self._write, snapshot)
+
+    def _snapshot(self) -> Optional[dict]:
+        with self._lock:
+            if not self._dirty:
+                return None
+            self._dirty = False
+            return {str(gid): dict(entries) for gid, entries in self._guilds.items() if entries}
+
+    def _write(self, snapshot: dict):
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در ذخیره‌ی تاریخچه‌ی سوال‌ها: {e}")
 
-    # کمی بیش‌ازحد از هر منبع می‌گیریم تا بعداً فیلتر و تعادل خانواده‌ها را اعمال کنیم
-    trivia_raw_all = fetch_raw_trivia_questions(max(trivia_target * 3, trivia_target + 5))
-    opentdb_raw_all = fetch_raw_opentdb_questions(max(opentdb_target * 3, opentdb_target + 5))
+    def save(self):
+        """ذخیره‌ی فوری (مثلاً هنگام خاموش شدن بات)."""
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            self._write(snapshot)
 
-    def filter_english(raw_list: List[RawQuizQuestion]) -> List[RawQuizQuestion]:
-        filtered: List[RawQuizQuestion] = []
-        for rq in raw_list:
-            if not rq.question_en or len(rq.question_en) > MAX_QUESTION_CHARS * 2:
-                continue
-            options = [rq.correct_en] + rq.incorrects_en
-            if len(options) != 4:
-                continue
-            if any((not opt) or len(opt) > MAX_OPTION_CHARS * 2 for opt in options):
-                continue
-            filtered.append(rq)
-        return filtered
 
-    trivia_pool = filter_english(trivia_raw_all)
-    opentdb_pool = filter_english(opentdb_raw_all)
+SEEN_HISTORY = SeenHistory(SEEN_HISTORY_PATH)
 
-    pool_by_source: Dict[str, List[RawQuizQuestion]] = {
-        "trivia": trivia_pool,
-        "opentdb": opentdb_pool,
-    }
 
-    for lst in pool_by_source.values():
-        random.shuffle(lst)
+# ------------------ آماده‌سازی سوال‌های quiz (مشترک بین مسابقه و بافر) ------------------
+async def fetch_and_translate_questions(
+    need: int,
+    progress: LoadingProgress,
+    guild_id: Optional[int] = None,
+    exclude: Optional[set] = None,
+) -> List[BankQuestion]:
+    """
+    کمبود بانک را از شبکه جبران می‌کند: دریافت سوال‌های خام، ترجمه‌ی دسته‌ای
+    (هر دور فقط به اندازه‌ی کمبود + کمی اضافه) و ذخیره در بانک.
+    سوال‌هایی که اخیراً در سرور guild_id پرسیده شده‌اند (یا hash آن‌ها در exclude است) قبل از ترجمه کنار می‌روند.
+    """
+    await progress.update(f"در حال دریافت {need} سوال از سرورهای سوال...", force=True)
+
+    # دریافت سوال‌ها هم‌زمان با warm-up مترجم انجام می‌شود
+    fetch_task = asyncio.create_task(collect_raw_mc_questions(need, exclude_hashes=exclude, guild_id=guild_id))
+    if ARGOS_STATE == "loading":
+        await progress.update("⏳ مترجم در حال آماده شدن است...", force=True)
+    if not await wait_for_argos():
+        print("[Knight_Quiz] مترجم به‌موقع آماده نشد؛ سوال‌ها بدون ترجمه آماده می‌شوند.")
+    raw_candidates = await fetch_task
+    seen_hashes = {question_content_hash(r.question_en, r.correct_en) for r in raw_candidates}
+    seen_hashes.update(exclude or ())
+
+    translated: List[BankQuestion] = []
+    cursor = 0
+    topup_rounds = 0
+    while len(translated) < need:
+        remaining = need - len(translated)
+        if cursor >= len(raw_candidates):
+            # ترجمه بیش از انتظار سوال رد کرد: فقط کمبود دوباره دریافت می‌شود
+            if topup_rounds >= COLLECT_MAX_TOPUP_ROUNDS:
+                break
+            topup_rounds += 1
+            FETCH_YIELD.topup_rounds += 1
+            extra = await collect_raw_mc_questions(remaining, exclude_hashes=seen_hashes, guild_id=guild_id)
+            if not extra:
+                break
+            seen_hashes.update(question_content_hash(r.question_en, r.correct_en) for r in extra)
+            raw_candidates.extend(extra)
 
-    # اگر هیچ سوالی نگرفتیم
-    all_questions = [q for lst in pool_by_source.values() for q in lst]
-    if not all_questions:
-        return []
+        batch = raw_candidates[cursor:cursor + remaining + max(2, remaining // 4)]
+        cursor += len(batch)
 
-    # خانواده‌ها
-    all_families = {q.family for q in all_questions}
-    if not all_families:
-        all_families = {"unknown"}
+        await progress.update(f"در حال ترجمه‌ی {len(batch)} سوال...")
+        batch_translated = await run_blocking(translate_raw_questions, batch)
+        FETCH_YIELD.record_translation(batch, batch_translated)
+        translated.extend(batch_translated)
 
-    max_per_family = max(1, int(total * 0.2))  # 20٪ سقف نرم
+    translated = translated[:need]
+    # ترجمه‌ها هدر نروند: در بانک ذخیره می‌شوند (استفاده‌شده)
+    await asyncio.to_thread(QUESTION_BANK.add_many, translated, True)
+    return translated
 
-    desired_per_source = {
-        "trivia": trivia_target,
-        "opentdb": opentdb_target,
-    }
 
-    selected: List[RawQuizQuestion] = []
-    family_counts: Dict[str, int] = {}
-    indices: Dict[str, int] = {src: 0 for src in pool_by_source}
-    # ترجیح می‌دهیم اول OpenTDB پر شود تا به نسبت ۶۰٪ نزدیک باشیم
-    sources_order = ["opentdb", "trivia"]
-
-    # فاز ۱: تلاش برای احترام به نسبت هر منبع + سقف خانواده‌ها
-    while len(selected) < total:
-        progress = False
-        for src in sources_order:
-            if desired_per_source[src] <= 0:
-                continue
-            lst = pool_by_source[src]
-            idx = indices[src]
-            # رد کردن سوال‌هایی که خانواده‌شان به سقف رسیده
-            while idx < len(lst) and family_counts.get(lst[idx].family, 0) >= max_per_family:
-                idx += 1
-            if idx >= len(lst):
-                indices[src] = idx
-                continue
+async def draw_quiz_items(
+    total: int,
+    progress: LoadingProgress,
+    guild_id: Optional[int] = None,
+    exclude: Optional[set] = None,
+) -> List[BankQuestion]:
+    """
+    total سوال ترجمه‌شده: اول از بانک و فقط کمبود از شبکه.
+    سوال‌هایی که اخیراً در سرور guild_id پرسیده شده‌اند انتخاب نمی‌شوند، مگر اینکه سوال تازه کم بیاید.
+    سوال‌هایی که hash آن‌ها در exclude است (مثلاً قبلاً برای همین مسابقه انتخاب شده‌اند) هیچ‌وقت انتخاب نمی‌شوند.
+    """
+    exclude = exclude or set()
 
-            rq = lst[idx]
-            indices[src] = idx + 1
-            selected.append(rq)
-            family_counts[rq.family] = family_counts.get(rq.family, 0) + 1
-            desired_per_source[src] -= 1
-            progress = True
+    def is_seen(content_hash: str) -> bool:
+        return content_hash in exclude or SEEN_HISTORY.contains(guild_id, content_hash)
 
-            if len(selected) >= total:
-                break
+    items: List[BankQuestion] = await asyncio.to_thread(QUESTION_BANK.draw, total, is_seen)
+    shortfall = total - len(items)
+    if shortfall > 0:
+        items.extend(await fetch_and_translate_questions(shortfall, progress, guild_id, exclude))
 
-        if not progress:
-            break
+    shortfall = total - len(items)
+    if shortfall > 0:
+        # سوال تازه کافی نبود: تکرار سوال‌های قدیمی‌تر بهتر از کوتاه شدن مسابقه است
+        chosen = {question_content_hash(bq.question_en, bq.correct_en) for bq in items} | exclude
+        items.extend(await asyncio.to_thread(QUESTION_BANK.draw, shortfall, chosen.__contains__))
 
-    # فاز ۲: اگر هنوز کم داریم، از هر منبعی که سوال مانده، با حفظ سقف خانواده‌ها پر می‌کنیم
-    if len(selected) < total:
-        remaining: List[RawQuizQuestion] = []
-        for src in sources_order:
-            lst = pool_by_source[src]
-            idx = indices[src]
-            if idx < len(lst):
-                remaining.extend(lst[idx:])
-        random.shuffle(remaining)
-
-        for rq in remaining:
-            if len(selected) >= total:
-                break
-            if family_counts.get(rq.family, 0) >= max_per_family:
-                continue
-            selected.append(rq)
-            family_counts[rq.family] = family_counts.get(rq.family, 0) + 1
-
-    # فاز ۳: اگر باز هم کم داریم، مجبوریم از محدودیت خانواده بگذریم که مسابقه حتماً اجرا شود
-    if len(selected) < total:
-        used_ids = {id(q) for q in selected}
-        remaining_all: List[RawQuizQuestion] = []
-        for src in sources_order:
-            for rq in pool_by_source[src]:
-                if id(rq) not in used_ids:
-                    remaining_all.append(rq)
-        random.shuffle(remaining_all)
-
-        for rq in remaining_all:
-            if len(selected) >= total:
-                break
-            selected.append(rq)
+    # پر کردن بانک برای مسابقه‌های بعدی (در پس‌زمینه)
+    schedule_bank_topup()
+    return items
 
-    # اگر به هر دلیل بیشتر از total شد، کوتاه می‌کنیم
-    if len(selected) > total:
-        selected = selected[:total]
 
-    return selected
+async def render_quiz_question(bq: BankQuestion) -> PreparedQuizQuestion:
+    """
+    گزینه‌ها را به هم می‌ریزد و تصویر سوال را (در استخر آماده‌سازی) می‌سازد.
+    اگر رندر خطا بدهد، سوال بدون تصویر (امبد متنی) آماده می‌شود.
+    """
+    options_fa, correct_index = shuffle_bank_options(bq)
+    try:
+        image_bytes = await run_blocking(render_question_image_bytes, bq.question_fa, options_fa)
+    except Exception as e:
+        print(f"[Knight_Quiz] خطا در رندر تصویر سوال (نمایش متنی): {e}")
+        image_bytes = None
+    return PreparedQuizQuestion(
+        question_fa=bq.question_fa,
+        options_fa=options_fa,
+        correct_index=correct_index,
+        correct_text_fa=options_fa[correct_index],
+        image=prepared_image(image_bytes, f"question.{IMAGE_EXT}"),
+        source=bq.source,
+        family=bq.family,
+        content_hash=question_content_hash(bq.question_en, bq.correct_en),
+    )
 
 
-# امتیازهای کلی (تاریخی)
-global_scores: Dict[int, int] = load_global_scores()
-global_score_order_map: Dict[int, int] = {}
-global_score_step_counter: int = 0
+async def render_quiz_questions(
+    items: List[BankQuestion],
+    progress: Optional[LoadingProgress] = None,
+    done_before: int = 0,
+    total: int = 0,
+) -> List[PreparedQuizQuestion]:
+    """
+    رندر موازی چند سوال (حداکثر RENDER_PARALLELISM هم‌زمان).
+    ترتیب خروجی همیشه همان ترتیب items است، مستقل از اینکه کدام رندر زودتر تمام شود.
+    """
+    semaphore = asyncio.Semaphore(RENDER_PARALLELISM)
+    done = 0
+
+    async def render_one(bq: BankQuestion) -> PreparedQuizQuestion:
+        nonlocal done
+        async with semaphore:
+            pq = await render_quiz_question(bq)
+        done += 1
+        if progress is not None:
+            await progress.update(f"{done_before + done}/{total or len(items)} سوال آماده شد...")
+        return pq
+
+    return list(await asyncio.gather(*[render_one(bq) for bq in items]))
+
+
+# ------------------ بافر سوال‌های آماده برای هر سرور ------------------
+def guild_is_preparing(guild_id: int) -> bool:
+    """آیا در این سرور مسابقه‌ای در حال آماده‌سازی سوال است؟"""
+    for sessions in (active_quizzes, active_flag_sessions, active_question_sessions):
+        for session in sessions.values():
+            guild = getattr(session.channel, "guild", None)
+            task = session.prepare_task
+            if guild is not None and guild.id == guild_id and task is not None and not task.done():
+                return True
+            pipeline = getattr(session, "pipeline", None)
+            if guild is not None and guild.id == guild_id and pipeline is not None and pipeline.producing:
+                return True
+    return False
+
+
+class QuestionPrefetcher:
+    """
+    یک بافر محدود از PreparedQuizQuestion های کاملاً آماده (ترجمه + تصویر) برای یک سرور.
+    !quiz اول از این بافر برمی‌دارد؛ وقتی بافر از PREFETCH_LOW_WATER کمتر شد،
+    در زمان بیکاری سرور تا PREFETCH_HIGH_WATER دوباره پر می‌شود.
+    """
 
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.pool: List[PreparedQuizQuestion] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def take(self, count: int) -> List[PreparedQuizQuestion]:
+        # سوال‌هایی که در این فاصله در این سرور پرسیده شده‌اند دور ریخته می‌شوند
+        self.pool = [pq for pq in self.pool if not SEEN_HISTORY.contains(self.guild_id, pq.content_hash)]
+        taken = self.pool[:count]
+        del self.pool[:count]
+        return taken
+
+    def ensure_refill(self):
+        """اگر بافر از حد پایین کمتر است و پر کردنی در جریان نیست، پر کردن را شروع می‌کند."""
+        if len(self.pool) >= PREFETCH_LOW_WATER or PREFETCH_HIGH_WATER <= 0:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._refill())
 
-def add_match_scores_to_global(match_scores: Dict[int, int]):
-    """
-    امتیازهای یک مسابقه را بعد از پایان مسابقه
-    به امتیاز کلی اضافه می‌کند.
+    async def _refill(self):
+        silent = LoadingProgress(None)
+        waited = 0
+        try:
+            # بافر فقط سوال فارسی آماده نگه می‌دارد: تا پایان warm-up مترجم صبر می‌کنیم
+            # (سوال‌هایی که بعد از timeout بدون ترجمه آماده می‌شدند بعداً به بازیکن‌ها می‌رسیدند)
+            while ARGOS_STATE == "loading":
+                await wait_for_argos()
+            if ARGOS_STATE != "ready":
+                print(f"[Knight_Quiz] مترجم آماده نیست؛ بافر سوال سرور {self.guild_id} پر نمی‌شود.")
+                return
+            while len(self.pool) < PREFETCH_HIGH_WATER:
+                # در زمان آماده‌سازی مسابقه‌ها منابع را اشغال نمی‌کنیم (ولی نه بی‌نهایت)
+                if guild_is_preparing(self.guild_id) and waited < PREFETCH_MAX_IDLE_WAIT:
+                    await asyncio.sleep(PREFETCH_IDLE_DELAY)
+                    waited += PREFETCH_IDLE_DELAY
+                    continue
 
-    فقط امتیازهای مثبت به امتیاز کلی اضافه می‌شوند
-    (برای اینکه امتیاز کلی بازیکن‌ها منفی نشود).
-    """
-    global global_scores, global_score_order_map, global_score_step_counter
+                batch = min(PREFETCH_BATCH_SIZE, PREFETCH_HIGH_WATER - len(self.pool))
+                items = await draw_quiz_items(batch, silent, self.guild_id)
+                # سوال‌هایی که ترجمه نشده‌اند به بافر راه پیدا نمی‌کنند
+                items = [bq for bq in items if bq.question_fa != bq.question_en]
+                if not items:
+                    break
+                self.pool.extend(await render_quiz_questions(items))
+            print(f"[Knight_Quiz] بافر سوال سرور {self.guild_id}: {len(self.pool)} سوال آماده.")
+        except Exception as e:
+            print(f"[Knight_Quiz] خطا در پر کردن بافر سوال سرور {self.guild_id}: {e}")
 
-    changed = False
-    for user_id, score in match_scores.items():
-        if score <= 0:
-            continue
-        global_scores[user_id] = global_scores.get(user_id, 0) + score
-        global_score_step_counter += 1
-        global_score_order_map[user_id] = global_score_step_counter
-        changed = True
 
-    if changed:
-        save_global_scores(global_scores)
+question_prefetchers: Dict[int, QuestionPrefetcher] = {}
 
 
-# مسابقه چندگزینه‌ای
-active_quizzes: Dict[int, "QuizSession"] = {}
-# مسابقه تشریحی (بدون گزینه) برای !question
-active_question_sessions: Dict[int, "QuestionSession"] = {}
-# مسابقه پرچم‌ها برای !flags
-active_flag_sessions: Dict[int, "FlagSession"] = {}
+def get_prefetcher(guild_id: int) -> QuestionPrefetcher:
+    prefetcher = question_prefetchers.get(guild_id)
+    if prefetcher is None:
+        prefetcher = QuestionPrefetcher(guild_id)
+        question_prefetchers[guild_id] = prefetcher
+    return prefetcher
 
 
 # ------------------ کلاس مسابقه چندگزینه‌ای (quiz) ------------------
@@ -999,6 +4012,10 @@ class QuizSession:
         self.source_stats: Dict[str, int] = {}
 
         self.started: bool = False
+        # تسک آماده‌سازی (برای لغو با !resetbot)
+        self.prepare_task: Optional[asyncio.Task] = None
+        # آماده‌سازی تدریجی بقیه‌ی سوال‌ها بعد از قابل شروع شدن مسابقه
+        self.pipeline: Optional[PreparationPipeline] = None
 
     async def preload_questions(self, ctx: commands.Context) -> bool:
         """
@@ -1012,87 +4029,108 @@ class QuizSession:
         loading_body = f"در حال دریافت و آماده‌سازی {self.num_questions} سوال از چند منبع...\nلطفاً صبر کنید."
         loading_embed = make_embed(loading_body, color_from_hex(COLOR_QUESTION_EMBED))
         loading_msg = await ctx.send(embed=loading_embed)
+        progress = LoadingProgress(loading_msg)
 
-        raw_candidates = collect_raw_mc_questions(self.num_questions)
-        if not raw_candidates:
-            error_embed = make_embed(
-                "❌ نتوانستم هیچ سوالی از سرورهای سوال‌ها دریافت کنم. لطفاً بعداً دوباره امتحان کن.",
-                color_from_hex(COLOR_TIMEOUT_ANSWER_EMBED),
+        if get_prepare_semaphore().locked():
+            await progress.update(
+                "⏳ چند کانال دیگر در حال آماده‌سازی سوال هستند؛ این مسابقه در صف است...",
+                force=True,
             )
-            await loading_msg.edit(embed=error_embed)
-            return False
+        return await self._prepare(loading_msg, progress)
+
+    async def _prepare(self, loading_msg: discord.Message, progress: LoadingProgress) -> bool:
+        """
+        بدنه‌ی preload_questions: کارهای شبکه در ترد و ترجمه/رندر در استخر آماده‌سازی
+        اجرا می‌شوند تا event loop (دکمه‌ها، تایمرها، heartbeat) آزاد بماند.
+        ترتیب منابع: بافر سوال‌های آماده‌ی سرور ← بانک محلی ← شبکه (فقط برای کمبود).
+        """
+        guild_id = self.channel.guild.id if self.channel.guild else None
+        prefetcher = get_prefetcher(guild_id) if guild_id is not None else None
 
+        # سوال‌های بافر از قبل آماده‌اند؛ بقیه به صورت تدریجی آماده می‌شوند
+        prefetched = prefetcher.take(self.num_questions) if prefetcher else []
+        random.shuffle(prefetched)
         self.prepared_questions = []
         self.asked_count = 0
+        self.pipeline = PreparationPipeline(
+            self.prepared_questions,
+            lookahead=max(PIPELINE_LOOKAHEAD, PIPELINE_START_AFTER),
+        )
+        for pq in prefetched:
+            self.pipeline.put(pq)
+
+        need = self.num_questions - len(prefetched)
+        # اول فقط به اندازه‌ی شروع مسابقه، بعد بقیه (زمان تا سوال اول مستقل از تعداد سوال‌ها)
+        head = min(need, max(0, PIPELINE_START_AFTER - len(prefetched)))
+        chunks = [n for n in (head, need - head) if n > 0]
+        # سقف کانال‌های هم‌زمان برای هر مرحله‌ی دریافت/رندر گرفته می‌شود، نه فقط تا شروع مسابقه؛
+        # تولیدکننده‌ای که منتظر جا (backpressure) است جای کانال دیگری را نمی‌گیرد
+        semaphore = get_prepare_semaphore()
+
+        async def produce():
+            chosen = {pq.content_hash for pq in prefetched}
+            for chunk in chunks:
+                async with semaphore:
+                    items = await draw_quiz_items(chunk, progress, guild_id, chosen)
+                chosen.update(question_content_hash(bq.question_en, bq.correct_en) for bq in items)
+                random.shuffle(items)
+                cursor = 0
+                while cursor < len(items):
+                    await self.pipeline.wait_for_room()
+                    batch = items[cursor:cursor + self.pipeline.room()]
+                    cursor += len(batch)
+                    async with semaphore:
+                        rendered = await render_quiz_questions(
+                            batch,
+                            progress,
+                            done_before=len(self.prepared_questions),
+                            total=self.num_questions,
+                        )
+                    for pq in rendered:
+                        self.pipeline.put(pq)
+            self._on_pipeline_done()
+
+        self.pipeline.start(produce())
+        try:
+            await self.pipeline.wait_ready(min(PIPELINE_START_AFTER, self.num_questions))
 
-        for raw in raw_candidates:
-            if len(self.prepared_questions) >= self.num_questions:
-                break
-
-            question_en = raw.question_en
-            correct_en = raw.correct_en
-            incorrects_en = raw.incorrects_en
-
-            # یک فیلتر اضافی روی طول انگلیسی (برای اطمینان)
-            if len(question_en) > MAX_QUESTION_CHARS * 2:
-                continue
-
-            # ترجمه سوال با Argos
-            question_fa = translate_en_to_fa(question_en) or question_en
-
-            options_en = list(incorrects_en) + [correct_en]
-            if len(options_en) != 4:
-                continue
-
-            random.shuffle(options_en)
-            correct_index = options_en.index(correct_en)
-
-            options_fa: List[str] = []
-            too_long_option = False
-            for opt_en in options_en:
-                opt_fa = translate_en_to_fa(opt_en) or opt_en
-                # اگر ترجمه خیلی طولانی شود، ردش می‌کنیم
-                if len(opt_fa) > MAX_OPTION_CHARS:
-                    too_long_option = True
-                options_fa.append(opt_fa)
-
-            if too_long_option:
-                continue
-
-            correct_text_fa = options_fa[correct_index]
-
-            question_file = render_question_image(question_fa, options_fa)
-
-            pq = PreparedQuizQuestion(
-                question_fa=question_fa,
-                options_fa=options_fa,
-                correct_index=correct_index,
-                correct_text_fa=correct_text_fa,
-                file=question_file,
-                source=raw.source,
-                family=raw.family,
-            )
-            self.prepared_questions.append(pq)
+            # بعد از قابل شروع شدن، پیشرفت دیگر روی امبد لودینگ نوشته نمی‌شود
+            progress.message = None
 
-            progress_body = f"{len(self.prepared_questions)}/{self.num_questions} سوال آماده شد..."
-            progress_embed = make_embed(progress_body, color_from_hex(COLOR_QUESTION_EMBED))
-            try:
-                await loading_msg.edit(embed=progress_embed)
-            except Exception:
-                pass
+            if not self.prepared_questions:
+                self.pipeline.cancel()
+                error_embed = make_embed(
+                    "❌ نتوانستم هیچ سوالی از سرورهای سوال‌ها دریافت کنم. لطفاً بعداً دوباره امتحان کن.",
+                    color_from_hex(COLOR_TIMEOUT_ANSWER_EMBED),
+                )
+                await loading_msg.edit(embed=error_embed)
+                return False
 
-        if not self.prepared_questions:
-            error_embed = make_embed(
-                "❌ نتوانستم سوال مناسبی پیدا کنم. لطفاً دوباره امتحان کن.",
-                color_from_hex(COLOR_TIMEOUT_ANSWER_EMBED),
-            )
-            await loading_msg.edit(embed=error_embed)
-            return False
+            if not self.pipeline.running:
+                ready_body = (
+                    f"✅ همه سوال‌ها آماده شدند.\n"
+                    f"{self.num_questions} سوال با موفقیت آماده شد.\n\n"
+                    "برای شروع مسابقه دستور `!start` را بزن."
+                )
+            else:
+                self._update_stats()
+                ready_body = (
+                    f"✅ مسابقه آماده‌ی شروع است.\n"
+                    f"{len(self.prepared_questions)} سوال آماده شد و بقیه‌ی {self.num_questions} سوال "
+                    f"هم‌زمان با مسابقه آماده می‌شوند.\n\n"
+                    "برای شروع مسابقه دستور `!start` را بزن."
+                )
+            ready_embed = make_embed(ready_body, color_from_hex(COLOR_CORRECT_PLAYER_EMBED))
+            await loading_msg.edit(embed=ready_embed)
 
-        # ممکن است به دلایلی کمی کمتر از تعداد درخواستی آماده شده باشد
-        self.num_questions = len(self.prepared_questions)
+            return True
+        except BaseException:
+            # اگر شروع مسابقه شکست بخورد (یا لغو شود) تولیدکننده نباید در پس‌زمینه بماند
+            self.pipeline.cancel()
+            raise
 
-        # محاسبه‌ی آمار خانواده‌ها و منبع‌ها برای این مسابقه
+    def _update_stats(self):
+        """آمار خانواده‌ها و منبع‌های سوال‌های آماده‌شده تا این لحظه."""
         self.family_stats = {}
         self.source_stats = {}
         for pq in self.prepared_questions:
@@ -1101,15 +4139,20 @@ class QuizSession:
             self.family_stats[fam] = self.family_stats.get(fam, 0) + 1
             self.source_stats[src] = self.source_stats.get(src, 0) + 1
 
-        ready_body = (
-            f"✅ همه سوال‌ها آماده شدند.\n"
-            f"{self.num_questions} سوال با موفقیت آماده شد.\n\n"
-            "برای شروع مسابقه دستور `!start` را بزن."
-        )
-        ready_embed = make_embed(ready_body, color_from_hex(COLOR_CORRECT_PLAYER_EMBED))
-        await loading_msg.edit(embed=ready_embed)
+    def _on_pipeline_done(self):
+        """پایان آماده‌سازی همه‌ی سوال‌ها: تعداد نهایی، آمار و پر کردن دوباره‌ی بافر سرور."""
+        # ممکن است به دلایلی کمی کمتر از تعداد درخواستی آماده شده باشد
+        if self.prepared_questions:
+            self.num_questions = len(self.prepared_questions)
+        self._update_stats()
 
-        return True
+        print(f"[Knight_Quiz] کش ترجمه بعد از آماده‌سازی: {TRANSLATION_CACHE.stats_line()}")
+        print(f"[Knight_Quiz] encode تصویرها: {ENCODE_STATS.stats_line()}")
+        print(f"[Knight_Quiz] کش تصویرها: {RENDER_CACHE.stats_line()}")
+
+        # بافر این سرور برای مسابقه‌ی بعدی دوباره پر می‌شود
+        if self.channel.guild:
+            get_prefetcher(self.channel.guild.id).ensure_refill()
 
     async def quiz_countdown(self, timer_message: discord.Message, question_id: int):
         """
@@ -1161,7 +4204,16 @@ class QuizSession:
         if self.finished:
             return
 
-        if self.asked_count >= self.num_questions or self.asked_count >= len(self.prepared_questions):
+        # سوال بعدی ممکن است هنوز در حال آماده‌سازی پس‌زمینه باشد
+        prepared = None
+        if self.asked_count < self.num_questions:
+            if self.pipeline is not None:
+                prepared = await self.pipeline.get(self.asked_count)
+            elif self.asked_count < len(self.prepared_questions):
+                prepared = self.prepared_questions[self.asked_count]
+        if self.finished:
+            return
+        if prepared is None:
             await self.finish_quiz()
             return
 
@@ -1171,8 +4223,8 @@ class QuizSession:
         self.current_question_id += 1
         question_id = self.current_question_id
 
-        prepared = self.prepared_questions[self.asked_count]
         self.asked_count += 1
+        SEEN_HISTORY.mark(self.channel.guild.id if self.channel.guild else None, prepared.content_hash)
 
         self.current_correct_answer = prepared.correct_index
         self.current_correct_text_fa = prepared.correct_text_fa
@@ -1183,16 +4235,13 @@ class QuizSession:
         body = f"سوال {self.asked_count} از {self.num_questions}:"
         embed = make_embed(body, color_from_hex(COLOR_QUESTION_EMBED))
 
-        if prepared.file is not None:
-            embed.set_image(url="attachment://question.jpg")
-            msg = await self.channel.send(embed=embed, view=view, file=prepared.file)
-        else:
+        if prepared.image is None:
             lines = [body, "", prepared.question_fa, ""]
             for i, opt in enumerate(prepared.options_fa, start=1):
                 lines.append(f"{i}_ {opt}")
             fallback_body = "\n".join(lines)
             embed = make_embed(fallback_body, color_from_hex(COLOR_QUESTION_EMBED))
-            msg = await self.channel.send(embed=embed, view=view)
+        msg = await send_with_image(self.channel, embed, prepared.image, view=view)
 
         self.current_question_message = msg
 
@@ -1238,6 +4287,8 @@ class QuizSession:
 
     async def finish_quiz(self):
         self.finished = True
+        if getattr(self, "pipeline", None) is not None:
+            self.pipeline.cancel()
         await self.channel.send("# پایان مسابقه ⏰")
 
         embed = build_scores_embed(
@@ -1250,7 +4301,7 @@ class QuizSession:
         await self.channel.send(embed=embed)
 
         # ✅ بعد از پایان مسابقه، امتیازهای این مسابقه به امتیاز کلی اضافه می‌شود
-        add_match_scores_to_global(self.scores)
+        await add_match_scores_to_global(score_guild_id(self.channel.guild), self.scores)
 
         if self.channel.id in active_quizzes:
             del active_quizzes[self.channel.id]
@@ -1269,6 +4320,10 @@ class FlagSession:
         self.finished = False
         self.question_resolved = False
         self.started: bool = False
+        # تسک آماده‌سازی (برای لغو با !resetbot)
+        self.prepare_task: Optional[asyncio.Task] = None
+        # آماده‌سازی تدریجی بقیه‌ی سوال‌ها بعد از قابل شروع شدن مسابقه
+        self.pipeline: Optional[PreparationPipeline] = None
 
         self.current_correct_answer: Optional[int] = None
         self.current_correct_text_fa: Optional[str] = None
@@ -1294,7 +4349,12 @@ class FlagSession:
         loading_embed = make_embed(loading_body, color_from_hex(COLOR_QUESTION_EMBED))
         loading_msg = await ctx.send(embed=loading_embed)
 
-        all_countries = load_flag_countries()
+        # اگر لیست کشورها هنوز لود نشده، برای ترجمه‌ی نام‌ها منتظر مترجم می‌مانیم
+        if not FLAG_COUNTRIES and ARGOS_STATE == "loading":
+            await LoadingProgress(loading_msg).update("⏳ مترجم در حال آماده شدن است...", force=True)
+            await wait_for_argos()
+
+        all_countries = await load_flag_countries()
         if not all_countries or len(all_countries) < 4:
             error_embed = make_embed(
                 "❌ نتوانستم پرچم‌های کافی از سرور دریافت کنم. لطفاً بعداً دوباره امتحان کن.",
@@ -1306,39 +4366,59 @@ class FlagSession:
         if self.num_questions > len(all_countries):
             self.num_questions = len(all_countries)
 
-        # انتخاب کشورها بدون تکرار برای این مسابقه
-        selected_countries = random.sample(all_countries, self.num_questions)
+        # انتخاب کشورها بدون تکرار برای این مسابقه؛
+        # پرچم‌هایی که اخیراً در این سرور پرسیده شده‌اند فقط در صورت کمبود انتخاب می‌شوند
+        guild_id = self.channel.guild.id if self.channel.guild else None
+        fresh = [c for c in all_countries if not SEEN_HISTORY.contains(guild_id, seen_key("flag", c.flag_url))]
+        selected_countries = random.sample(fresh, min(self.num_questions, len(fresh)))
+        if len(selected_countries) < self.num_questions:
+            repeats = [c for c in all_countries if c not in selected_countries]
+            selected_countries += random.sample(repeats, self.num_questions - len(selected_countries))
 
         self.prepared_questions = []
         self.asked_count = 0
+        self.pipeline = PreparationPipeline(
+            self.prepared_questions,
+            lookahead=max(PIPELINE_LOOKAHEAD, PIPELINE_START_AFTER),
+        )
 
-        for idx, correct_country in enumerate(selected_countries, start=1):
-            # ۳ کشور اشتباه (بدون تکرار و غیر از کشور صحیح)
-            wrong_pool = [c for c in all_countries if c is not correct_country]
-            if len(wrong_pool) < 3:
-                continue
-            wrong_countries = random.sample(wrong_pool, 3)
+        progress = LoadingProgress(loading_msg)
 
-            options_fa = [correct_country.name_fa] + [w.name_fa for w in wrong_countries]
-            random.shuffle(options_fa)
-            correct_index = options_fa.index(correct_country.name_fa)
+        async def produce():
+            for correct_country in selected_countries:
+                # ۳ کشور اشتباه (بدون تکرار و غیر از کشور صحیح)
+                wrong_pool = [c for c in all_countries if c is not correct_country]
+                if len(wrong_pool) < 3:
+                    continue
+                wrong_countries = random.sample(wrong_pool, 3)
 
-            pq = PreparedFlagQuestion(
-                flag_url=correct_country.flag_url,
-                options_fa=options_fa,
-                correct_index=correct_index,
-                correct_text_fa=correct_country.name_fa,
-            )
-            self.prepared_questions.append(pq)
+                options_fa = [correct_country.name_fa] + [w.name_fa for w in wrong_countries]
+                random.shuffle(options_fa)
+                correct_index = options_fa.index(correct_country.name_fa)
 
-            progress_body = f"{len(self.prepared_questions)}/{self.num_questions} سوال آماده شد..."
-            progress_embed = make_embed(progress_body, color_from_hex(COLOR_QUESTION_EMBED))
-            try:
-                await loading_msg.edit(embed=progress_embed)
-            except Exception:
-                pass
+                await self.pipeline.wait_for_room()
+                self.pipeline.put(PreparedFlagQuestion(
+                    flag_url=correct_country.flag_url,
+                    options_fa=options_fa,
+                    correct_index=correct_index,
+                    correct_text_fa=correct_country.name_fa,
+                    image=await prepare_flag_image(correct_country.flag_url),
+                ))
+                await progress.update(f"{len(self.prepared_questions)}/{self.num_questions} سوال آماده شد...")
+
+            # در صورت فیلتر شدن بعضی سوال‌ها ممکن است کمتر از num_questions شود
+            if self.prepared_questions:
+                self.num_questions = len(self.prepared_questions)
+
+        self.pipeline.start(produce())
+        await self.pipeline.wait_ready(min(PIPELINE_START_AFTER, self.num_questions))
+        progress.message = None
+
+        # بقیه‌ی پرچم‌ها برای مسابقه‌های بعدی در پس‌زمینه دانلود می‌شوند
+        schedule_flag_asset_prefetch(all_countries)
 
         if not self.prepared_questions:
+            self.pipeline.cancel()
             error_embed = make_embed(
                 "❌ نتوانستم سوال مناسبی برای پرچم‌ها بسازم. لطفاً دوباره امتحان کن.",
                 color_from_hex(COLOR_TIMEOUT_ANSWER_EMBED),
@@ -1346,14 +4426,19 @@ class FlagSession:
             await loading_msg.edit(embed=error_embed)
             return False
 
-        # در صورت فیلتر شدن بعضی سوال‌ها ممکن است کمتر از num_questions شود
-        self.num_questions = len(self.prepared_questions)
-
-        ready_body = (
-            f"✅ سوال‌های مسابقه پرچم‌ها آماده شدند.\n"
-            f"{self.num_questions} سوال با موفقیت آماده شد.\n\n"
-            "برای شروع مسابقه دستور `!start` را بزن."
-        )
+        if not self.pipeline.running:
+            ready_body = (
+                f"✅ سوال‌های مسابقه پرچم‌ها آماده شدند.\n"
+                f"{self.num_questions} سوال با موفقیت آماده شد.\n\n"
+                "برای شروع مسابقه دستور `!start` را بزن."
+            )
+        else:
+            ready_body = (
+                f"✅ مسابقه پرچم‌ها آماده‌ی شروع است.\n"
+                f"{len(self.prepared_questions)} سوال آماده شد و بقیه‌ی {self.num_questions} سوال "
+                f"هم‌زمان با مسابقه آماده می‌شوند.\n\n"
+                "برای شروع مسابقه دستور `!start` را بزن."
+            )
         ready_embed = make_embed(ready_body, color_from_hex(COLOR_CORRECT_PLAYER_EMBED))
         await loading_msg.edit(embed=ready_embed)
 
@@ -1410,7 +4495,16 @@ class FlagSession:
         if self.finished:
             return
 
-        if self.asked_count >= self.num_questions or self.asked_count >= len(self.prepared_questions):
+        # سوال بعدی ممکن است هنوز در حال آماده‌سازی پس‌زمینه باشد
+        prepared = None
+        if self.asked_count < self.num_questions:
+            if self.pipeline is not None:
+                prepared = await self.pipeline.get(self.asked_count)
+            elif self.asked_count < len(self.prepared_questions):
+                prepared = self.prepared_questions[self.asked_count]
+        if self.finished:
+            return
+        if prepared is None:
             await self.finish_quiz()
             return
 
@@ -1419,8 +4513,11 @@ class FlagSession:
         self.current_question_id += 1
         question_id = self.current_question_id
 
-        prepared = self.prepared_questions[self.asked_count]
         self.asked_count += 1
+        SEEN_HISTORY.mark(
+            self.channel.guild.id if self.channel.guild else None,
+            seen_key("flag", prepared.flag_url),
+        )
 
         self.current_correct_answer = prepared.correct_index
         self.current_correct_text_fa = prepared.correct_text_fa
@@ -1432,9 +4529,11 @@ class FlagSession:
         body = f"سوال {self.asked_count} از {self.num_questions}\n**پرچم کدوم کشوره؟**"
         embed = make_embed(body, color_from_hex(COLOR_QUESTION_EMBED))
 
-        # تصویر پرچم از URL
-        embed.set_image(url=prepared.flag_url)
-        msg = await self.channel.send(embed=embed, view=view)
+        # تصویر پرچم: فایل محلی به صورت attachment (همه هم‌زمان و یکسان می‌بینند)،
+        # و اگر فایل محلی نبود، از URL
+        if prepared.image is None:
+            embed.set_image(url=prepared.flag_url)
+        msg = await send_with_image(self.channel, embed, prepared.image, view=view)
         self.current_question_message = msg
 
         # امبد تایمر ۱۰ ثانیه‌ای
@@ -1478,6 +4577,8 @@ class FlagSession:
 
     async def finish_quiz(self):
         self.finished = True
+        if self.pipeline is not None:
+            self.pipeline.cancel()
         await self.channel.send("# پایان مسابقه پرچم‌ها ⏰")
 
         embed = build_scores_embed(
@@ -1490,7 +4591,7 @@ class FlagSession:
         await self.channel.send(embed=embed)
 
         # ✅ بعد از پایان مسابقه، امتیازهای این مسابقه به امتیاز کلی اضافه می‌شود
-        add_match_scores_to_global(self.scores)
+        await add_match_scores_to_global(score_guild_id(self.channel.guild), self.scores)
 
         if self.channel.id in active_flag_sessions:
             del active_flag_sessions[self.channel.id]
@@ -1556,6 +4657,8 @@ class QuestionSession:
         self.finished = False
         self.question_resolved = False
         self.started: bool = False
+        # تسک آماده‌سازی (برای لغو با !resetbot)
+        self.prepare_task: Optional[asyncio.Task] = None
 
         self.current_correct_text_fa: Optional[str] = None
         self.current_correct_text_en: Optional[str] = None  # برای سازگاری با تابع مقایسه
@@ -1589,16 +4692,24 @@ class QuestionSession:
         if self.num_questions > total_available:
             self.num_questions = total_available
 
-        indices = list(range(total_available))
-        random.shuffle(indices)
+        # سوال‌هایی که اخیراً در این سرور پرسیده شده‌اند فقط در صورت کمبود انتخاب می‌شوند
+        guild_id = self.channel.guild.id if self.channel.guild else None
+        selected = TXT_QUESTION_INDEX.sample(
+            self.num_questions,
+            is_excluded=lambda q: SEEN_HISTORY.contains(guild_id, txt_question_key(q)),
+        )
+        if len(selected) < self.num_questions:
+            chosen = {id(q) for q in selected}
+            selected += TXT_QUESTION_INDEX.sample(
+                self.num_questions - len(selected),
+                is_excluded=lambda q: id(q) in chosen,
+            )
 
         self.questions = []
-        for i in range(self.num_questions):
-            idx = indices[i]
-            self.questions.append(TXT_QUESTION_BANK[idx])
-            progress_body = f"{i+1}/{self.num_questions} سوال آماده شد..."
-            progress_embed = make_embed(progress_body, color_from_hex(COLOR_QUESTION_EMBED))
-            await loading_msg.edit(embed=progress_embed)
+        progress = LoadingProgress(loading_msg)
+        for i, q in enumerate(selected):
+            self.questions.append(q)
+            await progress.update(f"{i+1}/{self.num_questions} سوال آماده شد...")
 
         ready_body = (
             f"✅ سوال‌های مسابقه تشریحی آماده شدند.\n"
@@ -1626,7 +4737,7 @@ class QuestionSession:
             total_available = len(TXT_QUESTION_BANK)
             if self.num_questions > total_available:
                 self.num_questions = total_available
-            self.questions = random.sample(TXT_QUESTION_BANK, self.num_questions)
+            self.questions = TXT_QUESTION_INDEX.sample(self.num_questions)
 
         start_body = "مسابقه شروع شد 📢"
         start_embed = make_embed(start_body, color_from_hex(COLOR_QUESTION_EMBED))
@@ -1696,16 +4807,16 @@ class QuestionSession:
             body = f"سوال {question_number} از {self.num_questions}:"
             embed = make_embed(body, color_from_hex(COLOR_QUESTION_EMBED))
 
-            question_file = render_question_only_image(question_fa)
+            image_bytes = await run_blocking(render_question_only_image_bytes, question_fa)
+            question_image = prepared_image(image_bytes, f"question_open.{IMAGE_EXT}")
 
-            if question_file is not None:
-                embed.set_image(url="attachment://question_open.jpg")
-                await self.channel.send(embed=embed, file=question_file)
-            else:
+            if question_image is None:
                 lines = [body, "", question_fa]
                 fallback_body = "\n".join(lines)
                 embed = make_embed(fallback_body, color_from_hex(COLOR_QUESTION_EMBED))
-                await self.channel.send(embed=embed)
+            await send_with_image(self.channel, embed, question_image)
+            # فقط سوالی که واقعاً فرستاده شد در تاریخچه ثبت می‌شود (نه سوال‌های ردشده)
+            SEEN_HISTORY.mark(self.channel.guild.id if self.channel.guild else None, txt_question_key(q_data))
 
             # ست کردن آیدی سوال برای هماهنگی
             self.current_question_id += 1
@@ -1836,6 +4947,8 @@ class QuestionSession:
 
     async def finish_quiz(self):
         self.finished = True
+        if getattr(self, "pipeline", None) is not None:
+            self.pipeline.cancel()
         await self.channel.send("# پایان مسابقه ⏰")
 
         embed = build_scores_embed(
@@ -1848,7 +4961,7 @@ class QuestionSession:
         await self.channel.send(embed=embed)
 
         # ✅ بعد از پایان مسابقه تشریحی، امتیازهای مثبت این مسابقه به امتیاز کلی اضافه می‌شود
-        add_match_scores_to_global(self.scores)
+        await add_match_scores_to_global(score_guild_id(self.channel.guild), self.scores)
 
         if self.channel.id in active_question_sessions:
             del active_question_sessions[self.channel.id]
@@ -1921,6 +5034,24 @@ class AnswerView(discord.ui.View):
 
 
 # ------------------ ایونت ها و کامندها ------------------
+@bot.event
+async def setup_hook():
+    # لود مدل ترجمه در پس‌زمینه، قبل از اولین !quiz یا !flags
+    start_argos_warmup()
+    # امتیازهای سرورهای بی‌استفاده به‌طور دوره‌ای از حافظه خارج می‌شوند
+    GUILD_SCORES.start_sweeper()
+    # لیست کشورها از کش محلی (و در صورت نیاز تازه کردن در پس‌زمینه)
+    asyncio.create_task(preload_flag_countries())
+
+
+async def preload_flag_countries():
+    # اگر کشی نیست، نام‌های بدون ترجمه‌ی آماده باید با مترجم آماده ترجمه شوند
+    if not os.path.exists(FLAG_CACHE_PATH):
+        await wait_for_argos()
+    countries = await load_flag_countries()
+    schedule_flag_asset_prefetch(countries)
+
+
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user} (ID: {bot.user.id})")
@@ -1930,6 +5061,10 @@ async def on_ready():
     except Exception as e:
         print(f"❌ Error syncing commands: {e}")
 
+    # بافر سوال‌های آماده‌ی سرور مجاز را از همین حالا پر می‌کنیم
+    if ALLOWED_GUILD_ID:
+        get_prefetcher(ALLOWED_GUILD_ID).ensure_refill()
+
     # اگر بات روی چند سرور باشد، به جز سرور مجاز از بقیه لفت می‌دهد
     if ALLOWED_GUILD_ID:
         for guild in bot.guilds:
@@ -2069,7 +5204,8 @@ HELP_BODY = (
     f"• `{BOT_PREFIX}flags [تعداد]` — آماده‌سازی مسابقه پرچم‌شناسی چهارگزینه‌ای.\n\n"
     f"• `{BOT_PREFIX}question [تعداد]` — آماده‌سازی مسابقه تشریحی.\n\n"
     f"• `{BOT_PREFIX}start` — شروع مسابقه‌ای که با `!quiz` یا `!question` یا `!flags` آماده شده است.\n\n"
-    f"• `{BOT_PREFIX}top` — نمایش بهترین بازیکنان تاریخ این بازی‌ها.\n\n"
+    f"• `{BOT_PREFIX}top` — نمایش بهترین بازیکنان تاریخ این بازی‌ها (با دکمه‌های صفحه‌ی قبل/بعد).\n\n"
+    f"• `{BOT_PREFIX}rank [@player]` — رتبه و امتیاز کلی تو (یا بازیکن منشن‌شده).\n\n"
     f"• `{BOT_PREFIX}resetbot` — ریست کردن مسابقه‌های در حال اجرا.\n\n"
     f"• `{BOT_PREFIX}point @player ±N` — کم/زیاد کردن امتیاز کلی بازیکن (فقط Administrator).\n"
 )
@@ -2105,6 +5241,22 @@ async def help_text_cmd(ctx: commands.Context):
         await ctx.send(embed=embed)
 
 
+async def run_preload(session, ctx: commands.Context) -> bool:
+    """
+    preload_questions را به شکل یک تسک قابل لغو اجرا می‌کند
+    تا !resetbot بتواند آماده‌سازی نیمه‌کاره را متوقف کند.
+    """
+    session.prepare_task = asyncio.create_task(session.preload_questions(ctx))
+    try:
+        return await session.prepare_task
+    except asyncio.CancelledError:
+        if not session.prepare_task.cancelled():
+            raise
+        return False
+    finally:
+        session.prepare_task = None
+
+
 # کامند !quiz برای آماده‌سازی مسابقه چندگزینه‌ای (برای همه آزاد است)
 @bot.command(name="quiz")
 async def quiz_cmd(ctx: commands.Context, num_questions: Optional[int] = None):
@@ -2126,7 +5278,7 @@ async def quiz_cmd(ctx: commands.Context, num_questions: Optional[int] = None):
     session = QuizSession(ctx.channel, num_questions=num_questions)
     active_quizzes[ctx.channel.id] = session
 
-    success = await session.preload_questions(ctx)
+    success = await run_preload(session, ctx)
     if not success:
         if ctx.channel.id in active_quizzes:
             del active_quizzes[ctx.channel.id]
@@ -2155,7 +5307,7 @@ async def flags_cmd(ctx: commands.Context, num_questions: Optional[int] = None):
     session = FlagSession(ctx.channel, num_questions=num_questions)
     active_flag_sessions[ctx.channel.id] = session
 
-    success = await session.preload_questions(ctx)
+    success = await run_preload(session, ctx)
     if not success:
         if ctx.channel.id in active_flag_sessions:
             del active_flag_sessions[ctx.channel.id]
@@ -2188,7 +5340,7 @@ async def question_cmd(ctx: commands.Context, num_questions: Optional[int] = Non
     session = QuestionSession(ctx.channel, num_questions=num_questions)
     active_question_sessions[ctx.channel.id] = session
 
-    success = await session.preload_questions(ctx)
+    success = await run_preload(session, ctx)
     if not success:
         if ctx.channel.id in active_question_sessions:
             del active_question_sessions[ctx.channel.id]
@@ -2257,32 +5409,91 @@ async def start_cmd(ctx: commands.Context):
 
 
 # کامند !top
-@bot.command(name="top", aliases=["toprank", "topRank"])
-async def top_cmd(ctx: commands.Context, limit: int = 10):
-    global global_scores, global_score_order_map
+def build_top_page_embed(guild: discord.Guild, ns: GuildScores, page: int, page_size: int) -> discord.Embed:
+    """امبد صفحه‌ی page (از ۱) رتبه‌بندی کلی سرور."""
+    pages = max(1, math.ceil(len(ns.leaderboard) / page_size))
+    page = min(max(1, page), pages)
+    offset = (page - 1) * page_size
+    page_scores = ns.leaderboard.page(offset, page_size)
 
-    if not global_scores:
+    body_prefix = "🏆 بهترین بازیکنان تاریخ این بازی‌ها:"
+    if pages > 1:
+        body_prefix += f"\n(صفحه {page} از {pages})"
+    return build_scores_embed(
+        guild=guild,
+        scores=dict(page_scores),
+        description_prefix=body_prefix,
+        color_hex=COLOR_TOPRANK_EMBED,
+        order_map=ns.order_map,
+        start_rank=offset + 1,
+    )
+
+
+class TopPageView(discord.ui.View):
+    """دکمه‌های صفحه‌ی قبل/بعد زیر امبد !top."""
+
+    def __init__(self, guild: discord.Guild, page_size: int):
+        super().__init__(timeout=TOP_VIEW_TIMEOUT)
+        self.guild = guild
+        self.page_size = page_size
+        self.page = 1
+        self.message: Optional[discord.Message] = None
+
+        for label, step in (("◀", -1), ("▶", 1)):
+            button = discord.ui.Button(label=label, style=discord.ButtonStyle.secondary)
+            button.callback = self.make_callback(step)
+            self.add_item(button)
+
+    def make_callback(self, step: int):
+        async def callback(interaction: discord.Interaction):
+            ns = await GUILD_SCORES.get(score_guild_id(self.guild))
+            pages = max(1, math.ceil(len(ns.leaderboard) / self.page_size))
+            self.page = min(max(1, self.page + step), pages)
+            embed = build_top_page_embed(self.guild, ns, self.page, self.page_size)
+            await interaction.response.edit_message(embed=embed, view=self)
+        return callback
+
+    async def on_timeout(self):
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(view=None)
+        except Exception:
+            pass
+
+
+@bot.command(name="top", aliases=["toprank", "topRank"])
+async def top_cmd(ctx: commands.Context, limit: int = TOP_PAGE_SIZE):
+    ns = await GUILD_SCORES.get(score_guild_id(ctx.guild))
+    if not len(ns.leaderboard):
         await ctx.send("هنوز هیچ امتیاز کلی ثبت نشده است.")
         return
 
-    def sort_key(item):
-        user_id, score = item
-        order_value = global_score_order_map.get(user_id, 10**9)
-        return (-score, order_value)
+    page_size = min(max(1, limit), TOP_PAGE_MAX_SIZE)
+    embed = build_top_page_embed(ctx.guild, ns, 1, page_size)
+    if len(ns.leaderboard) <= page_size:
+        await ctx.send(embed=embed)
+        return
 
-    sorted_scores = sorted(global_scores.items(), key=sort_key)
-    sorted_scores = sorted_scores[:limit]
+    view = TopPageView(ctx.guild, page_size)
+    view.message = await ctx.send(embed=embed, view=view)
 
-    scores_for_embed = {user_id: score for user_id, score in sorted_scores}
 
-    body_prefix = "🏆 بهترین بازیکنان تاریخ این بازی‌ها:"
-    embed = build_scores_embed(
-        guild=ctx.guild,
-        scores=scores_for_embed,
-        description_prefix=body_prefix,
-        color_hex=COLOR_TOPRANK_EMBED,
-        order_map=global_score_order_map,
+# کامند !rank [@player]
+@bot.command(name="rank")
+async def rank_cmd(ctx: commands.Context, member: Optional[discord.Member] = None):
+    member = member or ctx.author
+    ns = await GUILD_SCORES.get(score_guild_id(ctx.guild))
+    rank = ns.leaderboard.rank(member.id)
+    if rank is None:
+        await ctx.send(f"ℹ️ هنوز هیچ امتیاز کلی برای {member.mention} ثبت نشده است.")
+        return
+
+    body = (
+        f"🏅 رتبه‌ی کلی {member.mention}: **{rank}** از {len(ns.leaderboard)}\n"
+        f"امتیاز کلی: **{ns.scores.get(member.id, 0)}**"
     )
+    embed = make_embed(body, color_from_hex(COLOR_TOPRANK_EMBED))
     await ctx.send(embed=embed)
 
 
@@ -2377,17 +5588,28 @@ async def resetbot_cmd(ctx: commands.Context):
     global active_quizzes, active_flag_sessions, active_question_sessions
 
     # همه مسابقه‌های در حال اجرا را خاتمه‌خورده علامت می‌کنیم
-    for s in list(active_quizzes.values()):
-        s.finished = True
-    for s in list(active_flag_sessions.values()):
-        s.finished = True
-    for s in list(active_question_sessions.values()):
+    # و آماده‌سازی‌های نیمه‌کاره را لغو می‌کنیم
+    all_sessions = (
+        list(active_quizzes.values())
+        + list(active_flag_sessions.values())
+        + list(active_question_sessions.values())
+    )
+    for s in all_sessions:
         s.finished = True
+        if s.prepare_task is not None and not s.prepare_task.done():
+            s.prepare_task.cancel()
+        if getattr(s, "pipeline", None) is not None:
+            s.pipeline.cancel()
 
     active_quizzes.clear()
     active_flag_sessions.clear()
     active_question_sessions.clear()
 
+    # امتیازهای در صف قبل از ادامه روی دیسک نوشته می‌شوند
+    await SCORE_WRITER.flush()
+    print(f"[Knight_Quiz] نوشتن امتیازها: {SCORE_WRITER.stats_line()}")
+    print(f"[Knight_Quiz] امتیازهای سرورها: {GUILD_SCORES.stats_line()}")
+
     embed = make_embed(
         "♻ بات ریست شد ، الان دوباره میتونی دستور مسابقه ها رو اجرا کنی",
         discord.Color.blue()
@@ -2398,26 +5620,116 @@ async def resetbot_cmd(ctx: commands.Context):
 # کامند !point @player ±N — فقط Administrator
 @bot.command(name="point")
 async def point_cmd(ctx: commands.Context, member: discord.Member, amount: int):
-    global global_scores, global_score_order_map, global_score_step_counter
-
     if not ctx.author.guild_permissions.administrator:
         await ctx.send("⛔ فقط ادمین های سرور (با پرمیشن **Administrator**) می‌توانند از دستور `!point` استفاده کنند.")
         return
 
-    global_scores[member.id] = global_scores.get(member.id, 0) + amount
-    global_score_step_counter += 1
-    global_score_order_map[member.id] = global_score_step_counter
-    save_global_scores(global_scores)
-
-    new_score = global_scores[member.id]
+    ns = await GUILD_SCORES.get(score_guild_id(ctx.guild))
+    new_scores = ns.apply({member.id: amount}, "point")
+    new_score = new_scores[member.id]
     sign = "+" if amount >= 0 else ""
     body = f"امتیاز کلی {member.mention} {sign}{amount} تغییر کرد.\nامتیاز جدید: **{new_score}**"
     embed = make_embed(body, color_from_hex(COLOR_TOPRANK_EMBED))
     await ctx.send(embed=embed)
 
 
+async def run_bot():
+    """اجرای بات؛ بعد از خاموش شدن، منابع مشترک (اتصال‌های HTTP) بسته می‌شوند."""
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await close_http_session()
+            SEEN_HISTORY.save()
+            await SCORE_WRITER.close()
+            print(f"[Knight_Quiz] نوشتن امتیازها: {SCORE_WRITER.stats_line()}")
+            print(f"[Knight_Quiz] امتیازهای سرورها: {GUILD_SCORES.stats_line()}")
+            SCORE_STORE.close()
+
+
+def bench_render(iterations: int = 50):
+    """
+    میکروبنچمارک شکستن خط روی سوال‌های بلند فارسی:
+    روش قدیمی (شکل‌دهی و اندازه‌گیری کل خط برای هر کلمه) در برابر TextMeasurer
+    (کش سرد و گرم)، به‌علاوه‌ی زمان کل رندر یک تصویر.
+    """
+    sentence = "در کدام سال و در کدام شهر نخستین دوره‌ی بازی‌های المپیک تابستانی دوران مدرن برگزار شد"
+    questions = [" ".join([sentence] * n) for n in (1, 2, 3)]
+
+    base = RENDER_CONTEXT.background() or Image.new("RGBA", (1280, 853))
+    draw = ImageDraw.Draw(base)
+    font = RENDER_CONTEXT.font(QUESTION_FONT_SIZE)
+    max_width = base.width - 160
+
+    def wrap_uncached(text: str) -> list:
+        lines, current = [], ""
+        for word in text.split(" "):
+            test_line = (current + " " + word).strip()
+            bbox = draw.textbbox((0, 0), shape_text(test_line), font=font, stroke_width=TEXT_STROKE_WIDTH)
+            if bbox[2] - bbox[0] <= max_width or not current:
+                current = test_line
+            else:
+                lines.append(current)
+                current = word
+        if current:
+            lines.append(current)
+        return lines
+
+    def timed(func) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) / iterations * 1000
+
+    for text in questions:
+        assert wrap_uncached(text) == _wrap_text(draw, text, font, max_width)
+        old_ms = timed(lambda: wrap_uncached(text))
+
+        def cold():
+            TEXT_MEASURER.clear()
+            _wrap_text(draw, text, font, max_width)
+
+        cold_ms = timed(cold)
+        warm_ms = timed(lambda: _wrap_text(draw, text, font, max_width))
+        print(
+            f"[Knight_Quiz] {len(text.split())} کلمه: قدیمی {old_ms:.2f}ms | "
+            f"کش سرد {cold_ms:.2f}ms | کش گرم {warm_ms:.3f}ms"
+        )
+
+    render_ms = timed(lambda: _render_question_only_image_bytes(questions[1]))
+    print(f"[Knight_Quiz] رندر کامل سوال بلند: {render_ms:.1f}ms | کش اندازه‌ها: {TEXT_MEASURER.stats_line()}")
+    print(f"[Knight_Quiz] encode تصویرها ({IMAGE_FORMAT}): {ENCODE_STATS.stats_line()}")
+
+
 def main():
-    bot.run(TOKEN)
+    # python bot.py --bench-render [n] : میکروبنچمارک شکستن خط و رندر
+    if len(sys.argv) >= 2 and sys.argv[1] == "--bench-render":
+        bench_render(int(sys.argv[2]) if len(sys.argv) >= 3 else 50)
+        return
+
+    # python bot.py --build-bank [n] : ساخت/پر کردن بانک سوال بدون اجرای بات
+    if len(sys.argv) >= 2 and sys.argv[1] == "--build-bank":
+        target = int(sys.argv[2]) if len(sys.argv) >= 3 else 500
+        warm_up_argos()
+        if ARGOS_STATE != "ready":
+            print("[Knight_Quiz] مترجم en→fa آماده نیست؛ بانک سوال ساخته نمی‌شود.")
+            return
+
+        async def build():
+            try:
+                return await build_question_bank(target, max_rounds=max(10, target // 20))
+            finally:
+                await close_http_session()
+
+        added = asyncio.run(build())
+        print(f"[Knight_Quiz] {added} سوال جدید به بانک اضافه شد (کل: {QUESTION_BANK.count()}).")
+        return
+
+    if not TOKEN or TOKEN == "YOUR_DISCORD_BOT_TOKEN_HERE":
+        raise RuntimeError("❌ لطفاً توکن واقعی بات را داخل فایل .env در متغیر DISCORD_BOT_TOKEN قرار بده.")
+
+    discord.utils.setup_logging()
+    asyncio.run(run_bot())
 
 
 if __name__ == "__main__":